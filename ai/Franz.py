@@ -14,8 +14,8 @@ __description__ = "Tries to be reasonable but will probably lose to a Serbian in
 
 
 class Franz(AIBase):
-    def __init__(self, room, seat):
-        super(Franz, self).__init__(room, seat, self.identity)  # Call to parent init
+    def __init__(self, room, seat, ns=None):
+        super(Franz, self).__init__(room, seat, self.identity, ns)  # Call to parent init
         self.start() # Blocks
 
     def bid(self):
@@ -53,10 +53,7 @@ class Franz(AIBase):
     def play(self):
         """Overriding base class play."""
         # Figure out what plays are allowed.
-        legal_cards = []
-        for c in self.hand:
-            if self.is_legal_play(c):
-                legal_cards.append(c)
+        legal_cards = self.legal_plays()
         log.debug(self.label + 'to play from choices: ' + str(legal_cards))
         
         #TODO implement real play logic
@@ -55,7 +55,7 @@ __description__ = "Goofus will make decisions at a very basic level when playing
 
 
 class Goofus(AIBase):
-    def __init__(self, room, seat):
+    def __init__(self, room, seat, ns=None):
         """Initialize AI agent. Blocks thread.
 
         All agents *must* include a super() call like below, and must have
@@ -64,11 +64,15 @@ class Goofus(AIBase):
         Args:
           room (int): Target room number.
           seat (int): Target seat number within room.
-          bidSuit (int): Suit on which bid was made this hand
+          ns (LocalNamespace, optional): In-process namespace; see AIBase.
 
         """
-        super(Goofus, self).__init__(room, seat, self.identity)
+        super(Goofus, self).__init__(room, seat, self.identity, ns)
         self.start()  # Blocks thread
+
+    def reset(self, seat):
+        """Extending base class reset, to forget the bid suit and plays."""
+        super(Goofus, self).reset(seat)
         self.bidSuit = None
         self.legalPlays = []
 
@@ -116,7 +120,7 @@ class Goofus(AIBase):
         """Overriding base class play."""
 
         # Determine the set of legal plays. Goofus ignores everything else.
-        self.legalPlays = filter(lambda c: self.is_legal_play(c), self.hand)
+        self.legalPlays = self.legal_plays()
 
         # Short circuit if there's only one legal play
         if len(self.legalPlays) == 1:
@@ -223,42 +227,6 @@ class Goofus(AIBase):
     Helper methods used in conditions, rules processing, or elsewhere.
     """
 
-    def whoWinsTrick(self, cards, gs=None): # Shamelessly copied from HAL. Things like this might ultimately go in AI base, I would think.
-        """Return the card that wins the trick.
-
-        `cards[0]` must be the card led.
-
-        This method is largely copied from core.gamestate.
-
-        Args:
-          cards (list): Card objects representing the trick, in player order
-            starting with whoever led. Indeed, this variable name creates a
-            namespace conflict with the cards module, but this method doesn't
-            use that module.
-          gs (GameState, default=self.gs): GameState used to make decision.
-
-        Returns:
-          Card: The Card object that wins the trick.
-
-        """
-        if gs is None:
-            gs = self.gs
-
-        # Determine which suit wins the trick
-        if self.gs.trump in map(lambda x: x.suit, cards):
-            winning_suit = self.gs.trump
-        else:
-            winning_suit = cards[0].suit
-
-        # Find the winning card and determine who played it
-        current_highest_card_rank = 0
-        for card in cards:
-            if card.suit == winning_suit:
-                if card.rank > current_highest_card_rank:
-                    current_highest_card_rank = card.rank
-                    current_highest_card = card
-        return current_highest_card
-
     def isThisWinner(self, card):
         return self.whoWinsTrick(self.gs.cardsInPlay + [card]) == card
 
@@ -43,12 +43,11 @@ Public classes:
 
 import math
 
-from collections import defaultdict
-
 import core.cards as cards
+import core.tricks as tricks
 
 # Import base class for AI agent
-from ai.base import AIBase, log
+from ai.base import AIBase, log, NUM_PLAYERS
 
 AI_CLASS = "HAL"  # Set this to match the class name for the agent
 __author__ = "Mike"
@@ -60,7 +59,7 @@ __description__ = "I would like to play a game."
 
 
 class HAL(AIBase):
-    def __init__(self, room, seat):
+    def __init__(self, room, seat, ns=None):
         """Initialize AI agent. Blocks thread.
 
         All agents *must* include a super() call like below, and must have
@@ -69,26 +68,17 @@ class HAL(AIBase):
         Args:
           room (int): Target room number.
           seat (int): Target seat number within room.
+          ns (LocalNamespace, optional): In-process namespace; see AIBase.
 
         """
-        super(HAL, self).__init__(room, seat, self.identity)
-
-        self.trackedPlays = defaultdict(list)
-        self.targetTrump = None
+        super(HAL, self).__init__(room, seat, self.identity, ns)
 
         self.start()  # Blocks thread
 
-    def applyUpdate(self, msg):
-        """Overriding base clase applyUpdate to better monitor game actions."""
-        super(HAL, self).applyUpdate(msg)
-
-        if 'addC' in msg:
-            # New hand, so clear tracked plays
-            self.trackedPlays = defaultdict(list)
-
-        if 'playC' in msg:
-            # Want to keep track of who plays what during a hand
-            self.trackedPlays[msg['actor']].append(cards.Card(msg['playC']))
+    def reset(self, seat):
+        """Extending base class reset, to forget the target trump suit."""
+        super(HAL, self).reset(seat)
+        self.targetTrump = None
 
     def bid(self):
         """Overriding base class bid.
@@ -139,7 +129,7 @@ class HAL(AIBase):
         """
         # If I'm leading the hand, then lead with targetTrump, determined
         # during bidding.
-        if len(self.gs.cardsInPlay) == 0 and len(self.gs.takenCards) == 0:
+        if self.gs.tracker.seen == 0:
             c = self.determinePlayOnHandLead()
         else:
             c = self.determinePlay()
@@ -158,7 +148,7 @@ class HAL(AIBase):
             # Ideal bid was to pass, so lead with most populous suit
             suit_count = dict()
             map(lambda s: suit_count.__setitem__(
-                s, len(filter(lambda x: x.suit == s), self.hand)),
+                s, len(filter(lambda x: x.suit == s, self.hand))),
                 cards.SUITS)
             self.targetTrump = max(
                 suit_count.items(), key=lambda x: suit_count[x[0]])[0]
@@ -168,7 +158,7 @@ class HAL(AIBase):
 
     def determinePlay(self):
         """Return play for when I am not leading the hand."""
-        legalCards = filter(self.is_legal_play, self.hand)
+        legalCards = self.legal_plays()
 
         # Sort by descending rank
         legalCards.sort(key=lambda x: x.rank, reverse=True)
@@ -262,8 +252,8 @@ class HAL(AIBase):
                        c.rank < partnerCard.rank:
                         continue
                     else:
-                        waysToLose = self.getUnseenCardCodesThatWinTrick(
-                            [partnerCard, oppCard, c])
+                        waysToLose = len(self.getUnseenCardCodesThatWinTrick(
+                            [partnerCard, oppCard, c]))
                         options.append((c, waysToLose))
 
                 if len(options) == 0:
@@ -303,37 +293,18 @@ class HAL(AIBase):
           boolean: True if myCard beats theirCard, False otherwise.
 
         """
-        mySuit = myCard.suit
-        theirSuit = theirCard.suit
-
-        if theirSuit == self.gs.trump:
-            if mySuit == self.gs.trump:
-                return myCard.rank > theirCard.rank
-            else:
-                return False
-        elif mySuit == self.gs.trump:
-            return True
-        else:
-            # Neither played trump
-            if theirSuit == suitLed:
-                if mySuit == suitLed:
-                    return myCard.rank > theirCard.rank
-                else:
-                    return False
-            else:
-                if mySuit == suitLed:
-                    return True
-                else:
-                    return False
+        return tricks.beats(self.gs.trump, suitLed, myCard.code,
+                            theirCard.code)
 
     def getUnseenCardCodesThatWinTrick(self, trickCards):
         """Return list of card codes that would win a trick, given 3 cards.
 
-        This makes use of the tracked cards and cards in my hand, targeting
-        only cards that I have not seen.
+        This makes use of the card tracker, targeting only cards that I have
+        not seen and that the last player to act could still hold.
 
-        A card must be trump or a higher-rank of the led suit (if trump
-        not led), or a higher-rank trump if trump was led.
+        A card must be a higher-rank trump than any trump in the trick, or,
+        if there is no trump in the trick, trump or a higher-rank card of the
+        led suit.
 
         Args:
           trickCards (list): Card objects. The first must be the led card.
@@ -342,68 +313,18 @@ class HAL(AIBase):
           list: Card codes that would win the trick.
 
         """
-        trumpLed = True if trickCards[0].suit == self.gs.trump else False
-        winners = []
-        if trumpLed:
-            topTrump = max(filter(lambda x: x.suit == self.gs.trump,
-                                  trickCards), key=lambda x: x.rank)
-            winningRanks = filter(lambda x: x > topTrump.rank, cards.RANKS)
-            winners = map(lambda x: cards.RS_TO_CODE[(x, self.gs.trump)],
-                          winningRanks)
+        trump = self.gs.trump
+        ledSuit = trickCards[0].suit
+        topTrump = max([x.code for x in trickCards if x.suit == trump] or [0])
+        if topTrump:
+            winners = cards.SUIT_MASKS[trump] & ~((1 << topTrump) - 1)
         else:
-            # Start with all trump cards
-            winners = map(lambda x: cards.RS_TO_CODE[(x, self.gs.trump)],
-                          cards.RANKS)
+            topLed = max(x.code for x in trickCards if x.suit == ledSuit)
+            winners = cards.SUIT_MASKS[trump] | (
+                cards.SUIT_MASKS[ledSuit] & ~((1 << topLed) - 1))
 
-            topLed = max(filter(lambda x: x.suit == trickCards[0].suit,
-                                trickCards), key=lambda x: x.rank)
-            winningRanks = filter(lambda x: x > topLed.rank, cards.RANKS)
-            winners.extend(list(map(
-                lambda x: cards.RS_TO_CODE[(x, trickCards[0].suit)],
-                winningRanks)))
-
-        # Filter out seen card codes
-        allTrackedPlays = []
-        map(lambda x: allTrackedPlays.extend(self.trackedPlays[x]),
-            self.trackedPlays)
-        trackedCodes = map(lambda x: x.code, allTrackedPlays)
-        return filter(lambda x: x in trackedCodes, winners)
-
-    def whoWinsTrick(self, cards, gs=None):
-        """Return the card that wins the trick.
-
-        `cards[0]` must be the card led.
-
-        This method is largely copied from core.gamestate.
-
-        Args:
-          cards (list): Card objects representing the trick, in player order
-            starting with whoever led. Indeed, this variable name creates a
-            namespace conflict with the cards module, but this method doesn't
-            use that module.
-          gs (GameState, default=self.gs): GameState used to make decision.
-
-        Returns:
-          Card: The Card object that wins the trick.
-
-        """
-        if gs is None:
-            gs = self.gs
-
-        # Determine which suit wins the trick
-        if self.gs.trump in map(lambda x: x.suit, cards):
-            winning_suit = self.gs.trump
-        else:
-            winning_suit = cards[0].suit
-
-        # Find the winning card and determine who played it
-        current_highest_card_rank = 0
-        for card in cards:
-            if card.suit == winning_suit:
-                if card.rank > current_highest_card_rank:
-                    current_highest_card_rank = card.rank
-                    current_highest_card = card
-        return current_highest_card
+        lastSeat = (self.pNum + 1) % NUM_PLAYERS
+        return cards.from_mask(winners & self.gs.tracker.possibleFor(lastSeat))
 
     def predictPointsFromHandBySuit(self, suit):
         """Predict the number of points the AI could take based on own hand.
@@ -41,7 +41,7 @@ __description__ = "Always bid at least two? Shoot man, I ain't bidding higher th
 
 
 class JoeLowbid(AIBase):
-    def __init__(self, room, seat):
+    def __init__(self, room, seat, ns=None):
         """Initialize AI agent. Blocks thread.
 
         All agents *must* include a super() call like below, and must have
@@ -50,9 +50,10 @@ class JoeLowbid(AIBase):
         Args:
           room (int): Target room number.
           seat (int): Target seat number within room.
+          ns (LocalNamespace, optional): In-process namespace; see AIBase.
 
         """
-        super(JoeLowbid, self).__init__(room, seat, self.identity)
+        super(JoeLowbid, self).__init__(room, seat, self.identity, ns)
         self.start()  # Blocks thread
 
     def bid(self):
@@ -74,10 +75,7 @@ class JoeLowbid(AIBase):
 
         """
         # log.debug("{0} is playing...".format(self.label))
-        legal_cards = []
-        for c in self.hand:
-            if self.is_legal_play(c):
-                legal_cards.append(c)
+        legal_cards = self.legal_plays()
         chosen_card_pos = random.randint(0, len(legal_cards)-1)
         # log.debug(str(legal_cards))
         chosen_card = legal_cards[chosen_card_pos]
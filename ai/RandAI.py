@@ -43,7 +43,7 @@ __description__ = "Pseudo randomness at its best."
 
 
 class Rand(AIBase):
-    def __init__(self, room, seat):
+    def __init__(self, room, seat, ns=None):
         """Initialize AI agent. Blocks thread.
 
         All agents *must* include a super() call like below, and must have
@@ -52,9 +52,10 @@ class Rand(AIBase):
         Args:
           room (int): Target room number.
           seat (int): Target seat number within room.
+          ns (LocalNamespace, optional): In-process namespace; see AIBase.
 
         """
-        super(Rand, self).__init__(room, seat, self.identity)
+        super(Rand, self).__init__(room, seat, self.identity, ns)
         self.start()  # Blocks thread
 
     def bid(self):
@@ -80,10 +81,7 @@ class Rand(AIBase):
 
         """
         # log.debug("{0} is playing...".format(self.label))
-        legal_cards = []
-        for c in self.hand:
-            if self.is_legal_play(c):
-                legal_cards.append(c)
+        legal_cards = self.legal_plays()
         chosen_card_pos = random.randint(0, len(legal_cards)-1)
         # log.debug(str(legal_cards))
         chosen_card = legal_cards[chosen_card_pos]
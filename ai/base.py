@@ -7,7 +7,17 @@ models, including socketio communications, game state management, and bid/play
 legality checking. This should leave AI subclass designers free to focus on the
 actual gameplay intelligence.
 
-TODO fix bug that allows AI to make play that is called illegal by server
+Every bid, play and think is timed, and its latency recorded in the shared
+metrics registry (see web.metrics) under `ai.<agent name>.<bid|play|think>`,
+so the slowest model at a table is easy to spot. Bids and plays must also fit
+within the agent's time budget. A decision that runs over is interrupted, and
+the lowest legal bid or card is sent in its place, so a slow agent can never
+stall its table. Interrupting needs SIGALRM, which only the main thread of a
+process can use (greenlets included). Agents on other threads are timed, and
+their overruns logged, but they are not interrupted. The alarm is shared by
+the whole process, so it only interrupts the greenlet that is deciding; a
+decision must not yield to other greenlets (by waiting on a socket, say).
+
 TODO add handler for 'win' message to allow for post-mortem analysis
 TODO monitor log when multi-AI games end; used to get 'exit' message race
   condition so was using sleep() during stop(), but have removed
@@ -18,9 +28,15 @@ Attributes:
   NUM_PLAYERS (int): Hardcoded player count, made available for AI models.
   BID (int): Mode number for bidding.
   PLAY (int): Mode number for playing.
+  DECISION_BUDGET (float): Default seconds allowed per bid or play.
+  JOIN_TIMEOUT (float): Seconds an agent waits for the server to answer a
+    request to join a room.
 
 Public classes:
+  DecisionTimeout: Raised inside a bid or play that ran over budget.
+  CardTracker: Cards seen this hand, and what they reveal about other hands.
   GS: Generic object for managing game states.
+  LocalNamespace: Socket-free stand-in for the agent's socketio namespace.
   AIBase: Base class for AI models to extend/inherit.
 
 """
@@ -33,16 +49,82 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import signal
+import time
 from collections import defaultdict
+import gevent
 from socketIO_client import SocketIO, BaseNamespace
 
 import core.cards as cards
+import core.moves as moves
+import core.tricks as tricks
 from common import SOCKETIO_PORT, SOCKETIO_NS
+from web.metrics import registry as metrics
 
 NUM_TEAMS = 2
 NUM_PLAYERS = 4
 BID = 2
 PLAY = 1
+DECISION_BUDGET = 2.0
+JOIN_TIMEOUT = 10.0
+
+
+class DecisionTimeout(BaseException):
+    """Raised inside a bid or play that ran over budget.
+
+    Like KeyboardInterrupt and gevent's Timeout, this derives from
+    BaseException, so an agent's `except Exception` can't swallow it.
+
+    """
+
+
+# Greenlet to interrupt when the alarm goes off, and the SIGALRM handler to
+# restore afterwards
+_alarm = dict(owner=None, previous=None)
+_ALARM_RETRY = 0.01
+
+def _on_alarm(signum, frame):
+    """Interrupt the decision in progress, once.
+
+    If another greenlet is running, the alarm is left for it and tried again
+    shortly, once the decision may have resumed.
+
+    """
+    if _alarm['owner'] is None:
+        return
+    if gevent.getcurrent() is not _alarm['owner']:
+        signal.setitimer(signal.ITIMER_REAL, _ALARM_RETRY)
+        return
+    _alarm['owner'] = None
+    raise DecisionTimeout()
+
+def _arm_alarm(seconds):
+    """Raise DecisionTimeout in this greenlet after `seconds`, if possible.
+
+    The alarm can't be used off the main thread, or without SIGALRM.
+
+    """
+    if seconds is None or not hasattr(signal, 'setitimer'):
+        return
+    try:
+        _alarm['previous'] = signal.signal(signal.SIGALRM, _on_alarm)
+    except ValueError:  # Signals only work in the main thread
+        return
+    _alarm['owner'] = gevent.getcurrent()
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+def _disarm_alarm():
+    """Cancel the alarm set by _arm_alarm, if any, and restore the handler.
+
+    The alarm can go off before the first line here has run, so a caller
+    that catches the DecisionTimeout should call this again.
+
+    """
+    _alarm['owner'] = None  # From here on, the alarm raises nothing
+    previous, _alarm['previous'] = _alarm['previous'], None
+    if previous is not None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
 
 
 class GS(object):
@@ -70,9 +152,125 @@ class GS(object):
         self.cardsInPlay = list()
         self.bidLog = dict()
         self.takenCards = defaultdict(list)
+        self.tracker = CardTracker()
         self.highBid = -1
 
 
+class CardTracker(object):
+    """Cards seen this hand, and what they reveal about other hands.
+
+    AIBase keeps one tracker per hand in its GS, updated as each card is
+    played, so agents needn't count cards themselves. All sets of cards are
+    bitmasks (see core.cards), so every query is a few bit operations.
+
+    A player who neither follows suit nor plays trump can't hold the suit
+    led (see core.moves), so they are marked void in it for the rest of the
+    hand.
+
+    Attributes:
+      mine (int): Bitmask of the agent's own cards, as dealt.
+      seen (int): Bitmask of cards played this hand.
+      playedBy (list): Bitmask of the cards each seat has played this hand.
+      voids (list): Bitmask of the suits each seat is known to be void in,
+        holding every card of those suits.
+      remaining (int): Bitmask of cards that may be in other players' hands:
+        those neither played nor dealt to the agent.
+
+    """
+    def __init__(self):
+        """Create a tracker for a new hand, with no cards seen."""
+        self.mine = 0
+        self.seen = 0
+        self.playedBy = [0] * NUM_PLAYERS
+        self.voids = [0] * NUM_PLAYERS
+        self.remaining = cards.FULL_MASK
+
+    def __repr__(self):
+        """Return string listing the cards seen and the known voids."""
+        return "seen {0}, voids {1}".format(
+            cards.from_mask(self.seen),
+            [[s for s in cards.SUITS if self.isVoid(p, s)]
+             for p in range(NUM_PLAYERS)])
+
+    def deal(self, codes):
+        """Note the agent's own hand, as dealt.
+
+        Args:
+          codes (list): Card codes dealt to the agent.
+
+        """
+        self.mine = cards.to_mask(codes)
+        self.remaining &= ~self.mine
+
+    def play(self, seat, code, ledSuit, trump):
+        """Note a card played, and any void it reveals.
+
+        Args:
+          seat (int): Seat of the player.
+          code (int): Code of the card played.
+          ledSuit (int): Suit led this trick; the card's own suit if led.
+          trump (int): Trump suit, or None if not yet declared.
+
+        """
+        bit = cards.card_bit(code)
+        self.seen |= bit
+        self.playedBy[seat] |= bit
+        self.remaining &= ~bit
+
+        suit = cards.CODE_TO_RS[code][1]
+        if suit != ledSuit and suit != trump:
+            self.voids[seat] |= cards.SUIT_MASKS[ledSuit]
+
+    def isSeen(self, code):
+        """Return True if a card has been played this hand."""
+        return bool(self.seen & cards.card_bit(code))
+
+    def isVoid(self, seat, suit):
+        """Return True if a seat is known to hold no cards of a suit."""
+        return bool(self.voids[seat] & cards.SUIT_MASKS[suit])
+
+    def couldHold(self, seat, code):
+        """Return True if a card may still be in another seat's hand."""
+        return bool(self.possibleFor(seat) & cards.card_bit(code))
+
+    def possibleFor(self, seat):
+        """Return bitmask of the remaining cards a seat may hold."""
+        return self.remaining & ~self.voids[seat]
+
+    def remainingIn(self, suit):
+        """Return bitmask of the remaining cards of a suit."""
+        return self.remaining & cards.SUIT_MASKS[suit]
+
+
+class LocalNamespace(object):
+    """Stand-in for the socketio namespace used by in-process agents.
+
+    Agents talk to the server exclusively through `self.ns.emit`. When an agent
+    is hosted in-process (e.g. by the headless simulator), a LocalNamespace is
+    given to the agent in place of a socket. Every emit is handed to `handler`
+    along with the agent's seat, and the host decides what to do with it.
+
+    Attributes:
+      seat (int): Seat number of the agent using this namespace.
+      handler (function): Called as `handler(seat, event, *args)` on emit.
+
+    """
+    def __init__(self, seat, handler):
+        """Initialize namespace for the agent in the given seat.
+
+        Args:
+          seat (int): Seat number of the agent.
+          handler (function): Receiver for events emitted by the agent.
+
+        """
+        self.seat = seat
+        self.handler = handler
+
+    def emit(self, event, *args):
+        """Pass an emitted event and its args to the handler."""
+        self.handler(self.seat, event, *args)
+
+
 class AIBase(object):
     """Common features of all Cinch AI Agents.
 
@@ -90,18 +288,25 @@ class AIBase(object):
       name (str): The agent's name as identified in the model module.
       label (str): The label used to identify the agent in logs.
       socket (SocketIO): The socketio connection used to communicate with the
-        main server.
-      ns (BaseNamespace): The namespace used by the socket.
+        main server. This is None for agents hosted in-process.
+      ns (BaseNamespace or LocalNamespace): The namespace used by the socket,
+        or the in-process namespace provided by the agent's host.
+      budget (float): Seconds allowed per bid or play; None for no limit.
+        Models may override this class attribute.
 
     """
+    budget = DECISION_BUDGET
+
     # ===============
     # Agent Management & Communications
     # ===============
-    def __init__(self, targetRoom, targetSeat, ident):
+    def __init__(self, targetRoom, targetSeat, ident, ns=None):
         """Initialize AI.
 
         The AI agent connects to the server, joins a game, and prepares to
-        receive game data.
+        receive game data. If a namespace is provided, no socket is opened;
+        the agent is assumed to already be seated by its in-process host, which
+        delivers game messages straight to `handle_game_action`.
 
         Args:
           targetRoom (int): Target game room number.
@@ -109,42 +314,130 @@ class AIBase(object):
           ident (dict): AI identifying info, including data like version number
             and AI description. This is provided from the AI model module via
             the manager.
+          ns (LocalNamespace, optional): In-process namespace to use instead
+            of a socket connection.
 
         """
-        self.room = None
-        self.pNum = None
-        self.hand = []
-        self.gs = GS()
         self.name = ident['name']
-        self.label = self.name + "_" + str(targetSeat)
+        self.reset(targetSeat)
 
-        self.setupSocket()
-        self.ns.emit('nickname', self.label)
-        self.join(targetRoom, targetSeat)
-        self.pNum = targetSeat
+        if ns is None:
+            self.connect(targetRoom, targetSeat)
+        else:
+            self.socket = None
+            self.ns = ns
+            self.room = targetRoom
 
     def __del__(self):
         """Cleanly shutdown AI agent."""
         self.stop()
 
+    def reset(self, seat):
+        """Clear all game state, ready for a new game in the given seat.
+
+        The AI manager reuses agents from one game to the next (see
+        ai.manager.AgentRoster). Subclasses that keep state of their own
+        should extend this to clear it. It is also called by __init__,
+        before the agent joins its first game, so it is where that state
+        should be created.
+
+        Args:
+          seat (int): Seat the agent will take in the new game.
+
+        """
+        self.room = None
+        self.pNum = seat
+        self.hand = []
+        self.gs = GS()
+        self.label = self.name + "_" + str(seat)
+        self._deciding = False
+        self._chosen = None
+        self.joinReply = None
+
+    def connect(self, room, seat):
+        """Open a socket connection, then join a room and seat.
+
+        This waits up to JOIN_TIMEOUT for the server to answer the join. A
+        sharded server's lobby (see web.shard) answers with the `port` of
+        the process hosting the room instead; the agent then reconnects to
+        that port and joins again, once. If the agent isn't seated in the
+        end, its socket is closed, so `start` returns at once.
+
+        Args:
+          room (int): Target room number.
+          seat (int): Target seat number.
+
+        Returns:
+          bool: True if the agent was seated.
+
+        """
+        port = SOCKETIO_PORT
+        while True:
+            self.joinReply = None
+            self.setupSocket(port)
+            self.ns.emit('nickname', self.label)
+            self.join(room, seat)
+            self.socket.wait_for_callbacks(seconds=JOIN_TIMEOUT)
+
+            reply = self.joinReply
+            if reply is None or 'port' not in reply or port != SOCKETIO_PORT:
+                break
+            self.socket.disconnect()  # Redirected to the room's own process
+            port = reply['port']
+
+        if reply is None or 'port' in reply:
+            log.error("{0} failed to join Room {1} Seat {2}".format(
+                self.label, room, seat))
+            self.stop()
+            self.socket = None
+            return False
+        return True
+
+    def playGame(self, room, seat, timeout=None):
+        """Reset, then connect and play one game in a room. Blocks thread.
+
+        However the game ends, the agent is disconnected when this returns.
+
+        Args:
+          room (int): Target room number.
+          seat (int): Target seat number.
+          timeout (float, optional): Most seconds to spend on the game. The
+            agent leaves a game that is still going after that.
+
+        """
+        self.reset(seat)
+        try:
+            self.connect(room, seat)
+            self.start(timeout)  # Blocks until game over
+            if self.socket is not None and self.socket.connected:
+                log.warning("{0} leaving Room {1}; game took over {2} "
+                            "seconds".format(self.label, room, timeout))
+        finally:
+            self.stop()
+
     def ackJoin(self, *args):
         """Callback for request to join room.
 
+        The reply is kept in `joinReply` for `connect`, which acts on
+        failures and redirects once the callback has returned.
+
         Args:
           *args (list): Confirmation data after joining room. If successful,
             this will be a 1-element list with a dict containing `roomNum`,
             `seatChart`, and `mySeat` keys. Otherwise, it will be an empty list
-            because the request resulted in an error.
+            because the request resulted in an error. A sharded server's
+            lobby (see web.shard) instead answers with `roomNum` and the
+            `port` of the process hosting the room.
 
         """
         if len(args) == 0:
             # The agent will receive an 'err' event in this case.
-            # TODO: look into intelligently handling this kind of error and
-            # ensure it is not possible to sit in a bad seat.
-            self.stop()
             return
 
-        data = args[0]
+        data = self.joinReply = args[0]
+        if 'port' in data:
+            return
+
         self.room = data['roomNum']
 
         if self.room != 0:  # Joining the lobby doesn't warrant any action
@@ -190,16 +483,74 @@ class AIBase(object):
             return
 
         if self.gs.activePlayer == self.pNum:
-            if self.gs.mode == BID:
-                self.bid()
-            else:
-                self.play()
+            self.decide(self.gs.mode)
         else:
-            self.think()
+            metrics.timed('ai.{0}.think'.format(self.name), self.think)
+
+    def decide(self, mode):
+        """Call `bid` or `play` within the time budget, then send the move.
+
+        While the agent decides, its send_bid or send_play call is held
+        back, and sent once the decision returns or is interrupted. If the
+        agent hasn't chosen a move by then, the lowest legal bid or card is
+        sent instead (see `fallback`). The interrupt only lands in this
+        greenlet, so `bid` and `play` must not yield to others.
+
+        Args:
+          mode (int): BID or PLAY.
+
+        """
+        kind = 'bid' if mode == BID else 'play'
+        self._chosen = None
+        self._deciding = True
+        start = time.time()
+        try:
+            try:
+                _arm_alarm(self.budget)
+                if mode == BID:
+                    self.bid()
+                else:
+                    self.play()
+            finally:
+                _disarm_alarm()
+        except DecisionTimeout:
+            _disarm_alarm()  # In case it went off during the first
+        finally:
+            self._deciding = False
+            elapsed = (time.time() - start) * 1000
+            metrics.record('ai.{0}.{1}'.format(self.name, kind), elapsed)
+
+        if self.budget is not None and elapsed > self.budget * 1000:
+            metrics.record('ai.{0}.overrun'.format(self.name), elapsed)
+            log.warning("{0} took {1:.0f} ms to {2}; budget is {3:.0f} "
+                        "ms".format(self.label, elapsed, kind,
+                                    self.budget * 1000))
+
+        if self._chosen is None:
+            self._chosen = self.fallback(mode)
+        send, move = self._chosen
+        send(move)
+
+    def fallback(self, mode):
+        """Return the (send method, move) to use if no move was chosen.
+
+        This is the lowest legal bid or the lowest-ranked legal card.
+
+        """
+        log.warning("{0} made no {1}; using fallback".format(
+            self.label, 'bid' if mode == BID else 'play'))
+        if mode == BID:
+            return self.send_bid, self.legal_bids()[0]
+        return self.send_play, min(self.legal_plays(), key=lambda c: c.rank)
+
+    def setupSocket(self, port=SOCKETIO_PORT):
+        """Create socket connection and configure namespace.
+
+        Args:
+          port (int, optional): Server port to connect to.
 
-    def setupSocket(self):
-        """Create socket connection and configure namespace."""
-        self.socket = SocketIO('127.0.0.1', SOCKETIO_PORT)
+        """
+        self.socket = SocketIO('127.0.0.1', port)
         self.ns = self.socket.define(BaseNamespace, SOCKETIO_NS)
 
         self.ns.on('err',       self.on_err)
@@ -222,6 +573,11 @@ class AIBase(object):
 
         if 'playC' in msg:
             self.gs.cardsInPlay.append(cards.Card(msg['playC']))
+            # Trump is unset or stale on a hand's lead, but a lead's suit
+            # is the suit led, so the tracker doesn't need it there
+            self.gs.tracker.play(msg['actor'], msg['playC'],
+                                 self.gs.cardsInPlay[0].suit,
+                                 getattr(self.gs, 'trump', None))
 
         if 'sco' in msg:
             self.gs.score = msg['sco']
@@ -242,6 +598,7 @@ class AIBase(object):
         if 'addC' in msg:
             self.hand = [cards.Card(num) for num in msg['addC']]
             self.gs.reset()
+            self.gs.tracker.deal(msg['addC'])
 
         if 'trp' in msg:
             self.gs.trump = msg['trp']
@@ -267,13 +624,26 @@ class AIBase(object):
         """
         self.ns.emit('join', room, seat, self.ackJoin)
 
-    def start(self):
-        """Activate AI."""
-        self.socket.wait()  # Blocks until self.stop()
+    def start(self, seconds=None):
+        """Activate AI.
+
+        In-process agents, and agents that failed to join, have no socket to
+        wait on, so this returns at once.
+
+        Args:
+          seconds (float, optional): Most seconds to wait for the game to
+            end. By default, wait as long as it takes.
+
+        """
+        if self.socket is not None:
+            self.socket.wait(seconds)  # Blocks until self.stop()
 
     def stop(self):
-        """Gracefully shutdown AI agent."""
-        self.socket.disconnect()
+        """Gracefully shutdown AI agent. Safe to call more than once."""
+        socket = getattr(self, 'socket', None)  # May be half-built
+        # Disconnecting again would open a new connection first
+        if socket is not None and socket.connected:
+            socket.disconnect()
 
         # TODO do any final cleanup (logging, etc)
 
@@ -291,6 +661,10 @@ class AIBase(object):
           bid (int): Bid amount (0-5, where PASS = 0)
 
         """
+        if self._deciding:  # Sent by decide() once the decision returns
+            self._chosen = (self.send_bid, bid)
+            return
+
         if self.is_legal_bid(bid):
             pass
         elif bid == 0:  # Illegally tried to pass (stuck dealer)
@@ -330,12 +704,45 @@ class AIBase(object):
             for play legality by the caller.
 
         """
+        if self._deciding:  # Sent by decide() once the decision returns
+            self._chosen = (self.send_play, card)
+            return
+
         card_val = card.code
         self.ns.emit('play', card_val)
 
         log.info("{0} plays {1}".format(self.label, str(card)))
         self.hand.remove(card)
 
+    def legal_bids(self):
+        """Return list of legal bids for this agent, ascending.
+
+        Uses the same generator as the server (core.moves), so the server
+        never rejects a bid chosen from this list.
+
+        """
+        return moves.legal_bids(self.gs.highBid, self.pNum == self.gs.dealer)
+
+    def legal_plays(self):
+        """Return list of the cards in hand that are legal to play.
+
+        Uses the same generator as the server (core.moves), so the server
+        never rejects a card chosen from this list.
+
+        """
+        return moves.legal_plays(self.hand, *self.trick_suits())
+
+    def trick_suits(self):
+        """Return (suit led, trump) for the current trick.
+
+        Both are None when leading; trump isn't known until the first lead
+        of the hand.
+
+        """
+        if len(self.gs.cardsInPlay) == 0:
+            return None, None
+        return self.gs.cardsInPlay[0].suit, self.gs.trump
+
     def is_legal_bid(self, bid):
         """Check if proposed bid is legal. Return boolean.
 
@@ -343,41 +750,40 @@ class AIBase(object):
           bid (int): Bid value (0=PASS, 5=CINCH).
 
         """
-        if bid == 0:
-            if self.pNum == self.gs.dealer and self.gs.highBid < 1:
-                return False  # Stuck dealer, must not pass
-            else:
-                return True  # Always legal to pass otherwise
-        elif bid < 0 or bid > 5:
-            return False  # Bid out of bounds
-        elif bid > self.gs.highBid:
-            return True
-        elif bid == 5 and self.pNum == self.gs.dealer:
-            return True
-        else:
-            return False
+        return bid in self.legal_bids()
 
     def is_legal_play(self, card):
         """Check if proposed play is legal. Return boolean.
 
+        The card is checked as though it were in hand, so this can be used to
+        ask about cards the agent doesn't hold.
+
         card (Card): Proposed play.
 
         """
-        if len(self.gs.cardsInPlay) == 0:
-            return True  # No restriction on what can be led
+        hand_mask = cards.cards_to_mask(self.hand) | cards.card_bit(card.code)
+        legal = moves.legal_play_mask(hand_mask, *self.trick_suits())
+        return bool(legal & cards.card_bit(card.code))
 
-        if card.suit == self.gs.trump:
-            return True  # Trump is always OK
-        else:
-            led = self.gs.cardsInPlay[0].suit
-            if card.suit == led:
-                return True  # Followed suit
-            else:
-                for c in self.hand:
-                    if led == c.suit:
-                        return False  # Could've followed suit but didn't
-
-                return True  # Throwing off
+    def whoWinsTrick(self, trick, gs=None):
+        """Return the card that wins the trick.
+
+        `trick[0]` must be the card led. This uses the same lookup tables as
+        the server (core.tricks), so agents and server always agree.
+
+        Args:
+          trick (list): Card objects representing the trick, in player order
+            starting with whoever led.
+          gs (GS, default=self.gs): Gamestate whose trump is used.
+
+        Returns:
+          Card: The Card object that wins the trick.
+
+        """
+        if gs is None:
+            gs = self.gs
+
+        return tricks.winning_card(gs.trump, trick)
 
     # ===============
     # Intelligence
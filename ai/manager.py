@@ -18,27 +18,46 @@ without changing source code. However, the MODELS_FILE is only read when the
 server (and hence the Manager) is first started, so the available AI models
 cannot be changed without a server restart.
 
-Agents are instantiated on a separate thread and given instructions on what
-room to join. After initializing an AI agent, agents can only communicate via
-the common socketio interface; the Manager does not keep a reference to the
-agent's thread.
-
-FUTURE: If performance is poor, it may be possible to rework to use
-multiprocessing instead of threading. This would circumvent Python's
-interpreter lock and let more CPU cores be used.
+Agents are kept in an AgentRoster and given instructions on what room to
+join. Each agent plays its game on a separate thread and communicates only
+via the common socketio interface. When the game is over, the agent is reset
+and kept for the next game that wants its model. At most MAX_AGENTS agents
+play at once; further requests wait for an agent to finish its game.
+
+Agents can instead be run by an AgentPool: a fixed set of worker processes,
+each hosting many agents. The server seats pooled agents in its rooms (see
+web.server.Room.addBot) and the pool carries game messages to them, and
+their bids and plays back, over pipes. Agents then think outside the
+server's process, so a slow agent can't starve the server or other agents
+of the interpreter lock, and more CPU cores get used. A pooled agent that
+misses its deadline has a legal move sent for it, and a worker that dies is
+replaced.
 
 Attributes:
   log (Logger): Log interface common to all Cinch modules.
   MY_PATH (str): The absolute path of this code file.
   MODELS_FILE (str): The file path of the available AI models text file.
+  AGENT_PROCESSES (int): Default number of AgentPool worker processes.
+  MAX_AGENTS (int): Most agents the AI manager has playing at once.
+  GAME_TIMEOUT (float): Most seconds an AI manager agent spends on a game.
+  AGENT_REPORT_INTERVAL (float): Most seconds between the AI manager's
+    reports of its agent counts to the server.
+  DECISION_DEADLINE (float): Default seconds a pooled agent has to bid or
+    play before a fallback move is sent for it.
 
 Public classes:
+  AgentRoster: Reusable AI agents, with a cap on how many play at once.
   AIManager: Entity for managing AI models.
+  Channel: One end of a pipe carrying pickled messages between processes.
+  AgentPool: Worker processes hosting AI agents for the server.
+  RemoteAgent: Server-side stand-in for an agent hosted by an AgentPool.
 
 Public methods:
   import_module: Given a module name, import and return the module.
   get_ai_models: Use MODELS_FILE to import AI modules.
   set_ai_ident: Set AI.ident for a given module.
+  close_sockets: Close every socket this process has, except one.
+  host_agents: Main loop of an AgentPool worker process.
 
 """
 
@@ -51,14 +70,37 @@ import imp  # Import module functionality
 import sys
 import threading
 import string
-
+from collections import defaultdict, deque
+from Queue import Queue, Empty
+import errno
+import multiprocessing
+import socket
+import stat
+import struct
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import gevent
+import gevent.hub
+from gevent.socket import wait_read, wait_write
 from time import sleep
 from socketIO_client import SocketIO, BaseNamespace
 
+import core.cards as cards
 from common import SOCKETIO_PORT, SOCKETIO_NS
+from ai.base import AIBase, LocalNamespace
+from web.metrics import registry as metrics
 
 MY_PATH = os.path.abspath(os.path.dirname(__file__))
 MODELS_FILE = "available_models.txt"
+AGENT_PROCESSES = 2
+MAX_AGENTS = 64
+GAME_TIMEOUT = 3600.0
+AGENT_REPORT_INTERVAL = 1.0
+DECISION_DEADLINE = 5.0
 
 
 def import_module(module_name):
@@ -135,6 +177,129 @@ def set_ai_ident(mod):
     return
 
 
+class AgentRoster(object):
+    """Reusable AI agents, with a cap on how many play at once.
+
+    Each game an agent is summoned to is played on its own thread. When the
+    game ends, the agent is reset and kept idle for the next summons of its
+    model, or plays the next waiting summons straight away. Agents are
+    created only when no idle agent of the model is available. An agent
+    leaves a game that runs past gameTimeout, and its place at the cap is
+    given back however its game ends.
+
+    Attributes:
+      aiClasses (list): AI classes in model ID order.
+      maxAgents (int): Most agents playing at once.
+      idle (dict): Lists of idle agents, keyed by model ID.
+      busy (int): Number of agents playing a game.
+      waiting (deque): (room, seat, model ID) summons waiting for an agent.
+      created (int): Number of agents created so far.
+      onChange (function): Called with `counts()` whenever they change, on
+        the thread that changed them.
+      gameTimeout (float): Most seconds an agent spends on one game.
+
+    """
+    # Lets agents be created without a socket; see AIBase.__init__
+    _noSocket = LocalNamespace(None, lambda *args: None)
+
+    def __init__(self, aiClasses, maxAgents=MAX_AGENTS, onChange=None,
+                 gameTimeout=GAME_TIMEOUT):
+        """Create an empty roster.
+
+        Args:
+          aiClasses (list): AI classes in model ID order.
+          maxAgents (int, optional): Most agents playing at once.
+          onChange (function, optional): Called with `counts()` whenever
+            they change, on the thread that changed them.
+          gameTimeout (float, optional): Most seconds an agent spends on one
+            game.
+
+        """
+        self.aiClasses = aiClasses
+        self.maxAgents = maxAgents
+        self.idle = defaultdict(list)
+        self.busy = 0
+        self.waiting = deque()
+        self.created = 0
+        self.onChange = onChange
+        self.gameTimeout = gameTimeout
+        self._lock = threading.Lock()
+
+    def counts(self):
+        """Return dict of agents `busy`, `idle`, `waiting` and `created`."""
+        return {'busy': self.busy,
+                'idle': sum(len(x) for x in self.idle.values()),
+                'waiting': len(self.waiting),
+                'created': self.created}
+
+    def summon(self, room, seat, model):
+        """Send an agent to a room and seat, or queue the request if capped.
+
+        Args:
+          room (int): Target room number.
+          seat (int): Target seat number.
+          model (int): AI model ID, counting from 1.
+
+        """
+        with self._lock:
+            if self.busy >= self.maxAgents:
+                log.warning("All {0} agents busy; Room {1} Seat {2} waits "
+                            "for one.".format(self.maxAgents, room, seat))
+                self.waiting.append((room, seat, model))
+            else:
+                self.busy += 1
+                player = threading.Thread(target=self._play,
+                                          args=(room, seat, model))
+                player.daemon = True
+                player.start()
+        self._changed()
+
+    def _play(self, room, seat, model):
+        """Play games with reused agents until no summons are waiting."""
+        released = False
+        try:
+            while True:
+                agent = None
+                try:
+                    agent = self._take(model)
+                    agent.playGame(room, seat, self.gameTimeout)
+                except Exception:
+                    log.exception("Agent in Room {0} Seat {1} failed".format(
+                        room, seat))
+                    agent = None  # Don't reuse an agent in an unknown state
+
+                with self._lock:
+                    if agent is not None:
+                        self.idle[model].append(agent)
+                    if self.waiting:
+                        room, seat, model = self.waiting.popleft()
+                    else:
+                        self.busy -= 1
+                        released = True
+                        break
+                self._changed()
+        finally:
+            if not released:  # Left by an exception not caught above
+                with self._lock:
+                    self.busy -= 1
+            self._changed()
+
+    def _take(self, model):
+        """Return an idle agent of a model, creating one if none is idle."""
+        with self._lock:
+            if self.idle[model]:
+                return self.idle[model].pop()
+            self.created += 1
+
+        # Model IDs are base 1, while aiClasses is base 0
+        return self.aiClasses[model-1](None, 0, self._noSocket)
+
+    def _changed(self):
+        """Report the current counts, if anyone is listening."""
+        if self.onChange is not None:
+            self.onChange(self.counts())
+
+
 class AIManager(object):
     """Management entity for AI agents.
 
@@ -145,6 +310,8 @@ class AIManager(object):
     Attributes:
       aiClasses (list): List of pointers to available AI classes (not modules).
       aiSummary (list): AI identity data, prepared for the server.
+      roster (AgentRoster): Agents playing games or waiting to.
+      reports (Queue): Agent counts from the roster since the last report.
       socket (SocketIO): Socket connection for communicating with server.
       ns (BaseNamespace): Socket namespace used by socket.
 
@@ -153,18 +320,33 @@ class AIManager(object):
         """Initialize AIManager.
 
         The Manager imports and summarizes all available AI agents, then sets
-        up its socket and namespace. Finally, socket.wait() is called, which
-        blocks the current thread.
+        up its socket and namespace. Finally, it serves the socket in a loop
+        (see `run`), which blocks the current thread.
 
         """
         self.aiClasses = get_ai_models()
         self.aiSummary = self.get_ai_summary()
+        self.reports = Queue()
+        self.roster = AgentRoster(self.aiClasses, onChange=self.reportAgents)
         self.setupSocket()
 
         log.info("AI Management Agency open, hosting {0} agents".format(
             len(self.aiClasses)))
 
-        self.socket.wait()  # Blocks
+        self.run()  # Blocks
+
+    def run(self):
+        """Handle socket events and send agent counts, forever.
+
+        socketIO_client isn't thread-safe, so the socket is only used from
+        this thread. Agent counts change on the roster's threads, which
+        queue them (see `reportAgents`); the latest counts are sent from
+        here between waits for events.
+
+        """
+        while True:
+            self.socket.wait(AGENT_REPORT_INTERVAL)
+            self.sendReport()
 
     def setupSocket(self):
         """Create socket connection and send configuration data to server.
@@ -192,7 +374,7 @@ class AIManager(object):
     def on_summonAI(self, data):
         """Handle request from server for an AI agent.
 
-        Threading is used to spawn a new AI agent for a game.
+        An agent from the roster plays the game on its own thread.
 
         Args:
           data (dict): Data of the format `{room number: (seat, AI model ID)}`,
@@ -203,11 +385,30 @@ class AIManager(object):
         seat = data[roomNum][0]
         modelID = data[roomNum][1]
 
-        # Model IDs are base 1, while aiClasses is base 0
-        agent = threading.Thread(target=self.aiClasses[modelID-1],
-                                 args=(int(roomNum), seat))
-        agent.daemon = True
-        agent.start()
+        self.roster.summon(int(roomNum), seat, modelID)
+
+    def reportAgents(self, counts):
+        """Queue the roster's agent counts to be sent. Any thread."""
+        self.reports.put(counts)
+
+    def sendReport(self):
+        """Send the server the roster's agent counts, if they have changed.
+
+        Counts from different threads can be queued out of order, so the
+        roster's current counts are sent rather than the last queued.
+
+        """
+        changed = False
+        while True:
+            try:
+                self.reports.get_nowait()
+            except Empty:
+                break
+            changed = True
+        if changed:
+            counts = self.roster.counts()
+            log.debug("AI agents: {0}".format(counts))
+            self.ns.emit('aiStats', counts)
 
     def get_ai_summary(self):
         """Return data detailing available AI agents.
@@ -232,3 +433,536 @@ class AIManager(object):
             aList.append(temp)
 
         return aList
+
+
+class Channel(object):
+    """One end of a pipe carrying pickled messages between processes.
+
+    The pipe is a non-blocking socket pair. Reads that can't finish at once
+    wait on the gevent hub (wait_read), so an empty pipe only holds up the
+    greenlet reading it. Each message is sent as a length-prefixed frame.
+    Frames are added to an outgoing buffer in the order they are sent, and
+    written out by whichever greenlet finds the buffer idle, waiting on the
+    hub (wait_write) while the pipe is full; other senders return at once.
+
+    Attributes:
+      sock (socket): This end of the socket pair.
+      fd (int): File descriptor of sock.
+      buf (str): Bytes read but not yet returned by `recv`.
+      out (str): Bytes sent but not yet written to the pipe.
+      flushing (bool): If a greenlet is writing out the buffer.
+
+    """
+    def __init__(self, sock):
+        """Wrap one end of a socket pair; see `Channel.pair`."""
+        self.sock = sock
+        self.sock.setblocking(0)
+        self.fd = sock.fileno()
+        self.buf = ''
+        self.out = ''
+        self.flushing = False
+
+    @staticmethod
+    def pair():
+        """Return two Channels joined by a new socket pair."""
+        return tuple(Channel(sock) for sock in socket.socketpair())
+
+    def close(self):
+        """Close this end of the pipe.
+
+        Its file descriptor may then be reused, so the Channel forgets it,
+        and any later use fails instead of reaching some other file.
+
+        """
+        self.sock.close()
+        self.fd = -1
+
+    def send(self, msg):
+        """Send a picklable message."""
+        self.sendAll([msg])
+
+    def sendAll(self, msgs):
+        """Send several messages, with no other frames between them."""
+        self.out += ''.join(self._frame(msg) for msg in msgs)
+        if self.flushing:
+            return
+        self.flushing = True
+        try:
+            while self.out:
+                try:
+                    self.out = self.out[os.write(self.fd, self.out):]
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                    wait_write(self.fd)
+        finally:
+            self.flushing = False
+
+    def _frame(self, msg):
+        """Return a message pickled, with its length in front."""
+        body = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        return struct.pack('!I', len(body)) + body
+
+    def poll(self, timeout=0):
+        """Return True if a whole message can be read.
+
+        Args:
+          timeout (float, optional): Seconds to wait for the rest of a
+            message; None waits as long as it takes.
+
+        Raises:
+          EOFError: The other end of the pipe was closed.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._ready():
+            try:
+                chunk = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.ECONNRESET:  # Died with data unread
+                    raise EOFError
+                if e.errno != errno.EAGAIN:
+                    raise
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return False
+                try:
+                    wait_read(self.fd, left)
+                except socket.timeout:
+                    return False
+                continue
+            if not chunk:
+                raise EOFError
+            self.buf += chunk
+        return True
+
+    def _ready(self):
+        """Return True if buf holds a whole message."""
+        return (len(self.buf) >= 4 and
+                len(self.buf) >= 4 + struct.unpack('!I', self.buf[:4])[0])
+
+    def recv(self):
+        """Return the next message, waiting for it if need be."""
+        self.poll(None)
+        size = 4 + struct.unpack('!I', self.buf[:4])[0]
+        msg = pickle.loads(self.buf[4:size])
+        self.buf = self.buf[size:]
+        return msg
+
+
+class RemoteAgent(object):
+    """Server-side stand-in for an agent hosted by an AgentPool.
+
+    This has the parts of the AIBase interface that a Room uses, and passes
+    each call on to the real agent in its worker process.
+
+    The stand-in also follows the game in a shadow AIBase, so it can answer
+    for the agent. When the agent is to bid or play, it has the pool's
+    deadline to answer; past that, the shadow sends the lowest legal move
+    in its place (see AIBase.fallback), and a late answer is dropped.
+
+    The agent times its own decisions, but in its worker's metrics, which
+    the server never sees. So the stand-in records each answer's round
+    trip, under the same names AIBase.decide uses, in the server's metrics.
+
+    Attributes:
+      pool (AgentPool): Pool hosting the agent.
+      agentId (int): The agent's ID within the pool.
+      model (int): AI model ID, counting from 1.
+      label (str): The label used to identify the agent, as AIBase sets it.
+      ns (LocalNamespace): Namespace that receives the agent's emits.
+      shadow (AIBase): The agent's view of the game, kept by the server.
+      history (list): Game messages sent to the agent, used to rebuild it
+        if its worker dies.
+      awaiting (int): Number of the message the agent must answer with a
+        bid or play, or None.
+      asked (float): Time the agent was last asked to bid or play.
+      timer (Greenlet): Sends the fallback move at the deadline, or None.
+
+    """
+    def __init__(self, pool, agentId, model, room, seat, ns):
+        """Create a stand-in for a pooled agent; see AgentPool.spawn."""
+        self.pool = pool
+        self.agentId = agentId
+        self.model = model
+        self.shadow = AIBase(room, seat, pool.aiClasses[model-1].identity, ns)
+        self.label = self.shadow.label
+        self.ns = ns
+        self.history = []
+        self.awaiting = None
+        self.asked = None
+        self.timer = None
+
+    def handle_game_action(self, *args):
+        """Pass a game message on to the agent, timing it if it is to move."""
+        msg = args[0]
+        shadow = self.shadow
+        shadow.applyUpdate(msg)
+        self.history.append(msg)
+        seq = self.pool.send(self.agentId, 'handle_game_action', args)
+        if 'win' not in msg and shadow.gs.activePlayer == shadow.pNum:
+            self._cancel()
+            self.awaiting = seq
+            self.asked = time.time()
+            self.timer = gevent.spawn_later(self.pool.deadline,
+                                            self._expire, seq)
+
+    def on_err(self, *args):
+        """Pass an error message on to the agent."""
+        self.pool.send(self.agentId, 'on_err', args)
+
+    def reply(self, seq, event, args):
+        """Pass on an emit from the agent, unless it's a late move.
+
+        Args:
+          seq (int): Number of the message the agent was handling.
+          event (str): Event emitted by the agent.
+          args (tuple): Args of the event.
+
+        """
+        if event in ('bid', 'play'):
+            if seq != self.awaiting:
+                log.warning("Dropped late %s from %s", event, self.label)
+                return
+            self._cancel()
+            self._record(event)
+            if event == 'play':
+                self.shadow.hand = [c for c in self.shadow.hand
+                                    if c.code != args[0]]
+        self.ns.emit(event, *args)
+
+    def _record(self, kind):
+        """Record how long the agent took to answer, as AIBase.decide does."""
+        elapsed = (time.time() - self.asked) * 1000
+        name = self.shadow.name
+        metrics.record('ai.{0}.{1}'.format(name, kind), elapsed)
+        budget = self.pool.aiClasses[self.model-1].budget
+        if budget is not None and elapsed > budget * 1000:
+            metrics.record('ai.{0}.overrun'.format(name), elapsed)
+
+    def _expire(self, seq):
+        """Send the fallback move for an agent that missed its deadline."""
+        if seq != self.awaiting:
+            return
+        self.timer = None
+        self.awaiting = None
+        metrics.record('ai.{0}.expired'.format(self.shadow.name),
+                       self.pool.deadline * 1000)
+        send, move = self.shadow.fallback(self.shadow.gs.mode)
+        send(move)
+        # The agent may still play its own card; give it the true hand
+        self.pool.send(self.agentId, 'sync',
+                       [c.code for c in self.shadow.hand])
+
+    def _cancel(self):
+        """Stop waiting for a move."""
+        if self.timer is not None:
+            self.timer.kill(block=False)
+        self.timer = None
+        self.awaiting = None
+
+    def rebuild(self):
+        """Return the commands that recreate the agent in a new worker.
+
+        The agent is created afresh, given the game so far, and told its
+        hand. If it was to move, the last message is handled again, with
+        its original number, so its answer still counts. What the agent
+        worked out while thinking is lost.
+
+        """
+        msgs = [('new', self.agentId, 0, (self.model, self.shadow.room,
+                                          self.shadow.pNum))]
+        last = len(self.history) - (self.awaiting is not None)
+        msgs.extend(('applyUpdate', self.agentId, 0, (msg,))
+                    for msg in self.history[:last])
+        msgs.append(('sync', self.agentId, 0,
+                     [c.code for c in self.shadow.hand]))
+        if self.awaiting is not None:
+            msgs.append(('handle_game_action', self.agentId, self.awaiting,
+                         (self.history[-1],)))
+        return msgs
+
+    def stop(self):
+        """Remove the agent from its worker process."""
+        self._cancel()
+        self.pool.remove(self.agentId)
+
+
+def close_sockets(keep):
+    """Close every socket this process has, except one.
+
+    A process forked from the server has copies of all the server's sockets:
+    its listening socket, its clients' connections, and the pool's pipes to
+    other workers. Copies left open would keep them from ever closing.
+
+    Args:
+      keep (int): File descriptor of the socket to keep open.
+
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = range(os.sysconf('SC_OPEN_MAX'))
+    for fd in fds:
+        try:
+            if fd != keep and stat.S_ISSOCK(os.fstat(fd).st_mode):
+                os.close(fd)
+        except OSError:
+            pass  # Not open
+
+
+def host_agents(conn):
+    """Run agents for an AgentPool. This is a worker process's main loop.
+
+    Commands arrive on the channel as (command, agent ID, number, args)
+    tuples: `new` creates an agent from (model ID, room, seat), `drop`
+    removes one, `sync` replaces an agent's hand with the given card codes,
+    `stop` ends the loop, and anything else is called as a method of the
+    agent. Each emit made by an agent is sent back as an (agent ID, number,
+    event, args) tuple, where the number is that of the command being
+    handled.
+
+    As in ai.tournament, the AI models are imported here by ID, since
+    dynamically imported classes can't be pickled across processes.
+
+    A worker forked from a running server has a copy of the server's gevent
+    hub, with all its greenlets, so the worker starts a new hub, on a new
+    event loop, and never runs the old one. (Destroying the old hub won't
+    do: that waits on its thread pool, whose threads fork didn't copy.)
+    The worker also closes the sockets it was given by fork.
+
+    Args:
+      conn (Channel): The worker's end of its pipe to the pool.
+
+    """
+    gevent.hub.set_hub(gevent.hub.Hub(default=False))
+    close_sockets(conn.fd)
+    aiClasses = get_ai_models()
+    agents = dict()
+    current = [0]  # Number of the command being handled
+
+    def emitter(agentId):
+        return lambda seat, event, *args: conn.send(
+            (agentId, current[0], event, args))
+
+    while True:
+        try:
+            cmd, agentId, current[0], args = conn.recv()
+        except EOFError:
+            return  # Pool has gone away
+
+        try:
+            if cmd == 'new':
+                model, room, seat = args
+                # Model IDs are base 1, while aiClasses is base 0
+                agents[agentId] = aiClasses[model-1](
+                    room, seat, LocalNamespace(seat, emitter(agentId)))
+            elif cmd == 'drop':
+                agents.pop(agentId, None)
+            elif cmd == 'sync':
+                if agentId in agents:
+                    agents[agentId].hand = [cards.Card(c) for c in args]
+            elif cmd == 'stop':
+                return
+            elif agentId in agents:
+                getattr(agents[agentId], cmd)(*args)
+        except Exception:
+            log.exception('Agent %s failed handling %s', agentId, cmd)
+
+
+class AgentPool(object):
+    """Worker processes hosting AI agents for the server.
+
+    The pool starts a fixed number of processes, and each new agent goes to
+    the process hosting the fewest agents. Agents in the same process take
+    turns, but agents in different processes think in parallel and outside
+    the server's process.
+
+    Use `factory` or `factories` in place of AI classes when seating agents
+    in a Room. Replies from the workers are applied by `dispatch`, which
+    `start` runs in a greenlet for each worker.
+
+    An agent that doesn't bid or play within `deadline` has a move sent for
+    it (see RemoteAgent). A worker that dies is started again by its
+    listener, and its agents are rebuilt there.
+
+    Attributes:
+      aiClasses (list): AI classes in model ID order, used for labels.
+      deadline (float): Seconds an agent has to answer before a fallback
+        move is sent for it.
+      conns (list): The pool's Channel to each worker.
+      procs (list): Worker Process objects.
+      load (list): Number of agents hosted by each worker.
+      agents (dict): RemoteAgent objects keyed by agent ID.
+      homes (dict): Worker number hosting each agent, keyed by agent ID.
+      listeners (list): Greenlets reading each worker's replies, once started.
+
+    """
+    def __init__(self, aiClasses, processes=AGENT_PROCESSES,
+                 deadline=DECISION_DEADLINE):
+        """Start the worker processes.
+
+        This should happen before any other threads or greenlets are
+        started, since they would be copied into every worker.
+
+        Args:
+          aiClasses (list): AI classes in model ID order, as returned by
+            get_ai_models.
+          processes (int, optional): Number of worker processes.
+          deadline (float, optional): Seconds an agent has to answer.
+
+        """
+        self.aiClasses = aiClasses
+        self.deadline = deadline
+        self.conns = [None] * processes
+        self.procs = [None] * processes
+        self.load = [0] * processes
+        self.agents = dict()
+        self.homes = dict()
+        self.listeners = []
+        self._lastId = 0
+        self._lastSeq = 0
+
+        for n in range(processes):
+            self._startWorker(n)
+
+    def _startWorker(self, worker):
+        """Start a worker process, replacing any old one."""
+        conn, childConn = Channel.pair()
+        proc = multiprocessing.Process(target=host_agents,
+                                       args=(childConn,),
+                                       name='AgentPool{0}'.format(worker))
+        proc.daemon = True
+        proc.start()
+        childConn.close()
+        self.conns[worker] = conn
+        self.procs[worker] = proc
+
+    def factory(self, model):
+        """Return a function that creates pooled agents of one model.
+
+        The function takes the same (room, seat, ns) args as an AI class, so
+        it can be used wherever an AI class is used to seat an agent.
+
+        Args:
+          model (int): AI model ID, counting from 1.
+
+        """
+        return lambda room, seat, ns: self.spawn(model, room, seat, ns)
+
+    def factories(self):
+        """Return a factory for every AI model, in model ID order."""
+        return [self.factory(n + 1) for n in range(len(self.aiClasses))]
+
+    def spawn(self, model, room, seat, ns):
+        """Create an agent in the least busy worker.
+
+        Args:
+          model (int): AI model ID, counting from 1.
+          room (int): Room number of the agent's game.
+          seat (int): The agent's seat.
+          ns (LocalNamespace): Namespace that receives the agent's emits.
+
+        Returns:
+          RemoteAgent: Stand-in for the new agent.
+
+        """
+        self._lastId += 1
+        agentId = self._lastId
+        worker = self.load.index(min(self.load))
+        self.load[worker] += 1
+        self.homes[agentId] = worker
+
+        self.agents[agentId] = RemoteAgent(self, agentId, model, room, seat,
+                                           ns)
+        self.send(agentId, 'new', (model, room, seat))
+        return self.agents[agentId]
+
+    def send(self, agentId, cmd, args):
+        """Send a command for an agent to its worker.
+
+        If the worker has died, the command is lost; the listener rebuilds
+        the agent once the worker is restarted.
+
+        Returns:
+          int: Number of the command, or None if the agent isn't in the pool.
+
+        """
+        if agentId not in self.homes:
+            return None
+        self._lastSeq += 1
+        try:
+            self.conns[self.homes[agentId]].send(
+                (cmd, agentId, self._lastSeq, args))
+        except EnvironmentError as e:
+            log.warning('Lost %s for agent %s: %s', cmd, agentId, e)
+        return self._lastSeq
+
+    def remove(self, agentId):
+        """Remove an agent from the pool and its worker."""
+        if agentId in self.homes:
+            self.send(agentId, 'drop', ())
+            self.load[self.homes.pop(agentId)] -= 1
+            self.agents.pop(agentId, None)
+
+    def dispatch(self, worker, timeout=0):
+        """Apply a worker's waiting replies, passing emits to each agent.
+
+        Args:
+          worker (int): Worker number.
+          timeout (float, optional): Seconds to wait for the first reply;
+            None waits as long as it takes.
+
+        Returns:
+          int: Number of replies applied.
+
+        Raises:
+          EOFError: The worker has died.
+
+        """
+        conn = self.conns[worker]
+        count = 0
+        while conn.poll(timeout if count == 0 else 0):
+            agentId, seq, event, args = conn.recv()
+            count += 1
+            if agentId in self.agents:
+                self.agents[agentId].reply(seq, event, args)
+        return count
+
+    def respawn(self, worker):
+        """Replace a dead worker, and rebuild the agents it hosted."""
+        log.error('AgentPool worker %d died; restarting it', worker)
+        old, dead = self.conns[worker], self.procs[worker]
+        self._startWorker(worker)
+        old.close()
+        msgs = []
+        for agentId, home in self.homes.items():
+            if home == worker:
+                msgs.extend(self.agents[agentId].rebuild())
+        self.conns[worker].sendAll(msgs)
+        dead.join()
+
+    def start(self):
+        """Apply replies from every worker as they arrive, in greenlets."""
+        def listen(worker):
+            while True:
+                try:
+                    self.dispatch(worker, None)
+                except EOFError:
+                    self.respawn(worker)
+
+        if not self.listeners:
+            self.listeners = [gevent.spawn(listen, n)
+                              for n in range(len(self.conns))]
+
+    def close(self):
+        """Stop the listeners and worker processes."""
+        for greenlet in self.listeners:
+            greenlet.kill(block=False)
+        self.listeners = []
+        for conn, proc in zip(self.conns, self.procs):
+            try:
+                conn.send(('stop', None, 0, None))
+            except EnvironmentError:
+                pass  # Already dead
+            proc.join()
@@ -0,0 +1,188 @@
+#!/usr/bin/python2
+
+"""Headless simulator for AI-vs-AI Cinch games.
+
+The simulator plays complete games between AI agents without a socketio
+server. A core.game Game object is created and each seat is given an agent
+hosted in-process with a LocalNamespace. Messages published by the game are
+fed straight into each agent's `handle_game_action`, and the bids and plays the
+agents emit are applied to the game in the order they are made.
+
+This is intended for tuning and measuring AI models, where the cost of a
+socket round-trip for every card would dominate the run time. Agents get no
+time budget by default (see AIBase.decide), so results don't depend on how
+fast or busy the machine is.
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+
+Public classes:
+  IllegalActionError: Raised when an agent makes a move the game rejects.
+  Simulator: Plays headless games between AI models.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+# Add parent directory (/cinch/) to Python path for imports
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+
+from core.game import Game, NUM_PLAYERS, NUM_TEAMS
+from ai.base import LocalNamespace
+from ai.manager import get_ai_models
+import db.writer as writer
+
+
+class IllegalActionError(Exception): pass
+
+
+class Simulator(object):
+    """Runner for headless AI-vs-AI games.
+
+    Attributes:
+      aiClasses (list): AI classes for each seat, in seat order.
+      persist (bool): Write finished games to the database.
+      budget (float): Seconds each agent has per bid or play, or None.
+      game (Game): The game currently being simulated.
+      agents (list): The agents seated in the current game, in seat order.
+      pending (list): (seat, event, args) tuples emitted by agents and not
+        yet applied to the game.
+
+    """
+    def __init__(self, aiClasses, persist=False, budget=None):
+        """Initialize simulator for a given seating of AI classes.
+
+        Args:
+          aiClasses (list): One AI class (not model ID) per seat.
+          persist (bool, optional): Write finished games to the database
+            like a served game would, before playGame returns. Off by
+            default so tuning runs don't flood the game logs.
+          budget (float, optional): Seconds each agent has per bid or
+            play. None, the default, sets no limit.
+
+        """
+        if len(aiClasses) != NUM_PLAYERS:
+            raise ValueError(
+                'Need {0} AI classes, got {1}.'.format(NUM_PLAYERS,
+                                                       len(aiClasses)))
+        self.aiClasses = aiClasses
+        self.persist = persist
+        self.budget = budget
+        self.game = None
+        self.agents = []
+        self.pending = []
+
+    def queueAction(self, seat, event, *args):
+        """Record an event emitted by an agent; see LocalNamespace."""
+        self.pending.append((seat, event, args))
+
+    def deliver(self, output):
+        """Hand published game output to the agents.
+
+        Args:
+          output (dict or list): Return value of a Game action. A list holds
+            one message per seat, as sent for new hands.
+
+        """
+        if type(output) == list:
+            for msg in output:
+                self.agents[msg['tgt']].handle_game_action(msg)
+        else:
+            for agent in self.agents:
+                agent.handle_game_action(output)
+
+    def playGame(self, seed=None):
+        """Play one game to completion and return its results.
+
+        Args:
+          seed (hashable, optional): Seed for the game's deck RNG stream. The
+            same seed always gives the same sequence of deals.
+
+        Returns:
+          dict: Summary of the game with keys `win` (winning team, or 0.5 for
+            a draw), `scores` (list of team scores), `hands` (number of hands
+            played), `declared` (list of per-team counts of hands declared),
+            and `sets` (list of per-team counts of hands where that team
+            declared and was set).
+
+        Raises:
+          IllegalActionError: If an agent makes an illegal or out-of-turn
+            move. Such an agent would stall a real game.
+
+        """
+        self.game = Game(self.persist, seed)
+        self.pending = []
+        self.agents = [cls(None, seat, LocalNamespace(seat, self.queueAction))
+                       for seat, cls in enumerate(self.aiClasses)]
+        for agent in self.agents:
+            agent.budget = self.budget
+        declared = [0] * NUM_TEAMS
+        sets = [0] * NUM_TEAMS
+
+        self.deliver(self.game.start_game(
+            [agent.label for agent in self.agents]))
+
+        while self.pending:
+            seat, event, args = self.pending.pop(0)
+            declarer = self.game.gs.declarer  # Reset when a new hand is dealt
+
+            if event == 'bid':
+                res = self.game.handle_bid(seat, args[0])
+            elif event == 'play':
+                res = self.game.handle_card_played(seat, args[0])
+            else:
+                continue  # Chat and the like have no effect on the game
+
+            if res is None or res is False:
+                raise IllegalActionError(
+                    '{0} made bad {1} of {2}'.format(
+                        self.agents[seat].label, event, args[0]))
+
+            msg = res[0] if type(res) == list else res
+            if 'mp' in msg:
+                declared[declarer % NUM_TEAMS] += 1
+                if self.game.gs.declarer_set():
+                    sets[declarer % NUM_TEAMS] += 1
+
+            self.deliver(res)
+
+        if self.persist:
+            # Nothing above yields to the gevent hub, which runs the writer
+            writer.flush()
+
+        gs = self.game.gs
+        return dict(win=gs.winner, scores=list(gs.scores),
+                    hands=gs.hand_number - 1, declared=declared, sets=sets)
+
+
+def main():
+    """Play a series of headless games and log the combined results."""
+    parser = argparse.ArgumentParser(
+        description='Headless AI-vs-AI game simulator.')
+    parser.add_argument('models', type=int, nargs=NUM_PLAYERS,
+                        help='AI model IDs for each seat (see ai list)')
+    parser.add_argument('-n', '--games', type=int, default=1,
+                        help='number of games to play (default=1)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    aiClasses = get_ai_models()
+    # Model IDs are base 1, while aiClasses is base 0
+    sim = Simulator([aiClasses[m-1] for m in args.models])
+
+    wins = {0: 0, 1: 0, 0.5: 0}
+    for _ in range(args.games):
+        wins[sim.playGame()['win']] += 1
+
+    print('Team 0: {0} wins, Team 1: {1} wins, {2} draws'.format(
+        wins[0], wins[1], wins[0.5]))
+
+
+if __name__ == "__main__":
+    main()
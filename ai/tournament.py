@@ -0,0 +1,226 @@
+#!/usr/bin/python2
+
+"""Multi-core tournament runner for AI-vs-AI matchups.
+
+A tournament plays many headless games (see ai.simulator) between a fixed
+seating of AI models. The games are split into shards, and the shards are
+spread across a multiprocessing Pool so every CPU core can be used; threads
+would all share one interpreter lock.
+
+Every game gets its own deck seed, made from the tournament seed and the
+game's index, so the deals do not depend on how the games are sharded. Each
+shard also seeds the global RNG used by agents in its worker process, so a
+tournament with the same seed, model seating, game count and shard count is
+repeatable no matter how many processes run it. The shard count defaults to
+SHARDS rather than to the process count for the same reason.
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+  SHARDS (int): Default number of shards a tournament is split into.
+
+Public classes:
+  Tally: Combinable counts of tournament results.
+
+Public methods:
+  game_seed: Return the deck seed for a game in a tournament.
+  play_shard: Play one shard of games. Runs in a worker process.
+  run_tournament: Play a full tournament and return the combined Tally.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+# Add parent directory (/cinch/) to Python path for imports
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import random
+import multiprocessing
+
+from core.game import NUM_PLAYERS, NUM_TEAMS
+from ai.manager import get_ai_models
+from ai.simulator import Simulator, IllegalActionError
+
+# Constants
+SHARDS = 32
+
+
+class Tally(object):
+    """Counts of game results that can be combined across shards.
+
+    Attributes:
+      games (int): Games played to completion.
+      wins (list): Games won by each team.
+      draws (int): Games that ended on MAX_HANDS without a winner.
+      hands (int): Hands played across all completed games.
+      declared (list): Hands declared by each team.
+      sets (list): Hands where each team declared and was set.
+      errors (int): Games abandoned because an agent made an illegal move.
+
+    """
+    def __init__(self):
+        """Initialize an empty tally."""
+        self.games = 0
+        self.wins = [0] * NUM_TEAMS
+        self.draws = 0
+        self.hands = 0
+        self.declared = [0] * NUM_TEAMS
+        self.sets = [0] * NUM_TEAMS
+        self.errors = 0
+
+    def __repr__(self):
+        """Return a multi-line report of the tally."""
+        out = "Games: {0}\t\tErrors: {1}\t\tDraws: {2}\n".format(
+            self.games, self.errors, self.draws)
+        out += "Avg hands per game: {0:.2f}\n".format(self.avgHands())
+        for team in range(NUM_TEAMS):
+            out += "Team {0}: {1} wins ({2:.1%}), set {3} of {4} ({5:.1%})\n"\
+                "".format(team, self.wins[team], self.winRate(team),
+                          self.sets[team], self.declared[team],
+                          self.setRate(team))
+        return out
+
+    def add(self, result):
+        """Count one game result from Simulator.playGame."""
+        self.games += 1
+        if result['win'] in range(NUM_TEAMS):
+            self.wins[result['win']] += 1
+        else:
+            self.draws += 1
+        self.hands += result['hands']
+        for team in range(NUM_TEAMS):
+            self.declared[team] += result['declared'][team]
+            self.sets[team] += result['sets'][team]
+
+    def merge(self, other):
+        """Add the counts of another Tally to this one."""
+        self.games += other.games
+        self.draws += other.draws
+        self.hands += other.hands
+        self.errors += other.errors
+        for team in range(NUM_TEAMS):
+            self.wins[team] += other.wins[team]
+            self.declared[team] += other.declared[team]
+            self.sets[team] += other.sets[team]
+
+    def avgHands(self):
+        """Return the mean number of hands per completed game."""
+        return self.hands / float(self.games) if self.games else 0.0
+
+    def winRate(self, team):
+        """Return the fraction of completed games won by a team."""
+        return self.wins[team] / float(self.games) if self.games else 0.0
+
+    def setRate(self, team):
+        """Return the fraction of a team's declared hands that were set."""
+        if self.declared[team] == 0:
+            return 0.0
+        return self.sets[team] / float(self.declared[team])
+
+
+def game_seed(seed, gameIndex):
+    """Return the deck seed for a game within a tournament."""
+    return (seed << 32) + gameIndex
+
+
+def play_shard(args):
+    """Play a shard of games and return its Tally.
+
+    This runs in a worker process, so the AI models are imported here by ID;
+    dynamically imported classes can't be pickled across processes.
+
+    Args:
+      args (tuple): (model IDs for each seat, tournament seed, index of the
+        first game in the shard, number of games).
+
+    Returns:
+      Tally: Results of the games in this shard.
+
+    """
+    modelIDs, seed, firstGame, numGames = args
+    random.seed(game_seed(seed, firstGame))  # Used by agents, not decks
+
+    aiClasses = get_ai_models()
+    # Model IDs are base 1, while aiClasses is base 0
+    sim = Simulator([aiClasses[m-1] for m in modelIDs])
+
+    tally = Tally()
+    for n in range(firstGame, firstGame + numGames):
+        try:
+            tally.add(sim.playGame(game_seed(seed, n)))
+        except IllegalActionError as e:
+            log.error("Game abandoned: {0}".format(e))
+            tally.errors += 1
+
+    return tally
+
+
+def run_tournament(modelIDs, numGames, seed=0, processes=None, shards=None):
+    """Play a tournament across a pool of processes.
+
+    Args:
+      modelIDs (list): AI model IDs for each seat.
+      numGames (int): Total number of games to play.
+      seed (int, optional): Tournament seed.
+      processes (int, optional): Worker processes. Defaults to CPU count.
+      shards (int, optional): Number of shards to split the games into.
+        Defaults to SHARDS. Results depend on this, but not on processes.
+
+    Returns:
+      Tally: Combined results of all games.
+
+    """
+    if len(modelIDs) != NUM_PLAYERS:
+        raise ValueError('Need {0} model IDs, got {1}.'.format(
+            NUM_PLAYERS, len(modelIDs)))
+
+    processes = processes or multiprocessing.cpu_count()
+    shards = min(shards or SHARDS, numGames) or 1
+
+    # Spread any remainder over the first shards
+    sizes = [numGames // shards + (1 if n < numGames % shards else 0)
+             for n in range(shards)]
+    starts = [sum(sizes[:n]) for n in range(shards)]
+    jobs = [(list(modelIDs), seed, start, size)
+            for start, size in zip(starts, sizes)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(play_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    total = Tally()
+    for tally in results:
+        total.merge(tally)
+    return total
+
+
+def main():
+    """Run a tournament from the command line and print the report."""
+    parser = argparse.ArgumentParser(
+        description='Multi-core AI-vs-AI tournament runner.')
+    parser.add_argument('models', type=int, nargs=NUM_PLAYERS,
+                        help='AI model IDs for each seat (see ai list)')
+    parser.add_argument('-n', '--games', type=int, default=100,
+                        help='number of games to play (default=100)')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='worker processes (default=CPU count)')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='tournament RNG seed (default=0)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='number of shards (default={0})'.format(SHARDS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print(run_tournament(args.models, args.games, args.seed,
+                         args.processes, args.shards))
+
+
+if __name__ == "__main__":
+    main()
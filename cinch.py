@@ -10,7 +10,7 @@ import argparse
 
 import common
 import web.server
-from ai.manager import AIManager
+from ai.manager import AIManager, AgentPool, get_ai_models
 
 
 if __name__ == "__main__":
@@ -21,6 +21,14 @@ if __name__ == "__main__":
                         action="store_true")
     parser.add_argument("--stack", help="stack deck using given RNG seed",
                         type=float)
+    parser.add_argument("--shards", help="run game rooms in this many worker "
+                        "processes (see web.shard)", type=int, default=0)
+    parser.add_argument("--local-ai", help="host summoned AI agents inside "
+                        "the server instead of the AI manager",
+                        action="store_true")
+    parser.add_argument("--ai-processes", help="host summoned AI agents in "
+                        "this many worker processes (implies --local-ai)",
+                        type=int, default=0)
     args = parser.parse_args()
 
     if args.quick:
@@ -33,9 +41,23 @@ if __name__ == "__main__":
     if args.stack:
         logging.info("Deck stacking on for all games (seed = {0})".format(
             args.stack))
-        import core.cards
-        core.cards.STACK_DECK = True
-        core.cards.DECK_SEED = args.stack
+        import core.game
+        core.game.DECK_SEED = args.stack
+
+    # Fork room or agent workers before any threads start. Room workers
+    # always host their own agents.
+    aiClasses = None
+    if args.shards:
+        import web.shard
+        logging.info("Starting {0} room workers".format(args.shards))
+        web.shard.startWorkers(args.shards)
+    elif args.ai_processes:
+        logging.info("Starting {0} AI agent workers".format(
+            args.ai_processes))
+        pool = AgentPool(get_ai_models(), args.ai_processes)
+        aiClasses = pool.factories()
+    elif args.local_ai:
+        aiClasses = get_ai_models()
 
     # Start AI manager
     manager = threading.Thread(target=AIManager)
@@ -43,7 +65,12 @@ if __name__ == "__main__":
     manager.start()
 
     # Start server
-    web.server.runServer() # Blocks
+    if args.shards:
+        web.shard.runLobby(args.shards) # Blocks
+    else:
+        if args.ai_processes:
+            pool.start()
+        web.server.runServer(aiClasses=aiClasses) # Blocks
 
     # Begin cleanup
     logging.info("Cleaning up...")
@@ -12,43 +12,63 @@ SOCKETIO_NS = '/cinch'
 # Construct sqlite database
 from db.dal import DAL, Field
 
-db = DAL('sqlite://storage.sqlite',folder='db')
+DB_URI = 'sqlite://storage.sqlite'
+DB_FOLDER = 'db'
+
+db = DAL(DB_URI, folder=DB_FOLDER)
 
 # Database table definitions -- defined here rather than in the relevant
 # modules to allow for reference fields without worrying about the import sequence.
-db.define_table(
-    'Games',
-    Field('Timestamp', 'string', required=True),
-    Field('PlayerName0', 'string', required=True),
-    Field('PlayerName1', 'string', required=True),
-    Field('PlayerName2', 'string', required=True),
-    Field('PlayerName3', 'string', required=True),
-)
-db.define_table(
-    'Events',
-    Field('game_id', 'reference Games', required=True),
-    Field('HandNumber', 'integer', required=True),
-    Field('Timestamp', 'string', required=True),
-    Field('EventString', 'text', required=True)
-)
-db.define_table(
-    'hands',
-    Field('game_id', 'reference Games', required=True),
-    Field('dealer', 'integer'),
-    Field('declarer', 'integer'),
-    Field('trump', 'integer'),
-    Field('high_bid', 'integer'),
-    Field('hand_number', 'integer')
-)
-db.define_table(
-    'actions',
-    Field('game_id', 'reference Games', required=True),
-    Field('hand_id', 'reference hands', required=True),
-    Field('pnum', 'integer', required=True),
-    Field('bid', 'integer'),
-    Field('rank', 'integer'),
-    Field('suit', 'integer')
-)
+def define_tables(db):
+    """Define the game tables on a DAL connection, and return it."""
+    db.define_table(
+        'Games',
+        Field('Timestamp', 'string', required=True),
+        Field('PlayerName0', 'string', required=True),
+        Field('PlayerName1', 'string', required=True),
+        Field('PlayerName2', 'string', required=True),
+        Field('PlayerName3', 'string', required=True),
+    )
+    db.define_table(
+        'Events',
+        Field('game_id', 'reference Games', required=True),
+        Field('HandNumber', 'integer', required=True),
+        Field('Timestamp', 'string', required=True),
+        Field('EventString', 'text', required=True)
+    )
+    db.define_table(
+        'hands',
+        Field('game_id', 'reference Games', required=True),
+        Field('dealer', 'integer'),
+        Field('declarer', 'integer'),
+        Field('trump', 'integer'),
+        Field('high_bid', 'integer'),
+        Field('hand_number', 'integer')
+    )
+    db.define_table(
+        'actions',
+        Field('game_id', 'reference Games', required=True),
+        Field('hand_id', 'reference hands', required=True),
+        Field('pnum', 'integer', required=True),
+        Field('bid', 'integer'),
+        Field('rank', 'integer'),
+        Field('suit', 'integer')
+    )
+
+    return db
+
+define_tables(db)
+
+
+def connect_db():
+    """Open a new connection to the game database.
+
+    common.db is a single connection and cursor, so code running on another
+    thread should use its own connection from here. The tables were created
+    when common.db was defined, so they aren't migrated again.
+
+    """
+    return define_tables(DAL(DB_URI, folder=DB_FOLDER, migrate_enabled=False))
 
 
 def enum(**enums):
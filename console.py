@@ -318,9 +318,9 @@ class Namespace(BaseNamespace):
     def on_roomFull(self, *args):
         log.debug('Room is full.')
 
-    def on_rooms(self, room_list): #TODO Change to silent update & add command
-        # room_list is a dict with items name and num
-        resp_line = "Rooms: "+', '.join([x['name'] for x in room_list])
+    def on_rooms(self, snapshot): #TODO Change to silent update & add command
+        # snapshot['rooms'] is a list of dicts with items name and num
+        resp_line = "Rooms: "+', '.join([x['name'] for x in snapshot['rooms']])
         log.info(resp_line)
     
     def on_startData(self, msg):
@@ -2,8 +2,7 @@
 # -*- coding: utf-8 -*-
 """Define basic properties of cards and decks of cards."""
 
-from random import shuffle
-from math import floor
+import random
 
 
 # Constants to use for card identification
@@ -23,14 +22,18 @@ SUITS = SUITS_MAP.keys()
 # Lookup tables for conversion, filled below
 CODE_TO_RS = {}
 RS_TO_CODE = {}
+CARDS = [None] # Card object for each code; index 0 is unused
 
 NUM_RANKS = len(RANKS)
 NUM_SUITS = len(SUITS)
 MAX_CARD_CODE = NUM_RANKS * NUM_SUITS
 
-# Control variables locked in at program start
-STACK_DECK = False
-DECK_SEED  = 0 # Used for deck stacking, must be in interval [0, 1]
+# Bitmask representation: a set of cards (hand, trick, team stack, etc.) is an
+# integer where bit (code - 1) is set if the card with that code is present.
+# Codes within a suit are contiguous and ordered by rank, so each suit
+# occupies NUM_RANKS consecutive bits, low rank first.
+SUIT_MASKS = [((1 << NUM_RANKS) - 1) << (s * NUM_RANKS) for s in SUITS]
+FULL_MASK = (1 << MAX_CARD_CODE) - 1
 
 
 # Define exceptions
@@ -39,27 +42,38 @@ class InvalidRankError(Exception): pass
 class InvalidSuitError(Exception): pass
 
 
-class Card:
+class Card(object):
     """Define Card object with instance variables:
 
     suit (int): card suit via Suits enum
     rank (int): card rank via Ranks enum
-    code (int): rank-suit encoding of card; only set when card dealt
-    owner (int, 0-3): local player id for initial holder of card
-        - currently set in game.py when dealt
+    code (int): rank-suit encoding of card
+
+    There is exactly one Card object for each card code, held in CARDS.
+    Creating a Card returns that shared object, so cards are immutable and
+    can be compared by identity. Which player holds a card is game data, and
+    is tracked by the game state rather than on the card.
 
     """
-    def __init__(self, rank_or_code, suit=None):
-        """Create Card object with given rank & suit."""
+    __slots__ = ('rank', 'suit', 'code')
+
+    def __new__(cls, rank_or_code, suit=None):
+        """Return the Card object with given code or rank & suit."""
         if suit is None: # Assume it's a 1-52 encoded card.
-            self.code = rank_or_code
-            self.rank, self.suit = decode(rank_or_code)
+            decode(rank_or_code) # Validate code
+            return CARDS[rank_or_code]
         else:
-            self.rank = rank_or_code
-            self.suit = suit
-            self.code = self.encode()
+            return CARDS[encode(rank_or_code, suit)]
+
+    def __setattr__(self, name, value):
+        """Prevent changes to shared Card objects."""
+        raise AttributeError("Card objects are immutable")
+
+    __delattr__ = __setattr__
 
-        self.owner = None
+    def __reduce__(self):
+        """Copy and pickle cards as references to the shared objects."""
+        return (Card, (self.code,))
 
     def __lt__(self, other):
         """Implemented to make class sortable."""
@@ -70,7 +84,15 @@ class Card:
 
     def __eq__(self, other):
         """Implemented to make class sortable."""
-        return self.suit == other.suit and self.rank == other.rank
+        return self is other
+
+    def __ne__(self, other):
+        """Counterpart to __eq__."""
+        return self is not other
+
+    def __hash__(self):
+        """Hash by card code."""
+        return self.code
 
     def __repr__(self):
         """Return descriptive string when asked to print object."""
@@ -83,23 +105,28 @@ class Card:
 
 
 class Deck(list):
-    """Define Deck object and methods for creating and manipulating Deck."""
-    def __init__(self):
+    """Define Deck object and methods for creating and manipulating Deck.
+
+    The top of the deck is the end of the list, so dealing is a pop from the
+    end rather than from the front.
+
+    """
+    def __init__(self, rng=None):
         """Create deck of cards.
 
-        Iterate through (rank,suit) pairs, creating a new Card object
-        for each and adding to internal list.
+        Iterate through (rank,suit) pairs, adding the Card object for each
+        to internal list, then shuffle.
+
+        rng (Random, optional): RNG stream used to shuffle; a game passes its
+            own stream so its deals are reproducible. Defaults to the module
+            RNG in `random`.
 
         """
         for r in RANKS:
             for s in SUITS:
                 self.append(Card(r, s))
 
-        # Shuffle deck, stacking if needed
-        if STACK_DECK:
-            shuffle(self, lambda: DECK_SEED)
-        else:
-            shuffle(self)
+        (rng or random).shuffle(self)
 
     def __repr__(self):
         """Return descriptive string when asked to print object."""
@@ -107,7 +134,13 @@ class Deck(list):
 
     def deal_one(self):
         """Return top from deck and remove from self."""
-        return self.pop(0)
+        return self.pop()
+
+    def deal(self, num_cards):
+        """Return list of the top num_cards cards and remove from self."""
+        dealt = self[-num_cards:]
+        del self[-num_cards:]
+        return dealt
 
 
 def encode(rank, suit):
@@ -126,13 +159,65 @@ def decode(card_code):
 
     return CODE_TO_RS[card_code]
 
+def card_bit(card_code):
+    """Return the bitmask holding only the card with the given code."""
+    return 1 << (card_code - 1)
+
+def to_mask(card_codes):
+    """Return the bitmask for an iterable of card codes."""
+    mask = 0
+    for code in card_codes:
+        mask |= 1 << (code - 1)
+    return mask
+
+def cards_to_mask(card_list):
+    """Return the bitmask for an iterable of Card objects."""
+    return to_mask(card.code for card in card_list)
+
+def from_mask(mask):
+    """Return list of card codes in a bitmask, in ascending order."""
+    codes = []
+    while mask:
+        low = mask & -mask
+        codes.append(low.bit_length())
+        mask ^= low
+    return codes
+
+def popcount(mask):
+    """Return the number of cards in a bitmask."""
+    return bin(mask).count('1')
+
+def in_suit(mask, suit):
+    """Return the part of a bitmask belonging to the given suit."""
+    return mask & SUIT_MASKS[suit]
+
+def highest_in_suit(mask, suit):
+    """Return code of the highest-rank card of a suit in mask, or None."""
+    return (mask & SUIT_MASKS[suit]).bit_length() or None
+
+def lowest_in_suit(mask, suit):
+    """Return code of the lowest-rank card of a suit in mask, or None."""
+    suited = mask & SUIT_MASKS[suit]
+    return (suited & -suited).bit_length() or None
+
+def fillCardTable():
+    """Create the one Card object for each code, bypassing Card.__new__."""
+    for code in range(1, MAX_CARD_CODE+1):
+        card = object.__new__(Card)
+        rank, suit = CODE_TO_RS[code]
+        object.__setattr__(card, 'rank', rank)
+        object.__setattr__(card, 'suit', suit)
+        object.__setattr__(card, 'code', code)
+        CARDS.append(card)
+
 def fillLookupTables():
     """Store all possible (code, (rank, suit)) pairs and the reverse."""
     for code in range(1, MAX_CARD_CODE+1):
-        suit = floor((code - 1) / NUM_RANKS)
+        suit = (code - 1) // NUM_RANKS
         rank = code - (suit * NUM_RANKS) + 1
 
         CODE_TO_RS[code] = (rank, suit)
         RS_TO_CODE[(rank, suit)] = code
 
 fillLookupTables()
+fillCardTable()
@@ -8,9 +8,10 @@ import logging
 log = logging.getLogger(__name__)
 
 import common
-from common import db
+import db.writer as writer
 from core.player import Player
 import core.cards as cards
+import core.moves as moves
 from core.gamestate import GameState
 import db.stats as stats
 
@@ -24,6 +25,7 @@ NUM_PLAYERS = NUM_TEAMS * TEAM_SIZE
 GAME_MODE = common.enum(PLAY=1, BID=2)
 MAX_HANDS = 16 # Not part of game rules; intended to prevent AI problems.
                # Can be modified later if actual gameplay is trending longer.
+DECK_SEED = None # Default seed for each game's RNG stream; set to stack decks.
 
 # Bid constants
 BID = common.enum(PASS=0, CINCH=5)
@@ -32,20 +34,29 @@ BID = common.enum(PASS=0, CINCH=5)
 class Game:
     """Define object for Game object with instance variables:
 
-        stack_deck (bool): fixed hands for testing purposes.
-        deck_seed (float)[0..1]: used to seed if stack_deck is True
         id (integer): unique id for game object
         mode (integer): setting for game mode
         players (list): array of Player objects for players in game
         teams (dict): player id : local player num pairings (?)
         gs (object): current game state
         deck (object): Deck object containing Card objects
+        persist (bool): write the game to the database when it ends
+        pure (bool): rules-only mode for simulations and solvers. Game state
+            is updated as usual, but no messages are built, no events are
+            logged, and nothing is written to the database. Actions return
+            the event status code (e.g. 'crd', 'eoh') instead of messages.
+        rng (Random): RNG stream used to shuffle every deck in this game. A
+            given seed always produces the same sequence of deals, with a
+            different deal for each hand.
 
     """
-    def __init__(self):
+    def __init__(self, persist=True, seed=None, pure=False):
         self.players = []
         self.gs = None
-        self.deck = cards.Deck()
+        self.rng = random.Random(DECK_SEED if seed is None else seed)
+        self.deck = cards.Deck(self.rng)
+        self.persist = persist
+        self.pure = pure
 
     def __repr__(self):
         """Return descriptive string when asked to print object."""
@@ -64,18 +75,15 @@ class Game:
         """
         if self.gs.game_mode != GAME_MODE.BID:
             return False    # Can't bid during play phase.
+        if bid not in moves.legal_bids(self.gs.high_bid,
+                                       player.pNum == self.gs.dealer):
+            return False    # Out of range, too low, or stuck dealer passing.
         if bid == BID.PASS:
-            return 'pass'   # Always legal to pass.
-        if bid < BID.PASS:
-            return False    # Bid outside legal range.
-        if bid > BID.CINCH:
-            return False    # Bid outside legal range.
+            return 'pass'
         if bid > self.gs.high_bid:
             return 'high'   # New high bid; legal.
-        if (bid == BID.CINCH) & (player.pNum == self.gs.dealer):
-            return 'cntr'   # Dealer has option to counter-cinch.
 
-        return False        # If we get here, no legal options left.
+        return 'cntr'       # Dealer has option to counter-cinch.
 
     def check_play_legality(self, player, card_num):
         """Check a proposed play for legality against the current gs.
@@ -86,67 +94,38 @@ class Game:
         card_num (int): encoding of card to be played by player
 
         """
-        # Search player's hand for card where card_num = card.code
-        has_card = False
-        for card in player.hand:
-            if card.code == card_num:
-                has_card = True
-                break
-
-        if not has_card:
-            return False     # Must play a card in hand.
         if self.gs.game_mode != GAME_MODE.PLAY:
             return False     # Can't play during bid phase.
-        if len(self.gs.cards_in_play) == 0:
-            return True      # No restrictions on what cards can be led.
-        if card.suit == self.gs.trump:
-            return True      # Trump is always OK
-        if card.suit == self.gs.cards_in_play[0].suit:
-            return True      # Not trump, but followed suit.
-        for each_card in player.hand:
-            if each_card.suit == self.gs.cards_in_play[0].suit:
-                return False # Could have followed suit with a different card.
-
-        return True          # Couldn't follow suit, throwing off.
+
+        if card_num not in range(1, cards.MAX_CARD_CODE+1):
+            return False     # Not a card.
+
+        # Must play a card in hand, following the rules in core.moves.
+        return bool(self.legal_play_mask(player) & cards.card_bit(card_num))
 
     def dbupdate(self):
-        """Write a completed gamestate to the sqlite database."""
-        log.debug("Trying to add a row for the new game.")
-
-        # Get the automatic game ID to use in the Events table in place of the
-        # random engine-generated game ID. The game timestamp is that of the
-        # first game event.
-        autogen_game_id = db.Games.insert(
-            Timestamp=self.gs.events[0]['timestamp'],
-            PlayerName0=self.players[0].name,
-            PlayerName1=self.players[1].name,
-            PlayerName2=self.players[2].name,
-            PlayerName3=self.players[3].name
-        )
-        log.debug("Grabbed a game_id from the database.")
-
-        # Write everything from Events to the database.
-        log.info("Writing game data for local game %s, db game %s.",
-                  self.gs.game_id, autogen_game_id)
-
-        for action in self.gs.events:
-            db.Events.insert(
-                game_id=autogen_game_id,
-                HandNumber=action['hand_num'],
-                Timestamp=action['timestamp'],
-                EventString=action['output']
-            )
+        """Queue a completed gamestate to be written to the sqlite database.
 
-        db.commit()
+        The write is done in the background by db.writer, so finishing a game
+        doesn't wait on the database.
+
+        """
+        log.info("Queueing game data for local game %s.", self.gs.game_id)
+
+        # The game timestamp is that of the first game event.
+        writer.submit(dict(timestamp=self.gs.events[0]['timestamp'],
+                           names=[p.name for p in self.players],
+                           events=self.gs.events))
 
     def deal_hand(self):
         """Deal new hand to each player and set card ownership."""
+        owners = self.gs.owners = {}
         for player in self.players:
-            player.hand = sorted([self.deck.deal_one() for x in range
-                          (STARTING_HAND_SIZE)], reverse = True)
+            player.hand = sorted(self.deck.deal(STARTING_HAND_SIZE),
+                                 reverse = True)
 
             for card in player.hand:
-                card.owner = player.pNum
+                owners[card.code] = player.pNum
 
     def generate_id(self, size=6):
         """Generate random character string of specified size.
@@ -235,11 +214,9 @@ class Game:
             self.gs.active_player = self.gs.next_player(self.gs.active_player)
             return self.publish('crd', player_num, card)
         else:
-            trick_winner = winning_card.owner
+            trick_winner = self.gs._t_w_player
             self.gs.active_player = trick_winner
-            self.gs.team_stacks[trick_winner
-                                % TEAM_SIZE] += self.gs.cards_in_play
-            self.gs.cards_in_play = []
+            self.gs.take_trick(trick_winner % TEAM_SIZE)
 
         # Check for end of hand and handle, otherwise return.
         #----------------------------------------------------
@@ -278,10 +255,10 @@ class Game:
         # If no victor, set up for next hand.
         gs = self.gs # Operate on local variable for speed++
 
-        gs.team_stacks = [[] for _ in range(NUM_TEAMS)]
+        gs.reset_hand()
         gs.dealer = gs.next_player(gs.dealer)
         gs.declarer = gs.dealer
-        self.deck = cards.Deck()
+        self.deck = cards.Deck(self.rng)
         self.deal_hand()
         gs.active_player = gs.next_player(gs.dealer)
         gs.high_bid = 0
@@ -292,6 +269,39 @@ class Game:
 
         return self.publish('eoh', player_num, card)
 
+    def legal_moves(self, player_num=None):
+        """Return all legal moves for a player in a single call.
+
+        player_num (int): local player number; defaults to the active player
+
+        Returns a list of legal bids during the bid phase, or a list of the
+        codes of legal cards to play during the play phase. A player that is
+        not active has no legal moves.
+
+        """
+        if player_num is None:
+            player_num = self.gs.active_player
+        if player_num != self.gs.active_player:
+            return []
+
+        player = self.players[player_num]
+        if self.gs.game_mode == GAME_MODE.BID:
+            return moves.legal_bids(self.gs.high_bid,
+                                    player_num == self.gs.dealer)
+        else:
+            return cards.from_mask(self.legal_play_mask(player))
+
+    def legal_play_mask(self, player):
+        """Return bitmask of the cards player may play to the current trick.
+
+        player (Player): player object of player to play
+
+        """
+        cip = self.gs.cards_in_play
+        return moves.legal_play_mask(cards.cards_to_mask(player.hand),
+                                     cip[0].suit if cip else None,
+                                     self.gs.trump)
+
     def publish(self, status, pNum, data):
         """Translate game actions into messages for clients.
 
@@ -310,7 +320,14 @@ class Game:
         data (int or Card): Card object being played by player for modes
             trp, crd, eot, eoh, eog; integer encoding of bid for bid and eob.
 
+        In pure mode, only the hand count is updated and status is returned.
+
         """
+        if self.pure:
+            if status in ['eoh', 'eog']:
+                self.gs.hand_number += 1
+            return status
+
         gs = self.gs # Make local copy for speed++; it's not edited in here.
 
         # Initialize the output. Message always contains actvP, so do it here.
@@ -331,7 +348,7 @@ class Game:
             # Player played Card.
 
             if status in ['eot', 'eoh', 'eog']:
-                message['remP'] = gs._t_w_card.owner
+                message['remP'] = gs._t_w_player
                 # Player won the trick with Card.
 
                 if status in ['eoh', 'eog']:
@@ -403,11 +420,38 @@ class Game:
         if status in ['eoh', 'eog']:
             gs.hand_number += 1
 
-        if status in ['eog']:
+        if status in ['eog'] and self.persist:
             self.dbupdate()
 
         return output
 
+    def restore(self, snap):
+        """Roll back to a state returned by snapshot().
+
+        snap (tuple): return value of snapshot()
+
+        """
+        gs_snap, hands, self.deck, deck_cards, rng_state = snap
+        self.gs.restore(gs_snap)
+        for player, hand in zip(self.players, hands):
+            player.hand = list(hand)
+        self.deck[:] = deck_cards
+        self.rng.setstate(rng_state)
+
+    def snapshot(self):
+        """Return a compact copy of the game for hypothetical play.
+
+        A search can call snapshot(), apply handle_bid/handle_card_played to
+        try out moves, and then restore() to undo them. The RNG state is kept
+        so a hand dealt during hypothetical play is dealt again identically.
+        Note that a game ended during hypothetical play is still written to
+        the database unless persist is off or the game is pure.
+
+        """
+        return (self.gs.snapshot(),
+                [list(player.hand) for player in self.players],
+                self.deck, list(self.deck), self.rng.getstate())
+
     def start_game(self, plr_arg = ["Test0", "Test1", "Test2", "Test3"]):
         """Start a new game, deal first hands, and send msgs.
 
@@ -448,6 +492,7 @@ class Game:
                 sco=self.gs.scores,
                 highBid=self.gs.high_bid,
                 declarer=self.gs.declarer,
-                cip=[(c.code, c.owner) for c in self.gs.cards_in_play])
+                cip=[(c.code, self.gs.owners[c.code])
+                     for c in self.gs.cards_in_play])
             )
         return message
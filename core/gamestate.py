@@ -1,6 +1,7 @@
 #!/usr/bin/python2
 import common
 import core.cards as cards
+import core.tricks as tricks
 
 import logging
 log = logging.getLogger(__name__)
@@ -14,6 +15,9 @@ NUM_PLAYERS = NUM_TEAMS * TEAM_SIZE
 MODE_PLAY = 1
 MODE_BID = 2
 
+# Game point value of each rank; ranks not listed are worth nothing.
+GAME_POINT_VALUES = {10: 10, 11: 1, 12: 2, 13: 3, 14: 4}
+
 
 class GameState(object):
     """Define object for GameState with class variables:
@@ -31,7 +35,15 @@ class GameState(object):
     cards_in_play (list): list of Card objects for cards in play
     scores (list of integers): score for each team
     team_stacks (list of lists of Card objects): Cards taken this hand
+    high_card (Card): highest trump taken so far this hand
+    low_card (Card): lowest trump taken so far this hand
+    jack_holder (int): team that took the Jack of trump this hand, or None
+    game_points (list of integers): game points taken this hand by each team
+    owners (dict): card code : local player id of player dealt that card
     events (list): every output published, stored for db writes
+
+    The high/low/jack/game fields are kept up to date as each trick is taken,
+    so the points so far in a hand are available at any time.
     """
     def __init__(self, game_id):
         self.game_id = game_id
@@ -43,7 +55,8 @@ class GameState(object):
         self.active_player = 0
         self.cards_in_play = []
         self.scores = [0]*NUM_TEAMS
-        self.team_stacks = [[] for _ in range(NUM_TEAMS)]
+        self.reset_hand()
+        self.owners = {}
         self.winner = 0.5 # Halfway between Team 0 and 1. Crafty, I know.
 
         # Count hands for logging/data collection and also to end the game
@@ -55,6 +68,7 @@ class GameState(object):
 
         # Journalist's variables to publish().
         self._t_w_card = None
+        self._t_w_player = None
         self._results = None
         self.countercinch = False
 
@@ -93,60 +107,59 @@ class GameState(object):
         if len(self.cards_in_play) != NUM_PLAYERS:
             return None
 
-        # Determine which suit wins the trick.
-        if self.trump_played():
-            winning_suit = self.trump
-        else:
-            winning_suit = self.suit_led()
-
-        # Find the winning card and determine who played it.
-        current_highest_card_rank = 0
-        for each in self.cards_in_play:
-            if each.suit == winning_suit:
-                if each.rank > current_highest_card_rank:
-                    current_highest_card_rank = each.rank
-                    current_highest_card = each
+        current_highest_card = tricks.winning_card(self.trump,
+                                                   self.cards_in_play)
         self._t_w_card = current_highest_card # For logging purposes.
+        # Ownership is reset when the next hand is dealt, so keep the winner.
+        self._t_w_player = self.owners[current_highest_card.code]
         return current_highest_card
 
-    def score_hand(self):
-        """Score a completed hand and adjust scores.
+    def reset_hand(self):
+        """Clear the cards taken and the running points for a new hand."""
+        self.team_stacks = [[] for _ in range(NUM_TEAMS)]
+        self.high_card = None
+        self.low_card = None
+        self.jack_holder = None
+        self.game_points = [0]*NUM_TEAMS # Allows for arbitrary number of teams
 
-        Assumption is that teams are of equal size and seated alternately.
-        Code should work for any number of teams with any (equal) number of
-        players. This method does not verify that the hand is actually over.
+    def take_trick(self, team):
+        """Move the cards in play to a team's stack and update the points.
 
-        return list of score changes for this hand, to be used for logging.
+        team (int): index of the team that won the trick
 
         """
-        # Initialize the comparison variables.
-        current_high_rank = 0
-        current_low_rank = 15
-        current_best_game_point_total = 0
-        game_points = [0]*NUM_TEAMS # Allows for arbitrary number of teams
-        jack_holder = None # Jack not necessarily out
-        game_holder = None # Game not necessarily out (ties)
-        declarer_set = False
+        for card in self.cards_in_play:
+            if card.suit == self.trump:
+                if self.high_card is None or card.rank > self.high_card.rank:
+                    self.high_card = card
+                if self.low_card is None or card.rank < self.low_card.rank:
+                    self.low_card = card
+                if card.rank == 11:
+                    self.jack_holder = team
+            self.game_points[team] += GAME_POINT_VALUES.get(card.rank, 0)
+
+        self.team_stacks[team] += self.cards_in_play
+        self.cards_in_play = []
+
+    def hand_points(self):
+        """Return the match points taken so far in the current hand.
+
+        High and low go to the team of the player who was dealt the card.
+        Jack and game go to the team that took them; game is None while
+        tied. The high and low holders are None until trump has been taken.
 
-        # team_number and *_holder are indices referencing a particular team.
-        for team_number in range(len(self.team_stacks)):
-            for card in self.team_stacks[team_number]:
-                if card.suit == self.trump:
-                    if card.rank > current_high_rank:
-                        current_high_rank = card.rank
-                        high_holder = (card.owner % TEAM_SIZE)
-                    if card.rank < current_low_rank:
-                        current_low_rank = card.rank
-                        low_holder = (card.owner % TEAM_SIZE)
-                    if card.rank == 11:
-                        jack_holder = team_number
-                if card.rank > 10:
-                    game_points[team_number] += (card.rank - 10)
-                if card.rank == 10:
-                    game_points[team_number] += card.rank
+        return dict with keys high_holder, low_holder, jack_holder,
+            game_holder, and game_points.
+
+        """
+        high_holder = low_holder = game_holder = None
+        if self.high_card is not None:
+            high_holder = self.owners[self.high_card.code] % TEAM_SIZE
+            low_holder = self.owners[self.low_card.code] % TEAM_SIZE
 
         # Determine who gets the Game point, no point for a tie.
-        for team, team_total in list(enumerate(game_points)):
+        current_best_game_point_total = 0
+        for team, team_total in list(enumerate(self.game_points)):
             if team_total > current_best_game_point_total:
                 current_best_game_point_total = team_total
                 game_holder = team
@@ -154,6 +167,31 @@ class GameState(object):
                 if team_total == current_best_game_point_total:
                     game_holder = None
 
+        return dict(high_holder = high_holder,
+                    low_holder = low_holder,
+                    jack_holder = self.jack_holder,
+                    game_holder = game_holder,
+                    game_points = list(self.game_points))
+
+    def score_hand(self):
+        """Score a completed hand and adjust scores.
+
+        Assumption is that teams are of equal size and seated alternately.
+        Code should work for any number of teams with any (equal) number of
+        players. This method does not verify that the hand is actually over.
+        Points taken are tallied trick by trick in take_trick(), so this only
+        has to award them.
+
+        return list of score changes for this hand, to be used for logging.
+
+        """
+        points = self.hand_points()
+        high_holder = points['high_holder']
+        low_holder = points['low_holder']
+        jack_holder = points['jack_holder']
+        game_holder = points['game_holder']
+        declarer_set = False
+
         # All cards accounted for, now assign temp points to teams.
         temp_points = [0]*TEAM_SIZE # Initialize to be able to increment
         temp_points[high_holder] += 1
@@ -189,9 +227,46 @@ class GameState(object):
                             jack_holder = jack_holder,
                             game_holder = game_holder,
                             declarer_set = declarer_set,
-                            game_points = game_points)
+                            game_points = points['game_points'])
         return
 
+    def declarer_set(self):
+        """Return True if the declarer was set on the last hand scored."""
+        return bool(self._results and self._results['declarer_set'])
+
+    def snapshot(self):
+        """Return a compact copy of the mutable game state.
+
+        Cards are shared, immutable objects, so only the lists holding them
+        are copied. Events are only ever appended, so just their count is
+        kept. Pass the result to restore() to roll back to this point; a
+        snapshot can be restored any number of times.
+
+        """
+        return (self.game_mode, self.trump, self.dealer, self.high_bid,
+                self.declarer, self.active_player, list(self.cards_in_play),
+                list(self.scores), [list(x) for x in self.team_stacks],
+                self.high_card, self.low_card, self.jack_holder,
+                list(self.game_points), self.owners, self.winner,
+                self.hand_number, len(self.events), self._t_w_card,
+                self._t_w_player, self._results, self.countercinch)
+
+    def restore(self, snap):
+        """Roll back to a state returned by snapshot()."""
+        (self.game_mode, self.trump, self.dealer, self.high_bid,
+         self.declarer, self.active_player, cards_in_play, scores,
+         team_stacks, self.high_card, self.low_card, self.jack_holder,
+         game_points, self.owners, self.winner, self.hand_number, num_events,
+         self._t_w_card, self._t_w_player, self._results,
+         self.countercinch) = snap
+
+        # Copy again so the snapshot survives changes made after restoring
+        self.cards_in_play = list(cards_in_play)
+        self.scores = list(scores)
+        self.team_stacks = [list(x) for x in team_stacks]
+        self.game_points = list(game_points)
+        del self.events[num_events:]
+
 
 if __name__ == "__main__":
     log.warning("Are your cats old enough to learn about Jesus?")
@@ -0,0 +1,63 @@
+#!/usr/bin/python2
+"""Legal move generation shared by the game engine and AI agents.
+
+The server validates every bid and play against these functions, and agents
+use them to choose among legal moves, so the two can never disagree about
+what is legal.
+
+"""
+import core.cards as cards
+
+
+# Bid constants
+PASS = 0
+CINCH = 5
+
+
+def legal_bids(high_bid, is_dealer):
+    """Return list of legal bids in ascending order (PASS first if legal).
+
+    high_bid (int): current high bid; anything below 1 means no bid yet
+    is_dealer (bool): whether the bidder is the dealer
+
+    Each bid must beat the high bid, except that the dealer may always
+    Cinch (counter-cinch). A dealer that everyone else passed to is stuck
+    and must bid.
+
+    """
+    bids = [] if (is_dealer and high_bid < 1) else [PASS]
+    bids.extend(range(max(high_bid, PASS) + 1, CINCH + 1))
+    if is_dealer and high_bid == CINCH:
+        bids.append(CINCH)
+    return bids
+
+def legal_play_mask(hand_mask, led_suit, trump):
+    """Return bitmask of legal plays from a hand.
+
+    hand_mask (int): bitmask of cards in hand (see core.cards)
+    led_suit (int): suit led this trick, or None if leading
+    trump (int): trump suit, or None if not yet declared
+
+    Any card may be led. Otherwise, a player must follow suit or play trump
+    if they can follow suit, and may play anything if they can't.
+
+    """
+    if led_suit is None:
+        return hand_mask
+    follow = hand_mask & cards.SUIT_MASKS[led_suit]
+    if not follow:
+        return hand_mask # Throwing off
+    if trump is not None:
+        follow |= hand_mask & cards.SUIT_MASKS[trump]
+    return follow
+
+def legal_plays(hand, led_suit, trump):
+    """Return list of the Card objects in hand that are legal to play.
+
+    hand (list): Card objects in hand; order is preserved
+    led_suit (int): suit led this trick, or None if leading
+    trump (int): trump suit, or None if not yet declared
+
+    """
+    mask = legal_play_mask(cards.cards_to_mask(hand), led_suit, trump)
+    return [card for card in hand if mask >> (card.code - 1) & 1]
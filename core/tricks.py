@@ -0,0 +1,97 @@
+#!/usr/bin/python2
+"""Trick resolution shared by the game engine and AI agents.
+
+Whether one card beats another in a trick depends only on the trump suit, the
+suit led, and the two cards. Every card is given a strength for each
+(trump, led suit) pair ahead of time: trump beats the suit led, which beats
+everything else, with rank deciding within a suit. Cards that can't win the
+trick have strength 0. Resolving a trick is then a table lookup per card.
+
+Tables are keyed by trump suit, including None for before trump is set.
+
+"""
+import core.cards as cards
+
+
+# Lookup tables, filled below.
+# STRENGTH[trump][led][code] (int): strength of card `code` in a trick
+# BEATEN_BY[trump][led][code] (int): bitmask of cards that beat card `code`
+STRENGTH = {}
+BEATEN_BY = {}
+SUIT_OF = [None] + [cards.CARDS[code].suit
+                    for code in range(1, cards.MAX_CARD_CODE+1)]
+
+
+def strength(trump, led, code):
+    """Return the strength of a card in a trick; higher wins."""
+    return STRENGTH[trump][led][code]
+
+def beats(trump, led, code, other_code):
+    """Return True if card `code` beats card `other_code` in a trick."""
+    table = STRENGTH[trump][led]
+    return table[code] > table[other_code]
+
+def winning_index(trump, codes):
+    """Return the position of the winning card in a list of card codes.
+
+    codes (list): card codes in play order; codes[0] is the card led.
+
+    """
+    table = STRENGTH[trump][SUIT_OF[codes[0]]]
+    best = 0
+    for i in range(1, len(codes)):
+        if table[codes[i]] > table[codes[best]]:
+            best = i
+    return best
+
+def winning_card(trump, trick):
+    """Return the Card object that wins a trick.
+
+    trick (list): Card objects in play order; trick[0] is the card led.
+
+    """
+    return trick[winning_index(trump, [card.code for card in trick])]
+
+def winning_seat(trump, codes, leader, num_players=4):
+    """Return the player number that wins a trick.
+
+    codes (list): card codes in play order; codes[0] is the card led.
+    leader (int): player number of the player that led.
+
+    """
+    return (leader + winning_index(trump, codes)) % num_players
+
+def beating_mask(trump, codes):
+    """Return bitmask of the cards that would take a trick from its winner.
+
+    codes (list): card codes played so far; codes[0] is the card led.
+
+    """
+    led = SUIT_OF[codes[0]]
+    return BEATEN_BY[trump][led][codes[winning_index(trump, codes)]]
+
+def fillTables():
+    """Store strengths and beaten-by masks for every trump/led/card combo."""
+    for trump in cards.SUITS + [None]:
+        STRENGTH[trump] = {}
+        BEATEN_BY[trump] = {}
+        for led in cards.SUITS:
+            table = [0]
+            for code in range(1, cards.MAX_CARD_CODE+1):
+                rank, suit = cards.decode(code)
+                if suit == trump:
+                    table.append(200 + rank)
+                elif suit == led:
+                    table.append(100 + rank)
+                else:
+                    table.append(0)
+            STRENGTH[trump][led] = table
+
+            masks = [0]
+            for code in range(1, cards.MAX_CARD_CODE+1):
+                masks.append(cards.to_mask(
+                    other for other in range(1, cards.MAX_CARD_CODE+1)
+                    if table[other] > table[code]))
+            BEATEN_BY[trump][led] = masks
+
+fillTables()
@@ -0,0 +1,251 @@
+#!/usr/bin/python2
+"""Background writer for finished games.
+
+Writing a game used to happen inline at the end of the last play, with one
+insert per game event and a commit per game. Finished games are now handed
+to a GameWriter, which queues them and writes them in the background. Each
+batch of games is written in one transaction, and each game's events are
+written with multi-row inserts.
+
+The writer's loop is a greenlet, but SQLite calls block, so each batch is
+written on a real OS thread from the gevent hub's threadpool. The hub keeps
+serving rooms and sockets while a batch is written. The writer opens its own
+database connection for this (see common.connect_db), as common.db's single
+connection is in use on the hub's thread.
+
+The loop only runs when the hub does. Callers that never yield to the hub,
+such as ai.simulator, call `flush` to wait for their games to be written.
+
+The queue is bounded, so a stalled database can't grow memory without limit.
+Submitting never blocks the caller, which is usually a Room's actor: once
+MAX_PENDING_GAMES are waiting, further games are dropped, counted and logged.
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+  MAX_PENDING_GAMES (int): Most finished games held in memory at once.
+  MAX_BATCH_GAMES (int): Most games written in one transaction.
+  ROWS_PER_INSERT (int): Most event rows per INSERT statement. Each row uses
+    4 placeholders, and SQLite allows 999 per statement.
+
+Public classes:
+  GameWriter: Queue and background writer for finished games.
+
+Public methods:
+  submit: Queue a finished game with the shared GameWriter.
+  backlog: Return the number of games waiting to be written.
+  dropped: Return the number of games dropped because the queue was full.
+  flush: Wait until the shared GameWriter has written every queued game.
+  shutdown: Write all queued games and stop the shared GameWriter.
+
+"""
+
+import threading
+import atexit
+import traceback
+
+import gevent
+from gevent.queue import JoinableQueue, Empty, Full
+
+import logging
+log = logging.getLogger(__name__)
+
+import common
+
+# Constants
+MAX_PENDING_GAMES = 256
+MAX_BATCH_GAMES = 32
+ROWS_PER_INSERT = 200
+
+
+class GameWriter(object):
+    """Queue and background writer for finished games.
+
+    A game is submitted as a dict with keys `timestamp` (string), `names`
+    (list of player names in seat order), and `events` (list of dicts with
+    keys `hand_num`, `timestamp` and `output`, as kept in GameState.events).
+
+    Attributes:
+      db (DAL): Database holding the Games and Events tables. None until the
+        first write, if the writer opens its own connection.
+      queue (JoinableQueue): Games waiting to be written; None asks the
+        writer to stop once everything before it is written.
+      batchSize (int): Most games written in one transaction.
+      greenlet (Greenlet): Writer loop, once started.
+      written (int): Games written so far.
+      dropped (int): Games dropped because the queue was full.
+
+    """
+    def __init__(self, database=None, maxPending=MAX_PENDING_GAMES,
+                 batchSize=MAX_BATCH_GAMES):
+        """Create a writer. It doesn't run until started.
+
+        Args:
+          database (DAL, optional): Target database. By default, the writer
+            opens its own connection to the game database when it first
+            writes, on the thread doing the write.
+          maxPending (int, optional): Most games held in the queue.
+          batchSize (int, optional): Most games written per transaction.
+
+        """
+        self.db = database
+        self.queue = JoinableQueue(maxPending)
+        self.batchSize = batchSize
+        self.greenlet = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the writer loop, in a greenlet."""
+        self.greenlet = gevent.spawn(self.run)
+
+    def submit(self, game):
+        """Queue a finished game. Drops it if the queue is full."""
+        try:
+            self.queue.put_nowait(game)
+        except Full:
+            self.dropped += 1
+            log.error('Write queue full; dropped game %s (%s dropped so far).',
+                      game['timestamp'], self.dropped)
+
+    def backlog(self):
+        """Return the number of games waiting to be written."""
+        return self.queue.qsize()
+
+    def flush(self):
+        """Wait until every queued game is written. Blocks the greenlet.
+
+        Waiting yields to the gevent hub, which is what runs the writer loop.
+
+        """
+        if self.greenlet is not None:
+            self.queue.join()
+
+    def close(self):
+        """Write every queued game, then stop the writer loop."""
+        if self.greenlet is None:
+            return
+        self.queue.put(None)
+        self.greenlet.join()
+        self.greenlet = None
+
+    def run(self):
+        """Write batches of games from the queue until asked to stop."""
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            running = None not in batch
+            games = [x for x in batch if x is not None]
+            try:
+                if games:
+                    # SQLite blocks; write on a thread so the hub keeps running
+                    error = gevent.get_hub().threadpool.apply(self.writeBatch,
+                                                              (games,))
+                    if error is None:
+                        log.info('Wrote %s games to the database.',
+                                 len(games))
+                    else:
+                        log.error('Failed to write %s games; rolled back.'
+                                  '\n%s', len(games), error)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def writeBatch(self, games):
+        """Write a list of games in a single transaction.
+
+        If the write fails, the transaction is rolled back and the games are
+        dropped, so one bad game can't wedge the writer.
+
+        This runs on a threadpool thread, so it doesn't log: once gevent has
+        monkey patched the server, logging's locks belong to the hub, and
+        waiting on one from another thread fails. The caller logs instead.
+
+        Returns:
+          str: Traceback of the failure, or None if the games were written.
+
+        """
+        db = self.db
+        try:
+            if db is None:
+                db = self.db = common.connect_db()
+            sql = 'INSERT INTO {0} ({1}, {2}, {3}, {4}) VALUES '.format(
+                db.Events._tablename, db.Events.game_id.name,
+                db.Events.HandNumber.name, db.Events.Timestamp.name,
+                db.Events.EventString.name)
+
+            for game in games:
+                names = game['names']
+                game_id = db.Games.insert(
+                    Timestamp=game['timestamp'],
+                    PlayerName0=names[0],
+                    PlayerName1=names[1],
+                    PlayerName2=names[2],
+                    PlayerName3=names[3]
+                )
+
+                events = game['events']
+                for n in range(0, len(events), ROWS_PER_INSERT):
+                    chunk = events[n:n+ROWS_PER_INSERT]
+                    values = []
+                    for action in chunk:
+                        values.extend([game_id, action['hand_num'],
+                                       action['timestamp'], action['output']])
+                    rows = ', '.join(['(?, ?, ?, ?)'] * len(chunk))
+                    db.executesql(sql + rows, values)
+
+            db.commit()
+        except Exception:
+            if db is not None:
+                db.rollback()
+            return traceback.format_exc()
+
+        self.written += len(games)
+
+
+# Shared writer used by core.game, started on first use
+_writer = None
+_lock = threading.Lock()
+
+
+def submit(game):
+    """Queue a finished game with the shared GameWriter, starting it if new."""
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = GameWriter()
+            _writer.start()
+            atexit.register(shutdown)
+    _writer.submit(game)
+
+
+def backlog():
+    """Return the number of games waiting for the shared writer."""
+    return _writer.backlog() if _writer is not None else 0
+
+
+def dropped():
+    """Return the number of games the shared writer dropped."""
+    return _writer.dropped if _writer is not None else 0
+
+
+def flush():
+    """Wait until the shared writer has written every queued game."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def shutdown():
+    """Write all queued games and stop the shared GameWriter."""
+    global _writer
+    with _lock:
+        if _writer is not None:
+            log.info('Flushing %s queued games to the database.',
+                     _writer.backlog())
+            _writer.close()
+            _writer = None
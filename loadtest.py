@@ -0,0 +1,287 @@
+#!/usr/bin/python2
+"""Load generator for the Cinch socketio server.
+
+Requires socketIO-client package, available here:
+https://github.com/invisibleroads/socketIO-client
+
+This simulates many socket clients against a running server (see cinch.py)
+to find out how much traffic one server process can handle. Each simulated
+game creates a room from the Lobby, then fills it with scripted players,
+which are AI agents that pick random legal moves. Alternatively, seats 1-3
+can be filled with server-side AIs summoned through the AI manager. Games
+are played to completion, with a bounded number running at once. Idle
+clients can also be parked in the Lobby to load its broadcasts.
+
+Every client is a greenlet (socketIO-client is made cooperative by gevent's
+monkey patching), so thousands of clients can run in one process.
+
+Reported measurements:
+  join->startData: Time from the last join sent by a harness client to a
+    room until each of its players receives start data.
+  play->broadcast: Time from a scripted player sending a bid or play until
+    it receives the server's broadcast of that action.
+  messages/sec: Socket events received by all harness clients, per second.
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+
+Public classes:
+  LoadStats: Latency samples and counters collected during a run.
+  LoadBot: Scripted player that records its latencies.
+
+Public methods:
+  play_room: Create, fill and play out one room.
+  run_load: Run a full load test and return its LoadStats.
+
+"""
+
+# Make socketIO-client and its sockets cooperative
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+from gevent.pool import Pool
+
+import argparse
+import random
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+from socketIO_client import SocketIO, BaseNamespace
+
+from common import SOCKETIO_PORT, SOCKETIO_NS
+from ai.base import AIBase, NUM_PLAYERS
+
+
+class LoadStats(object):
+    """Latency samples and counters collected during a run.
+
+    Attributes:
+      joinStart (list): join->startData latencies, in milliseconds.
+      playBroadcast (list): play->broadcast latencies, in milliseconds.
+      messages (int): Socket events received by all harness clients.
+      games (int): Games played to completion.
+      errors (int): Games that failed or timed out.
+      started (float): Time the run started.
+      elapsed (float): Length of the run in seconds, once finished.
+
+    """
+    def __init__(self):
+        """Initialize empty stats for a run starting now."""
+        self.joinStart = []
+        self.playBroadcast = []
+        self.messages = 0
+        self.games = 0
+        self.errors = 0
+        self.started = time.time()
+        self.elapsed = None
+
+    def __repr__(self):
+        """Return a multi-line report of the stats."""
+        elapsed = self.elapsed or (time.time() - self.started)
+        out = "Games: {0}\t\tErrors: {1}\t\tTime: {2:.1f}s\n".format(
+            self.games, self.errors, elapsed)
+        out += "Messages/sec: {0:.1f}\n".format(self.messages / elapsed)
+        for label, samples in [('join->startData', self.joinStart),
+                               ('play->broadcast', self.playBroadcast)]:
+            out += "{0}: n={1} p50={2:.1f} p90={3:.1f} p99={4:.1f} " \
+                "max={5:.1f} (ms)\n".format(label, len(samples),
+                                           *percentiles(samples))
+        return out
+
+
+def percentiles(samples):
+    """Return p50, p90, p99 and max of a list of samples (0 if empty)."""
+    if not samples:
+        return [0.0] * 4
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return [ordered[int(round(last * p))] for p in (0.5, 0.9, 0.99)] + \
+        [ordered[-1]]
+
+
+class LoadBot(AIBase):
+    """Scripted player that records its latencies.
+
+    Moves are chosen at random from the legal moves, so games look much like
+    games between RandAI agents.
+
+    Attributes:
+      run (dict): State shared by the harness clients in one room; `lastJoin`
+        holds the time of the latest join sent to the room.
+      stats (LoadStats): Where latencies and counts are recorded.
+      sentAt (float): Time the pending bid or play was sent, if any.
+
+    """
+    identity = {'name': 'LoadBot'}
+
+    def __init__(self, room, seat, run, stats):
+        """Connect, join the room and seat, and start recording.
+
+        Args:
+          room (int): Target game room number.
+          seat (int): Target seat within game room.
+          run (dict): State shared by the harness clients in the room.
+          stats (LoadStats): Where latencies and counts are recorded.
+
+        """
+        self.run = run
+        self.stats = stats
+        self.sentAt = None
+        AIBase.__init__(self, room, seat, self.identity)
+
+    def setupSocket(self, port=SOCKETIO_PORT):
+        """Create socket connection, timing start data separately."""
+        AIBase.setupSocket(self, port)
+        self.ns.on('startData', self.on_startData)
+
+    def join(self, room, seat):
+        """Make request to join room, noting the time sent."""
+        self.run['lastJoin'] = time.time()
+        AIBase.join(self, room, seat)
+
+    def on_startData(self, msg):
+        """Record join->startData latency, then handle start data."""
+        self.stats.messages += 1
+        self.stats.joinStart.append(
+            (time.time() - self.run['lastJoin']) * 1000)
+        AIBase.handle_game_action(self, msg)
+
+    def handle_game_action(self, *args):
+        """Record play->broadcast latency for own moves, then handle."""
+        self.stats.messages += 1
+        msg = args[0] if args else {}
+        if self.sentAt is not None and msg.get('actor') == self.pNum:
+            self.stats.playBroadcast.append(
+                (time.time() - self.sentAt) * 1000)
+            self.sentAt = None
+        AIBase.handle_game_action(self, *args)
+
+    def bid(self):
+        """Bid at random from the legal bids."""
+        self.sentAt = time.time()
+        self.send_bid(random.choice(self.legal_bids()))
+
+    def play(self):
+        """Play a random legal card."""
+        self.sentAt = time.time()
+        self.send_play(random.choice(self.legal_plays()))
+
+
+def connect_lobby(nickname, stats=None):
+    """Connect a client to the server and join the Lobby.
+
+    Args:
+      nickname (str): Nickname for the client.
+      stats (LoadStats, optional): If given, Lobby updates received by the
+        client are counted as messages.
+
+    Returns:
+      tuple: (SocketIO, namespace) for the client.
+
+    """
+    socket = SocketIO('127.0.0.1', SOCKETIO_PORT)
+    ns = socket.define(BaseNamespace, SOCKETIO_NS)
+    if stats is not None:
+        def count(*args):
+            stats.messages += 1
+        for event in ['rooms', 'lobbyDelta', 'enter', 'exit', 'chat']:
+            ns.on(event, count)
+    ns.emit('nickname', nickname)
+    ns.emit('join', 0, 0)  # Room 0 is the Lobby
+    return socket, ns
+
+
+def play_room(stats, aiModel=None, timeout=300):
+    """Create, fill and play out one room.
+
+    Args:
+      stats (LoadStats): Where latencies and counts are recorded.
+      aiModel (int, optional): AI model ID for server-side AIs in seats 1-3.
+        If not given, all four seats get scripted players.
+      timeout (int, optional): Seconds to wait for the game to finish.
+
+    """
+    try:
+        socket, ns = connect_lobby('LoadHost')
+        roomNum = []
+        args = dict((str(seat), aiModel) for seat in range(1, NUM_PLAYERS)) \
+            if aiModel else {}
+        ns.emit('createRoom', args, roomNum.append)
+        socket.wait_for_callbacks(seconds=timeout)
+        socket.disconnect()
+
+        run = {'lastJoin': time.time()}
+        seats = [0] if aiModel else range(NUM_PLAYERS)
+
+        def seat_bot(seat):
+            LoadBot(roomNum[0], seat, run, stats).start()
+
+        bots = [gevent.spawn(seat_bot, seat) for seat in seats]
+        gevent.joinall(bots, timeout=timeout, raise_error=True)
+        if not all(bot.ready() for bot in bots):
+            gevent.killall(bots)
+            raise RuntimeError('Game timed out')
+        stats.games += 1
+    except Exception as e:
+        log.error('Room failed: {0}'.format(repr(e)))
+        stats.errors += 1
+
+
+def run_load(games, concurrency, idle=0, aiModel=None, timeout=300):
+    """Run a load test and return its stats.
+
+    Args:
+      games (int): Number of games to play.
+      concurrency (int): Most games in progress at once.
+      idle (int, optional): Idle clients to park in the Lobby.
+      aiModel (int, optional): AI model ID for seats 1-3; see play_room.
+      timeout (int, optional): Seconds to wait for each game to finish.
+
+    Returns:
+      LoadStats: Measurements from the run.
+
+    """
+    stats = LoadStats()
+    lobby = [connect_lobby('LoadIdle{0}'.format(n), stats)
+             for n in range(idle)]
+    waiters = [gevent.spawn(socket.wait) for socket, ns in lobby]
+
+    pool = Pool(concurrency)
+    for _ in range(games):
+        pool.spawn(play_room, stats, aiModel, timeout)
+    pool.join()
+    stats.elapsed = time.time() - stats.started
+
+    for socket, ns in lobby:
+        socket.disconnect()
+    gevent.killall(waiters)
+    return stats
+
+
+def main():
+    """Run a load test from the command line and print the report."""
+    parser = argparse.ArgumentParser(
+        description='Load generator for the Cinch server.')
+    parser.add_argument('-n', '--games', type=int, default=10,
+                        help='number of games to play (default=10)')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='most games in progress at once (default=10)')
+    parser.add_argument('-i', '--idle', type=int, default=0,
+                        help='idle clients to park in the Lobby (default=0)')
+    parser.add_argument('-a', '--ai', type=int, default=None,
+                        help='AI model ID for seats 1-3 (default=scripted)')
+    parser.add_argument('-t', '--timeout', type=int, default=300,
+                        help='seconds allowed per game (default=300)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print(run_load(args.games, args.concurrency, args.idle, args.ai,
+                   args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,7 +29,8 @@ function CinchViewModel() {
     var self = this;
 
     //Data
-    self.socket = CinchApp.socket;
+    self.socket = CinchApp.socket; //Socket for the current room
+    self.lobbySocket = CinchApp.socket; //Socket for the Lobby
     self.actionQueue = []; //Don't add to this directly: call self.addAction
     self.isWindowActive = ko.observable(true);
     self.urlParameters = ko.observable({});
@@ -52,6 +53,7 @@ function CinchViewModel() {
     self.curRoom = ko.observable();
     self.activeView = ko.observable();
     self.games = ko.observableArray([]);
+    self.lobbyVersion = 0; //Version of lobby feed reflected in self.games
     self.players = ko.observableArray(ko.utils.arrayMap([
             CinchApp.players.south,
             CinchApp.players.west,
@@ -269,6 +271,7 @@ function CinchViewModel() {
 
         if(!navigateAwayMessage || (navigateAwayMessage && confirm(navigateAwayMessage))) {
             self.socket.emit('exit');
+            self.useSocket(self.lobbySocket); //Leave the game's server, if any
             self.socket.emit('room_list'); //Update room list in Lobby
 
             //Clean up from last game
@@ -332,9 +335,30 @@ function CinchViewModel() {
         self.urlParameters(urlParameters);
     };
 
+    //Make a socket the one used for the current room, closing the old one
+    //unless it is the Lobby socket
+    self.useSocket = function(socket) {
+        if (self.socket !== socket && self.socket !== self.lobbySocket) {
+            self.socket.disconnect();
+        }
+        self.socket = socket;
+        CinchApp.socket = socket;
+    };
+
     self.joinCallback = function(msg) {
         //Message could be empty if there was an issue joining the room
-        if (msg) {
+        if (msg && msg.port) {
+            //The room is hosted on another server process; join it there,
+            //staying connected to the Lobby for room updates
+            var gameSocket = io.connect(location.protocol + '//' + location.hostname +
+                ':' + msg.port + '/cinch', {'force new connection': true});
+
+            self.setUpSocket(gameSocket);
+            self.useSocket(gameSocket);
+            gameSocket.emit('nickname', self.username());
+            gameSocket.emit('join', msg.roomNum, msg.mySeat, self.joinCallback);
+        }
+        else if (msg) {
             self.curRoom(msg.roomNum);
             self.activeView(CinchApp.views.game);
             self.chats([]); //Clear any chats from before game start
@@ -350,6 +374,7 @@ function CinchViewModel() {
             history.pushState(null, "Cinch Home", window.location.href.replace(window.location.search, ""));
 
             //Join failed, so just go to the lobby
+            self.useSocket(self.lobbySocket);
             self.socket.emit('join', 0, 0);
             self.activeView(CinchApp.views.lobby);
         }
@@ -419,8 +444,8 @@ function CinchViewModel() {
         }
     };
 
-    self.setUpSocket = function() {
-        var socket = self.socket;
+    self.setUpSocket = function(socket) {
+        socket = socket || self.socket;
 
         //Adds action to queue with console message: unlockBoard() must be added within handler()
         //TODO Note: this isn't compatible with events that are sent multiple parameters.
@@ -452,12 +477,56 @@ function CinchViewModel() {
             var i = 0;
 
             self.games([]); //Clear existing list
+            self.lobbyVersion = msg.v;
 
-            for(i = 0; i < msg.length; i++) {
-                self.games.push(new Game(msg[i]));
+            for(i = 0; i < msg.rooms.length; i++) {
+                self.games.push(new Game(msg.rooms[i]));
             }
         });
 
+        addSocketHandler('lobbyDelta', function(msg) {
+            var i, j;
+            var games = self.games();
+
+            if (msg.v <= self.lobbyVersion) {
+                return; //Already reflected in the last snapshot
+            }
+            if (msg.prev != self.lobbyVersion) {
+                //Missed an update; start over from a fresh snapshot
+                socket.emit('room_list');
+                return;
+            }
+            self.lobbyVersion = msg.v;
+
+            //Changed rooms overwrite their old listing, or are added if new
+            for (i = 0; i < msg.rooms.length; i++) {
+                for (j = 0; j < games.length; j++) {
+                    if (games[j].number == msg.rooms[i].num) {
+                        break;
+                    }
+                }
+
+                if (j < games.length) {
+                    games[j].isFull(msg.rooms[i].isFull);
+                    games[j].started(msg.rooms[i].started);
+                    games[j].seatChart(msg.rooms[i].seatChart);
+                }
+                else {
+                    games.push(new Game(msg.rooms[i]));
+                }
+            }
+
+            for (i = 0; i < msg.gone.length; i++) {
+                for (j = games.length - 1; j >= 0; j--) {
+                    if (games[j].number == msg.gone[i]) {
+                        games.splice(j, 1);
+                    }
+                }
+            }
+
+            self.games(games); //Update observable array
+        });
+
         addSocketHandler('chat', function(msg) {
             self.chats.push(new VisibleMessage(msg[1], msg[0]));
 
@@ -471,10 +540,6 @@ function CinchViewModel() {
             self.logError(msg);
         });
 
-        addSocketHandler('newRoom', function(msg) {
-            self.games.push(new Game(msg));
-        });
-
         addSocketHandler('seatChart', function(msg) {
             var i = 0, j = 0;
             var players = self.players();
@@ -592,27 +657,6 @@ function CinchViewModel() {
             setRoomFullStatus(false, roomNum);
         });
 
-        addSocketHandler('roomGone', function(roomNum) {
-            //Remove room from games list
-            var i;
-            var games = self.games();
-
-            for (i = 0; i < games.length; i++) {
-                if (games[i].number == roomNum) {
-                    games.splice(i, 1); // Remove element i from array
-                    self.games(games); // Update observable array
-                }
-            }
-        });
-
-        addSocketHandler('gameStarted', function(roomNum) {
-            ko.utils.arrayForEach(self.games(), function(item) {
-                if (item.number == roomNum) {
-                    item.started(true);
-                }
-            });
-        });
-
         // Game message handlers
         addSocketHandler('startData', function(msg) {
             var app = CinchApp;
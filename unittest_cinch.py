@@ -55,24 +55,317 @@ class BadInput(unittest.TestCase):
         
     def testBadRankSuit(self):
         """encode should fail with invalid input"""
-        c = cards.Card(1)
         for r in (-1, 0, 1, 15, 20):
-            c.rank = r
-            self.assertRaises(cards.InvalidRankError, c.encode)
+            self.assertRaises(cards.InvalidRankError, cards.encode, r, 0)
+            self.assertRaises(cards.InvalidRankError, cards.Card, r, 0)
         
-        c.rank = 2 # Reset to valid rank
         for s in (-1, 4):
-            c.suit = s
-            self.assertRaises(cards.InvalidSuitError, c.encode)
+            self.assertRaises(cards.InvalidSuitError, cards.encode, 2, s)
+            self.assertRaises(cards.InvalidSuitError, cards.Card, 2, s)
     
 class SanityCheck(unittest.TestCase):
     def testSanity(self):
         """encode(decode(n))==n for all n"""
-        c = cards.Card(1) # Initialize Card object
-        
         for integer in card_codes:
-            c.rank, c.suit = cards.decode(integer)
-            self.assertEqual(integer, c.encode())
+            r, s = cards.decode(integer)
+            self.assertEqual(integer, cards.encode(r, s))
+
+class FlyweightTests(unittest.TestCase):
+    def testInterned(self):
+        """cards with the same code should be the same immutable object"""
+        import copy
+        for integer in card_codes:
+            c = cards.Card(integer)
+            self.assertIs(c, cards.Card(c.rank, c.suit))
+            self.assertIs(c, copy.deepcopy(c))
+        self.assertEqual(52, len(set(map(id, cards.Deck()))))
+        self.assertRaises(AttributeError, setattr, c, 'rank', 2)
+        self.assertRaises(AttributeError, setattr, c, 'owner', 0)
+
+class BitmaskTests(unittest.TestCase):
+    def testRoundTrip(self):
+        """from_mask(to_mask(codes)) should give back sorted codes"""
+        codes = [52, 1, 14, 36, 27]
+        mask = cards.to_mask(codes)
+        self.assertEqual(sorted(codes), cards.from_mask(mask))
+        self.assertEqual(len(codes), cards.popcount(mask))
+        self.assertEqual(cards.FULL_MASK, cards.to_mask(card_codes))
+
+    def testSuitMasks(self):
+        """suit masks should partition the deck by suit"""
+        for code in card_codes:
+            r, s = cards.decode(code)
+            self.assertTrue(cards.card_bit(code) & cards.SUIT_MASKS[s])
+        self.assertEqual(cards.FULL_MASK, sum(cards.SUIT_MASKS))
+
+    def testHighLowInSuit(self):
+        """highest/lowest in suit should find extreme ranks or None"""
+        hand = [cards.Card(r, s) for r, s in ((3, 1), (11, 1), (14, 1),
+                                                (2, 3), (10, 0))]
+        mask = cards.cards_to_mask(hand)
+        self.assertEqual(cards.encode(14, 1), cards.highest_in_suit(mask, 1))
+        self.assertEqual(cards.encode(3, 1), cards.lowest_in_suit(mask, 1))
+        self.assertEqual(cards.encode(2, 3), cards.highest_in_suit(mask, 3))
+        self.assertEqual(None, cards.highest_in_suit(mask, 2))
+        self.assertEqual(None, cards.lowest_in_suit(mask, 2))
+
+class DeckSeedTests(unittest.TestCase):
+    def deals(self, seed, numHands=3):
+        """Return hands dealt by a game's RNG stream, as card code lists."""
+        from core.game import Game
+        g = Game(False, seed)
+        return [[c.code for c in cards.Deck(g.rng).deal(9)]
+                for _ in range(numHands)]
+
+    def testReproducible(self):
+        """games with the same seed should deal the same hands"""
+        self.assertEqual(self.deals(42), self.deals(42))
+        self.assertNotEqual(self.deals(42), self.deals(43))
+
+    def testNewDealEachHand(self):
+        """successive hands in a seeded game should differ"""
+        hands = self.deals(42)
+        self.assertNotEqual(hands[0], hands[1])
+
+    def testDeal(self):
+        """deal should remove cards from the top of the deck"""
+        d = cards.Deck()
+        top = d[-9:]
+        self.assertEqual(top, d.deal(9))
+        self.assertEqual(43, len(d))
+
+def play_hand(g):
+    """Bid and play out a hand in Game g, always making the first legal move."""
+    for _ in range(4):
+        g.handle_bid(g.gs.active_player, g.legal_moves()[0])
+    while g.gs.game_mode == 1 and len(g.players[0].hand) > 0:
+        out = g.handle_card_played(g.gs.active_player, g.legal_moves()[0])
+    return out
+
+class SnapshotTests(unittest.TestCase):
+    def testRestore(self):
+        """restore should undo a hand and allow it to be replayed"""
+        from core.game import Game
+        g = Game(False, 7)
+        g.start_game()
+        snap = g.snapshot()
+        state = (repr(g.gs), [list(p.hand) for p in g.players])
+        numEvents = len(g.gs.events)
+
+        first = play_hand(g)
+        self.assertNotEqual(state[0], repr(g.gs))
+
+        for _ in range(2):
+            g.restore(snap)
+            self.assertEqual(state, (repr(g.gs),
+                                     [list(p.hand) for p in g.players]))
+            self.assertEqual(numEvents, len(g.gs.events))
+            self.assertEqual(first, play_hand(g))
+
+class PureModeTests(unittest.TestCase):
+    def testPureMatchesNormal(self):
+        """pure mode should reach the same state without logging events"""
+        from core.game import Game
+
+        normal = Game(False, 11)
+        normal.start_game()
+        pure = Game(False, 11, pure=True)
+        self.assertEqual('sog', pure.start_game())
+
+        self.assertEqual('eoh', play_hand(pure))
+        play_hand(normal)
+
+        # Game IDs differ, so compare from the second line of the summary
+        self.assertEqual(repr(normal.gs).split('\n', 1)[1],
+                         repr(pure.gs).split('\n', 1)[1])
+        self.assertEqual(normal.gs.hand_number, pure.gs.hand_number)
+        self.assertEqual([p.hand for p in normal.players],
+                         [p.hand for p in pure.players])
+        self.assertEqual([], pure.gs.events)
+
+class HandPointsTests(unittest.TestCase):
+    def testRunningPoints(self):
+        """running hand points should match a scan of the taken cards"""
+        from core.game import Game
+        from core.gamestate import GAME_POINT_VALUES
+        g = Game(False, 3, pure=True)
+        g.start_game()
+        for _ in range(4):
+            g.handle_bid(g.gs.active_player, g.legal_moves()[0])
+
+        for _ in range(8):  # Stop one trick short of the end of the hand
+            for _ in range(4):
+                g.handle_card_played(g.gs.active_player, g.legal_moves()[0])
+
+            gs = g.gs
+            taken = gs.team_stacks[0] + gs.team_stacks[1]
+            trumps = [c.rank for c in taken if c.suit == gs.trump]
+            points = gs.hand_points()
+            self.assertEqual(max(trumps), gs.high_card.rank)
+            self.assertEqual(min(trumps), gs.low_card.rank)
+            for team in (0, 1):
+                self.assertEqual(
+                    sum(GAME_POINT_VALUES.get(c.rank, 0)
+                        for c in gs.team_stacks[team]),
+                    points['game_points'][team])
+
+class TrickTests(unittest.TestCase):
+    def testWinner(self):
+        """trick resolution should favor trump, then the suit led"""
+        from core import tricks
+        enc = cards.encode
+        # Diamonds led, no trump played: high diamond wins over high spade
+        trick = [enc(5, 1), enc(14, 3), enc(9, 1), enc(2, 1)]
+        self.assertEqual(2, tricks.winning_index(0, trick))
+        self.assertEqual(3, tricks.winning_seat(0, trick, 1))
+        # Low trump (clubs) beats the suit led
+        trick[3] = enc(2, 0)
+        self.assertEqual(3, tricks.winning_index(0, trick))
+        self.assertEqual(cards.Card(2, 0), tricks.winning_card(
+            0, [cards.Card(c) for c in trick]))
+        # Only higher trumps can take it now
+        self.assertEqual(cards.to_mask(enc(r, 0) for r in range(3, 15)),
+                         tricks.beating_mask(0, trick))
+
+def memoryGameDB():
+    """Return an in-memory database with the Games and Events tables."""
+    from db.dal import DAL, Field
+    mem = DAL('sqlite:memory')
+    mem.define_table('Games', *[Field(x) for x in ['Timestamp'] +
+                                ['PlayerName%d' % n for n in range(4)]])
+    mem.define_table('Events', Field('game_id', 'reference Games'),
+                     Field('HandNumber', 'integer'), Field('Timestamp'),
+                     Field('EventString', 'text'))
+    return mem
+
+class WriterTests(unittest.TestCase):
+    def testBatchWrite(self):
+        """queued games should all be written, in batches, on close"""
+        from db.writer import GameWriter
+        mem = memoryGameDB()
+
+        w = GameWriter(mem, batchSize=2)
+        w.start()
+        events = [{'hand_num': n // 100, 'timestamp': 't', 'output': str(n)}
+                  for n in range(450)]
+        for _ in range(3):
+            w.submit(dict(timestamp='t', names=list('abcd'), events=events))
+        w.close()
+
+        self.assertEqual(3, w.written)
+        self.assertEqual(3, mem(mem.Games).count())
+        self.assertEqual(1350, mem(mem.Events).count())
+        self.assertEqual(['0', '1'], [r.EventString for r in
+                                      mem(mem.Events).select(limitby=(0, 2))])
+
+    def testHubRunsDuringWrite(self):
+        """the gevent hub should keep running while a batch is written"""
+        import time
+        import gevent
+        from db.writer import GameWriter
+
+        class SlowWriter(GameWriter):
+            def writeBatch(self, games):
+                time.sleep(0.3)  # Blocks its thread, like a long transaction
+                self.written += len(games)
+
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(time.time())
+                gevent.sleep(0.01)
+
+        w = SlowWriter(database=object())
+        w.start()
+        ticker = gevent.spawn(tick)
+        w.submit(dict(timestamp='t'))
+        gevent.sleep(0.2)
+        self.assertEqual(0, w.written)  # Batch still being written
+        self.assertTrue(len(ticks) > 10)
+        w.close()
+        ticker.kill()
+        self.assertEqual(1, w.written)
+
+    def testFullQueueDrops(self):
+        """submitting to a full queue should drop the game, not block"""
+        from db.writer import GameWriter
+        w = GameWriter(database=object(), maxPending=1)
+        w.submit(dict(timestamp='t1'))
+        w.submit(dict(timestamp='t2'))
+        self.assertEqual((1, 1), (w.backlog(), w.dropped))
+
+class MetricsTests(unittest.TestCase):
+    def testHistogram(self):
+        """latency percentiles should report the bound of their bucket"""
+        from web.metrics import Metrics
+        m = Metrics()
+        for ms in [0.5, 3, 3, 40, 700]:
+            m.record('on_play', ms)
+        m.gauge('rooms', lambda: 2)
+        snap = m.snapshot()
+        self.assertEqual(2, snap['gauges']['rooms'])
+        self.assertEqual(5, snap['events']['on_play']['count'])
+        self.assertEqual(5.0, snap['events']['on_play']['p50'])
+        self.assertEqual(1000.0, snap['events']['on_play']['p99'])
+        self.assertEqual(7, m.timed('on_bid', lambda x: x + 1, 6))
+        self.assertEqual(1, m.histograms['on_bid'].count)
+
+    def testThreadedRecord(self):
+        """samples recorded from many threads at once should all count"""
+        import sys
+        import threading
+        from web.metrics import Metrics
+        m = Metrics()
+
+        def work():
+            for n in range(2000):
+                m.record('ai.{0}.bid'.format(n % 50), 1.5)
+                if n % 500 == 0:
+                    m.snapshot()
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)  # Switch threads as often as possible
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval(interval)
+
+        hists = m.histograms.values()
+        self.assertEqual(16000, sum(h.count for h in hists))
+        self.assertEqual(16000, sum(sum(h.counts) for h in hists))
+
+class MoveTests(unittest.TestCase):
+    def testBids(self):
+        """legal bids should follow stuck dealer and counter-cinch rules"""
+        from core import moves
+        self.assertEqual([0, 1, 2, 3, 4, 5], moves.legal_bids(0, False))
+        self.assertEqual([1, 2, 3, 4, 5], moves.legal_bids(0, True))
+        self.assertEqual([0, 4, 5], moves.legal_bids(3, True))
+        self.assertEqual([0], moves.legal_bids(5, False))
+        self.assertEqual([0, 5], moves.legal_bids(5, True))
+
+    def testPlays(self):
+        """legal plays should follow suit or trump, else allow throwing off"""
+        from core import moves
+        hand = [cards.Card(2, 0), cards.Card(3, 1), cards.Card(4, 2)]
+        self.assertEqual(hand, moves.legal_plays(hand, None, 0))
+        self.assertEqual(hand[:2], moves.legal_plays(hand, 1, 0))
+        self.assertEqual(hand[1:2], moves.legal_plays(hand, 1, None))
+        self.assertEqual(hand, moves.legal_plays(hand, 3, 0))
+
+    def testServerAgrees(self):
+        """the game should accept exactly the moves it reports as legal"""
+        from core.game import Game
+        g = Game(False, 3)
+        g.start_game()
+        p = g.gs.active_player
+        self.assertEqual(g.legal_moves(), [b for b in range(6)
+            if g.check_bid_legality(g.players[p], b)])
+        self.assertEqual([], g.legal_moves((p + 1) % 4))
 
 class AITests(unittest.TestCase):
     def __init__(self, p):
@@ -147,5 +440,844 @@ class AITests(unittest.TestCase):
         self.assertFalse(func(4))
         self.assertTrue(func(0))
 
+class SimulatorTests(unittest.TestCase):
+    def testHeadlessGame(self):
+        """simulator should play a full game without a server"""
+        from ai.manager import get_ai_models
+        from ai.simulator import Simulator
+
+        aiClasses = get_ai_models()
+        sim = Simulator([aiClasses[0]] * 4)  # Rand in every seat
+        result = sim.playGame()
+
+        self.assertIn(result['win'], (0, 1, 0.5))
+        self.assertTrue(result['hands'] > 0)
+        self.assertEqual(len(sim.game.players[0].hand), 0)
+        self.assertEqual([None] * 4, [agent.budget for agent in sim.agents])
+
+    def testPersistManyGames(self):
+        """persisted games should all be written, however many are played"""
+        import db.writer as writer
+        from ai.manager import get_ai_models
+        from ai.simulator import Simulator
+
+        mem = memoryGameDB()
+        writer._writer = writer.GameWriter(mem)
+        writer._writer.start()
+        try:
+            sim = Simulator([get_ai_models()[0]] * 4, persist=True)
+            games = writer.MAX_PENDING_GAMES + 44
+            for n in range(games):
+                sim.playGame(n)
+            self.assertEqual(0, writer.dropped())
+            self.assertEqual(0, writer.backlog())
+            self.assertEqual(games, mem(mem.Games).count())
+        finally:
+            writer.shutdown()
+
+class AgentPoolTests(unittest.TestCase):
+    def testPooledBid(self):
+        """a pooled agent should send back a legal bid when it is active"""
+        from ai.base import LocalNamespace
+        from ai.manager import AgentPool, get_ai_models
+        from core.game import Game
+        from web.metrics import registry
+
+        pool = AgentPool(get_ai_models(), processes=2)
+        try:
+            g = Game(False, 5)
+            initData = g.start_game()
+            p = g.gs.active_player
+            emits = []
+            ns = lambda seat: LocalNamespace(seat, lambda *x: emits.append(x))
+            agents = [pool.factory(1)(1, seat, ns(seat)) for seat in range(4)]
+            self.assertEqual([2, 2], pool.load)
+            name = 'ai.{0}.bid'.format(agents[p].shadow.name)
+            timed = registry.histograms.get(name)
+            before = timed.count if timed else 0
+            for msg in initData:
+                agents[msg['tgt']].handle_game_action(msg)
+
+            for _ in range(10):
+                if emits:
+                    break
+                pool.dispatch(pool.homes[agents[p].agentId], 0.5)
+            seat, event, bid = emits[0]
+            self.assertEqual((p, 'bid'), (seat, event))
+            self.assertTrue(g.handle_bid(seat, bid))
+            # Timed in this process, not just in the worker's metrics
+            self.assertEqual(before + 1, registry.histograms[name].count)
+
+            agents[0].stop()
+            self.assertEqual(3, sum(pool.load))
+        finally:
+            pool.close()
+
+    def startPooledGame(self, pool):
+        """Seat four pooled agents in a new game; return (game, emits)."""
+        from ai.base import LocalNamespace
+        from core.game import Game
+
+        g = Game(False, 5)
+        initData = g.start_game()
+        emits = []
+        ns = lambda seat: LocalNamespace(seat, lambda *x: emits.append(x))
+        self.agents = [pool.factory(1)(1, seat, ns(seat))
+                       for seat in range(4)]
+        for msg in initData:
+            self.agents[msg['tgt']].handle_game_action(msg)
+        return g, emits
+
+    def testHungWorker(self):
+        """a hung worker's agent should have a legal bid sent for it"""
+        import gevent
+        import os
+        import signal
+        from ai.manager import AgentPool, get_ai_models
+
+        pool = AgentPool(get_ai_models(), processes=1, deadline=0.2)
+        pool.start()
+        os.kill(pool.procs[0].pid, signal.SIGSTOP)
+        try:
+            g, emits = self.startPooledGame(pool)
+            p = g.gs.active_player
+            gevent.sleep(0.5)
+            self.assertEqual(1, len(emits))
+            seat, event, bid = emits[0]
+            self.assertEqual((p, 'bid'), (seat, event))
+            self.assertTrue(g.handle_bid(seat, bid))
+
+            # The agent's own bid, once the worker wakes, comes too late
+            os.kill(pool.procs[0].pid, signal.SIGCONT)
+            gevent.sleep(0.5)
+            self.assertEqual(1, len(emits))
+        finally:
+            os.kill(pool.procs[0].pid, signal.SIGCONT)
+            pool.close()
+
+    def testDeadWorker(self):
+        """a dead worker should be replaced, and its agents rebuilt there"""
+        import gevent
+        import os
+        import signal
+        from ai.manager import AgentPool, get_ai_models
+
+        pool = AgentPool(get_ai_models(), processes=1, deadline=5)
+        pool.start()
+        try:
+            g, emits = self.startPooledGame(pool)
+            for _ in range(20):
+                if emits:
+                    break
+                gevent.sleep(0.1)
+            seat, event, bid = emits.pop()
+            res = g.handle_bid(seat, bid)
+            self.assertTrue(res)
+
+            dead = pool.procs[0]
+            os.kill(dead.pid, signal.SIGKILL)
+            for _ in range(20):
+                if pool.procs[0] is not dead:
+                    break
+                gevent.sleep(0.1)
+            self.assertTrue(pool.procs[0].is_alive())
+
+            # The rebuilt agents carry on with the game
+            for agent in self.agents:
+                agent.handle_game_action(res)
+            for _ in range(20):
+                if emits:
+                    break
+                gevent.sleep(0.1)
+            seat, event, bid = emits.pop()
+            self.assertEqual((res['actvP'], 'bid'), (seat, event))
+            self.assertTrue(g.handle_bid(seat, bid))
+            self.assertEqual([], [x for x in pool.agents.values()
+                                  if x.timer is not None])
+        finally:
+            pool.close()
+
+class AgentRosterTests(unittest.TestCase):
+    def testCapAndReuse(self):
+        """summons over the cap should wait, then reuse a finished agent"""
+        import threading
+        import time
+        from ai.manager import AgentRoster
+
+        gate = threading.Event()
+        made, played = [], []
+
+        class FakeAI(object):
+            def __init__(self, room, seat, ns):
+                made.append(self)
+            def playGame(self, room, seat, timeout=None):
+                gate.wait(5)
+                played.append((room, seat))
+
+        roster = AgentRoster([FakeAI], maxAgents=1)
+        roster.summon(1, 1, 1)
+        roster.summon(2, 3, 1)
+        self.assertEqual((1, 1), (roster.busy, len(roster.waiting)))
+
+        gate.set()
+        for _ in range(50):
+            if roster.busy == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual([(1, 1), (2, 3)], played)
+        self.assertEqual(1, len(made))
+        self.assertEqual({'busy': 0, 'idle': 1, 'waiting': 0, 'created': 1},
+                         roster.counts())
+
+    def waitIdle(self, roster):
+        import time
+        for _ in range(50):
+            if roster.busy == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(0, roster.busy)
+
+    def testReusedAgentStartsClean(self):
+        """an agent's second game should not see its first game's state"""
+        from ai.Goofus import Goofus
+        from ai.HAL import HAL
+        from ai.manager import AgentRoster
+
+        seen = []
+
+        def recordAndDirty(agent, room, seat):
+            seen.append((agent.name, seat, agent.pNum, agent.hand,
+                         agent.gs.highBid, agent.perGame()))
+            agent.hand = [1, 2, 3]
+            agent.gs.highBid = 4
+            agent.dirty()
+
+        class TestHAL(HAL):
+            identity = {'name': 'HAL'}
+            connect = recordAndDirty
+            def perGame(self):
+                return self.targetTrump
+            def dirty(self):
+                self.targetTrump = 2
+
+        class TestGoofus(Goofus):
+            identity = {'name': 'Goofus'}
+            connect = recordAndDirty
+            def perGame(self):
+                return (self.bidSuit, self.legalPlays)
+            def dirty(self):
+                self.bidSuit = 3
+                self.legalPlays = [5]
+
+        roster = AgentRoster([TestHAL, TestGoofus], maxAgents=1)
+        for seat in (1, 2):
+            for model in (1, 2):
+                roster.summon(1, seat, model)
+                self.waitIdle(roster)
+
+        self.assertEqual([('HAL', 1, 1, [], -1, None),
+                          ('Goofus', 1, 1, [], -1, (None, [])),
+                          ('HAL', 2, 2, [], -1, None),
+                          ('Goofus', 2, 2, [], -1, (None, []))], seen)
+        self.assertEqual(2, roster.created)
+
+    def testFailedCreationFreesSlot(self):
+        """an agent that can't be created should not keep its slot"""
+        from ai.manager import AgentRoster
+
+        class BrokenAI(object):
+            def __init__(self, room, seat, ns):
+                raise RuntimeError("no agent today")
+
+        roster = AgentRoster([BrokenAI], maxAgents=1)
+        roster.summon(1, 1, 1)
+        self.waitIdle(roster)
+        self.assertEqual({'busy': 0, 'idle': 0, 'waiting': 0, 'created': 1},
+                         roster.counts())
+
+class AIManagerTests(unittest.TestCase):
+    def testReportsSentByManager(self):
+        """agent counts should be sent from the manager's thread only"""
+        import threading
+        import time
+        from ai.manager import AIManager
+
+        class FakeAI(object):
+            def __init__(self, room, seat, ns):
+                pass
+            def playGame(self, room, seat, timeout=None):
+                pass
+
+        emits = []
+        class TestManager(AIManager):
+            def setupSocket(self):
+                self.ns = self  # Records emits instead
+            def emit(self, event, *args):
+                emits.append((threading.current_thread(), event, args))
+            def run(self):
+                pass  # Served by the test instead
+
+        manager = TestManager()
+        manager.roster.aiClasses = [FakeAI]
+        manager.roster.summon(1, 1, 1)
+        manager.roster.summon(2, 1, 1)
+        for _ in range(50):
+            if manager.roster.busy == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual([], emits)  # Nothing sent from the roster's threads
+
+        manager.sendReport()
+        manager.sendReport()  # Nothing new to send
+        self.assertEqual([(threading.current_thread(), 'aiStats',
+                           (manager.roster.counts(),))], emits)
+
+class DecisionBudgetTests(unittest.TestCase):
+    def testOverrunFallsBack(self):
+        """an agent over its time budget should be cut off and bid lowest"""
+        from ai.base import AIBase, LocalNamespace
+        from core.game import Game
+        from web.metrics import registry
+
+        class StuckAI(AIBase):
+            budget = 0.05
+            def bid(self):
+                while True:
+                    pass
+
+        g = Game(False, 5)
+        initData = g.start_game()
+        p = g.gs.active_player
+        emits = []
+        agent = StuckAI(1, p, {'name': 'StuckAI'},
+                        LocalNamespace(p, lambda *x: emits.append(x)))
+        for msg in initData:
+            if msg['tgt'] == p:
+                agent.handle_game_action(msg)
+
+        self.assertEqual([(p, 'bid', agent.legal_bids()[0])], emits)
+        self.assertEqual(1, registry.histograms['ai.StuckAI.overrun'].count)
+
+    def testTimeoutNotCaughtByAgent(self):
+        """an agent's `except Exception` shouldn't swallow the timeout"""
+        from ai.base import AIBase, LocalNamespace
+        from core.game import Game
+
+        class CarelessAI(AIBase):
+            budget = 0.05
+            def bid(self):
+                try:
+                    while True:
+                        pass
+                except Exception:
+                    self.send_bid(self.legal_bids()[-1])
+
+        g = Game(False, 5)
+        initData = g.start_game()
+        p = g.gs.active_player
+        emits = []
+        agent = CarelessAI(1, p, {'name': 'CarelessAI'},
+                           LocalNamespace(p, lambda *x: emits.append(x)))
+        for msg in initData:
+            if msg['tgt'] == p:
+                agent.handle_game_action(msg)
+
+        self.assertEqual([(p, 'bid', agent.legal_bids()[0])], emits)
+
+    def testOnlyDeciderInterrupted(self):
+        """the alarm should interrupt only the greenlet that is deciding"""
+        import gevent
+        import signal
+        import time
+        from ai.base import AIBase, LocalNamespace
+        from core.game import Game
+
+        class YieldingAI(AIBase):
+            budget = 0.05
+            def bid(self):
+                gevent.sleep(0)  # Not allowed, but lets busy() overrun
+                while True:
+                    pass
+
+        def busy():
+            end = time.time() + 0.2
+            while time.time() < end:
+                pass
+            return 'done'
+
+        g = Game(False, 5)
+        initData = g.start_game()
+        p = g.gs.active_player
+        emits = []
+        agent = YieldingAI(1, p, {'name': 'YieldingAI'},
+                           LocalNamespace(p, lambda *x: emits.append(x)))
+        handler = signal.getsignal(signal.SIGALRM)
+        other = gevent.spawn(busy)
+        for msg in initData:
+            if msg['tgt'] == p:
+                agent.handle_game_action(msg)
+
+        self.assertEqual('done', other.get())
+        self.assertEqual([(p, 'bid', agent.legal_bids()[0])], emits)
+        self.assertEqual(handler, signal.getsignal(signal.SIGALRM))
+
+class CardTrackerTests(unittest.TestCase):
+    def testVoidsAndRemaining(self):
+        """tracker should infer voids from plays and count unseen cards"""
+        from ai.base import CardTracker
+        from core.cards import popcount
+
+        t = CardTracker()
+        t.deal([1, 2])  # 2C, 3C
+        t.play(1, 14, 1, None)  # 2D led
+        t.play(2, 27, 1, 0)  # 2H thrown off on diamonds; void in diamonds
+        t.play(3, 3, 1, 0)  # 4C trumps in; no inference
+
+        self.assertTrue(t.isVoid(2, 1))
+        self.assertFalse(t.isVoid(3, 1))
+        self.assertTrue(t.isSeen(14))
+        self.assertFalse(t.couldHold(2, 15))  # 3D
+        self.assertTrue(t.couldHold(3, 15))
+        self.assertFalse(t.couldHold(3, 1))  # Dealt to me
+        self.assertEqual(47, popcount(t.remaining))
+
+    def testHALUnseenWinners(self):
+        """HAL should count only unseen cards that beat its trick"""
+        from ai.base import LocalNamespace
+        from ai.HAL import HAL
+        from core.cards import Card
+
+        class TestHAL(HAL):
+            identity = {'name': 'HAL'}
+
+        hal = TestHAL(1, 2, LocalNamespace(2, lambda *args: None))
+        hal.gs.trump = 0  # Clubs
+        hal.gs.tracker.deal([1, 25])  # 2C, KD
+        hal.gs.tracker.play(0, 17, 1, 0)  # 5D led by partner
+        hal.gs.tracker.play(1, 21, 1, 0)  # 9D
+
+        winners = hal.getUnseenCardCodesThatWinTrick(
+            [Card(17), Card(21), Card(25)])
+        self.assertEqual(range(2, 14) + [26], winners)  # 3C-AC, AD
+
+        hal.gs.tracker.play(3, 30, 1, 0)  # Seat 3 throws off 5H
+        winners = hal.getUnseenCardCodesThatWinTrick(
+            [Card(17), Card(21), Card(25)])
+        self.assertEqual(range(2, 14), winners)  # AD can't be with seat 3
+
+def importServer():
+    """Import web.server without its gevent monkey patching.
+
+    The rest of the suite relies on real threads and sockets.
+
+    """
+    from gevent import monkey
+    patch = monkey.patch_all
+    monkey.patch_all = lambda *args, **kwargs: None
+    try:
+        import web.server
+    finally:
+        monkey.patch_all = patch
+    return web.server
+
+class FakeSocket(object):
+    """Socket stand-in keeping the (event, args) of every packet sent."""
+    def __init__(self, sessid):
+        import json
+        self.sessid = sessid
+        self.session = {}
+        self.json_dumps = json.dumps
+        self.namespaces = {}
+        self.sent = []
+        self.ackCallbacks = {}
+
+    def __getitem__(self, ns):
+        return self.namespaces[ns]
+
+    def put_client_msg(self, frame):
+        import json
+        from socketio import packet
+        pkt = packet.decode(frame, json.loads)
+        self.sent.append((pkt['name'], pkt['args']))
+
+    def send_packet(self, pkt):
+        from socketio import packet
+        self.put_client_msg(packet.encode(pkt, self.json_dumps))
+
+    def _get_next_msgid(self):
+        return len(self.ackCallbacks) + 1
+
+    def _save_ack_callback(self, msgid, callback):
+        self.ackCallbacks[msgid] = callback
+
+    def events(self, name):
+        return [args for event, args in self.sent if event == name]
+
+class ServerTestCase(unittest.TestCase):
+    """Base for tests of web.server with fake sockets and no listener."""
+    def setUp(self):
+        self.server = importServer()
+        self.rooms = self.server.RoomRegistry()
+        self.lobby = self.server.LobbyFeed(self.rooms)
+        self.request = {'rooms': self.rooms, 'lobby': self.lobby,
+                        'aiInfo': {}, 'aiStats': {}, 'aiClasses': None}
+        self.savedRequest = self.server.Server.request
+        self.server.Server.request = self.request
+        self.rooms.add(self.server.Room(self.server.LOBBY))
+
+    def tearDown(self):
+        self.server.Server.request = self.savedRequest
+        if self.lobby.flusher is not None:
+            self.lobby.flusher.kill()
+        for room in list(self.rooms):
+            room.close()
+
+    def connect(self, nickname):
+        """Return a namespace for a new client, placed in the Lobby."""
+        from common import SOCKETIO_NS
+        sock = FakeSocket(nickname)
+        ns = self.server.GameNamespace(
+            {'socketio': sock, 'REMOTE_ADDR': '127.0.0.1'}, SOCKETIO_NS,
+            self.request)
+        sock.namespaces[SOCKETIO_NS] = ns
+        ns.session['nickname'] = nickname
+        ns.moveToRoom(roomNum=self.server.LOBBY, seat=0)
+        return ns
+
+    def settle(self):
+        """Let spawned greenlets, like room actors, run."""
+        import gevent
+        gevent.sleep(0)
+        gevent.sleep(0)
+
+class GameNamespaceTests(ServerTestCase):
+    def testMoveWithoutGameRejected(self):
+        """bids and plays with no game in progress should get an 'err'"""
+        ns = self.connect('a')
+        ns.on_bid('1')  # In the Lobby
+        room = self.rooms.create()
+        ns.on_exit()
+        ns.on_join(room.num, 2)
+        ns.on_play('3')  # Seated, but the room isn't full yet
+
+        errs = ns.socket.events('err')
+        self.assertEqual(2, len(errs))
+        self.assertTrue(all('No game in progress' in x[0] for x in errs))
+        self.assertTrue(self.rooms.get(self.server.LOBBY).inbox.empty())
+        self.assertTrue(room.inbox.empty())
+
+class RoomRegistryTests(ServerTestCase):
+    def testAddRemoveLookup(self):
+        """the registry should find, list and drop rooms by number"""
+        Room, rooms = self.server.Room, self.server.RoomRegistry()
+        lobby = Room(self.server.LOBBY)
+        rooms.add(lobby)
+        one, two = rooms.create(), rooms.create()
+        self.assertEqual((1, 2), (one.num, two.num))
+        rooms.add(Room(7))  # As a shard worker adds rooms it is sent
+        self.assertEqual(8, rooms.create().num)
+
+        self.assertIs(two, rooms.get(2))
+        self.assertIs(lobby, rooms.get(self.server.LOBBY))
+        self.assertIsNone(rooms.get(5))
+        self.assertEqual([0, 1, 2, 7, 8], [x.num for x in rooms])
+        self.assertEqual((5, 4), (len(rooms), rooms.liveRoomCount()))
+
+        rooms.remove(two)
+        rooms.remove(two)  # Already gone; does nothing
+        self.assertIsNone(rooms.get(2))
+        self.assertEqual([0, 1, 7, 8], [x.num for x in rooms])
+        self.assertEqual(9, rooms.create().num)  # Numbers aren't reused
+
+class BroadcastTests(ServerTestCase):
+    def testEncodedOnce(self):
+        """a broadcast should encode its packet once for all recipients"""
+        import json
+        calls = []
+        def dumps(data):
+            calls.append(data)
+            return json.dumps(data)
+
+        socks = [FakeSocket(str(n)) for n in range(3)]
+        for sock in socks:
+            sock.json_dumps = dumps
+        self.server.broadcast(socks, 'chat', [['a', 'hi']])
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([[('chat', [['a', 'hi']])]] * 3,
+                         [sock.sent for sock in socks])
+
+    def testRoomEmitNotMe(self):
+        """room emits should reach the room, or the room but the sender"""
+        room = self.rooms.create()
+        a, b = self.connect('a'), self.connect('b')
+        for ns, seat in ((a, 1), (b, 2)):
+            ns.on_exit()
+            ns.on_join(room.num, seat)
+        del a.socket.sent[:], b.socket.sent[:]
+
+        a.on_chat('hello')
+        a.emit_to_room_not_me('exit', 'a', room.num, 1)
+        self.assertEqual([('chat', [['a', 'hello']])], a.socket.sent)
+        self.assertEqual([('chat', [['a', 'hello']]),
+                          ('exit', ['a', room.num, 1])], b.socket.sent)
+
+class LobbyFeedTests(ServerTestCase):
+    def testCoalescedVersionedDeltas(self):
+        """changes within an interval should go out as one versioned delta"""
+        import gevent
+        watcher = self.connect('w')
+        one, two = self.rooms.create(), self.rooms.create()
+        watcher.recv_connect()  # Sends the snapshot
+        self.assertEqual([[{'v': 0, 'rooms': [one.summary(),
+                                              two.summary()]}]],
+                         watcher.socket.events('rooms'))
+
+        self.lobby.touch(one)
+        self.lobby.touch(two)
+        flusher = self.lobby.flusher
+        one.started = True
+        self.lobby.touch(one)  # Same room again; sent once, as it is now
+        self.rooms.remove(two)
+        self.lobby.drop(two.num)
+        self.assertIs(flusher, self.lobby.flusher)
+        gevent.sleep(self.server.LOBBY_UPDATE_INTERVAL + 0.05)
+
+        delta = {'v': 1, 'prev': 0, 'rooms': [one.summary()],
+                 'gone': [two.num]}
+        self.assertEqual([[delta]], watcher.socket.events('lobbyDelta'))
+        self.assertEqual({'v': 1, 'rooms': [one.summary()]},
+                         self.lobby.snapshot())
+
+        self.lobby.flush()  # Nothing pending, so no delta
+        self.lobby.touch(one)
+        self.lobby.flush()
+        self.assertEqual([(1, 0), (2, 1)],
+                         [(x[0]['v'], x[0]['prev']) for x in
+                          watcher.socket.events('lobbyDelta')])
+
+class EventTimingTests(ServerTestCase):
+    def testCallMethodTimed(self):
+        """each dispatched event should be timed under its handler's name"""
+        from web.metrics import Metrics
+        saved, self.server.metrics = self.server.metrics, Metrics()
+        try:
+            ns = self.connect('a')
+            pkt = {'type': 'event', 'name': 'nickname', 'args': ['b']}
+            self.assertEqual('b', ns.call_method('on_nickname', pkt, 'b'))
+            self.assertRaises(TypeError, ns.call_method, 'on_nickname', pkt)
+            hists = self.server.metrics.histograms
+        finally:
+            self.server.metrics = saved
+
+        self.assertEqual(['on_nickname'], list(hists))
+        self.assertEqual(2, hists['on_nickname'].count)  # Failures too
+
+class RoomIndexTests(ServerTestCase):
+    def testUsersAndSeats(self):
+        """a room's user and seat index should follow joins and exits"""
+        lobby = self.rooms.get(self.server.LOBBY)
+        room = self.rooms.create()
+        a, b = self.connect('a'), self.connect('b')
+        self.assertEqual({}, lobby.seats)  # Seats aren't kept in the Lobby
+
+        a.on_exit()
+        a.on_join(room.num, 1)
+        b.on_exit()
+        b.on_join(room.num, 2)
+        self.assertEqual(set(['a', 'b']), set(room.users))
+        self.assertEqual({1: a.socket, 2: b.socket}, room.seats)
+        self.assertEqual({}, lobby.users)
+        self.assertEqual([0, 3], room.getAvailableSeats())
+
+        a.on_exit()  # Back to the Lobby, then into another seat
+        self.assertEqual({2: b.socket}, room.seats)
+        self.assertEqual(['a'], list(lobby.users))
+        a.on_join(room.num, 3)
+        self.assertEqual({2: b.socket, 3: a.socket}, room.seats)
+        self.assertEqual(set([('a', 3), ('b', 2)]),
+                         set(room.getSeatingChart()))
+
+        b.on_exit()
+        b.on_exit()  # Leaves the Lobby too, as on disconnect
+        self.assertEqual({3: a.socket}, room.seats)
+        self.assertEqual(['a'], list(room.users))
+        self.assertEqual({}, lobby.users)
+
+class JoinTests(ServerTestCase):
+    def testAckBeforeStartData(self):
+        """the last player's join ack should be ready before start data"""
+        room = self.rooms.create()
+        players = [self.connect(name) for name in 'abcd']
+        for seat, ns in enumerate(players):
+            ns.on_exit()
+            ack = ns.on_join(room.num, seat)
+
+        # The ack goes out when on_join returns; the game isn't started yet
+        self.assertEqual(3, ack['mySeat'])
+        self.assertFalse(room.started)
+        self.assertEqual([], players[3].socket.events('startData'))
+        self.assertEqual([[room.num]], players[0].socket.events('roomFull'))
+
+        self.settle()
+        self.assertTrue(room.started)
+        for seat, ns in enumerate(players):
+            startData = ns.socket.events('startData')
+            self.assertEqual(1, len(startData))
+            self.assertEqual(seat, startData[0][0]['tgt'])
+
+class RoomBotTests(ServerTestCase):
+    def testDelivery(self):
+        """hosted agents should get game messages and post their moves"""
+        class RecordingAI(object):
+            def __init__(self, room, seat, ns):
+                self.ns = ns
+                self.label = 'bot%d' % seat
+                self.got, self.errs = [], []
+                self.stopped = False
+            def handle_game_action(self, msg):
+                self.got.append(msg)
+            def on_err(self, msg):
+                self.errs.append(msg)
+            def stop(self):
+                self.stopped = True
+
+        room = self.rooms.create()
+        human = self.connect('a')
+        human.on_exit()
+        human.on_join(room.num, 0)
+        bot = room.addBot(2, RecordingAI)
+        self.assertEqual([1, 3], room.getAvailableSeats())
+        self.assertIn(('bot2', 2), room.getSeatingChart())
+
+        room.emit('bid', {'actvP': 2})
+        room.emit('chat', ['a', 'hi'])  # Not a game message
+        room.sendTo(2, 'startData', {'tgt': 2})
+        room.sendTo(0, 'startData', {'tgt': 0})
+        room.sendTo(2, 'err', "It's not your turn")
+        self.assertEqual([{'actvP': 2}, {'tgt': 2}], bot.got)
+        self.assertEqual(["It's not your turn"], bot.errs)
+        self.assertEqual([[{'actvP': 2}]], human.socket.events('bid'))
+
+        bot.ns.emit('bid', '3')
+        bot.ns.emit('chat', 'ignored')
+        self.assertEqual([(room.applyBid, (2, 3))], list(room.inbox.queue))
+
+        room.close()
+        self.assertTrue(bot.stopped)
+
+    def testAIOnlyGame(self):
+        """a room of hosted agents should play its game to the end"""
+        from core.game import Game
+        from ai.manager import get_ai_models
+
+        room = self.rooms.create()
+        rand = get_ai_models()[0]
+        for seat in range(4):
+            room.addBot(seat, rand)
+        self.assertTrue(room.isFull())
+
+        saved, self.server.Game = self.server.Game, lambda: Game(False)
+        try:
+            room.post(room.startGame)
+            for _ in range(100):
+                if room.finished:
+                    break
+                self.settle()
+        finally:
+            self.server.Game = saved
+        self.assertTrue(room.finished)
+        self.assertIsNone(self.rooms.get(room.num))  # Retired with no users
+
+class RoomActorTests(ServerTestCase):
+    def testActionsAppliedInOrder(self):
+        """posted actions should be applied one at a time, in post order"""
+        import gevent
+        room = self.rooms.create()
+        applied = []
+
+        def slow(tag):
+            applied.append(('start', tag))
+            gevent.sleep(0.01)  # Yields; the next action must still wait
+            applied.append(('end', tag))
+
+        def broken(tag):
+            applied.append(('broken', tag))
+            raise ValueError(tag)
+
+        room.post(slow, 1)
+        room.post(broken, 2)
+        gevent.spawn(room.post, slow, 3)
+        room.post(slow, 4)
+        gevent.sleep(0.1)
+
+        self.assertEqual([('start', 1), ('end', 1), ('broken', 2),
+                          ('start', 4), ('end', 4), ('start', 3),
+                          ('end', 3)], applied)
+
+class RoomDirectoryTests(ServerTestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        ServerTestCase.setUp(self)
+        import web.shard
+        self.shard = web.shard
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.directory = web.shard.RoomDirectory(self.path)
+        self.directory.reset()
+
+    def tearDown(self):
+        import os
+        os.remove(self.path)
+        ServerTestCase.tearDown(self)
+
+    def testChangesInSeqOrder(self):
+        """changes should list each room's latest listing in write order"""
+        d = self.directory
+        listing = lambda n, x: {'num': n, 'name': 'Room %d' % n, 'x': x}
+        one = d.create(lambda n: listing(n, 0))
+        two = d.create(lambda n: listing(n, 0))
+        self.assertEqual((1, 2), (one, two))
+        self.assertTrue(d.isOpen(one))
+        self.assertFalse(d.isOpen(3))
+
+        seen = d.changes(0)[-1][2]
+        d.publish([listing(one, 1)], [])
+        d.publish([], [two])
+        changes = d.changes(seen)
+        self.assertEqual([(one, listing(one, 1)), (two, None)],
+                         [(num, x) for num, x, seq in changes])
+        self.assertTrue(changes[0][2] < changes[1][2])
+        self.assertFalse(d.isOpen(two))
+        self.assertEqual([], d.changes(changes[-1][2]))
+
+    def testFailedPublishRequeued(self):
+        """a delta the directory can't store should go out with the next"""
+        import sqlite3
+
+        class FlakyDirectory(object):
+            def __init__(self):
+                self.fail = True
+                self.published = []
+            def publish(self, listings, gone):
+                if self.fail:
+                    self.fail = False
+                    raise sqlite3.OperationalError('database is locked')
+                self.published.append(([x['num'] for x in listings], gone))
+
+        feed = self.shard.PublishingFeed(self.rooms, FlakyDirectory())
+        self.lobby = feed  # Cleaned up by tearDown
+        one, two = self.rooms.create(), self.rooms.create()
+        feed.touch(one)
+        feed.drop(two.num)
+        feed.flush()
+        self.assertEqual([], feed.directory.published)
+        self.assertEqual([one.num, two.num], list(feed.pending))
+        self.assertTrue(feed.flusher is not None)
+
+        feed.flush()
+        self.assertEqual([([one.num], [two.num])], feed.directory.published)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python2
+"""Server metrics for Cinch.
+
+This keeps simple, cheap instrumentation for web.server: a call counter and a
+latency histogram for each socket event handler and room action, plus gauges
+read on demand (live rooms, sockets, games in progress, and so on). The
+server exposes a snapshot through a localhost-only socket event and writes a
+summary line to the log periodically.
+
+Histograms use fixed buckets, so recording a sample is a single bisect and
+memory use doesn't grow with traffic. Percentiles are reported as the upper
+bound of the bucket they fall in.
+
+Samples come from greenlets and from real threads too (AI manager agents,
+the hub's threadpool), so a Metrics object guards its contents with an OS
+lock, which gevent's monkey patching leaves alone.
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+  BUCKETS (list): Upper bounds of the histogram buckets, in milliseconds.
+  REPORT_INTERVAL (int): Seconds between periodic log lines.
+  registry (Metrics): Shared metrics used by web.server.
+
+Public classes:
+  Histogram: Fixed-bucket latency histogram.
+  Metrics: Collection of named histograms and gauges.
+
+"""
+
+import time
+from bisect import bisect_left
+
+import gevent
+from gevent.monkey import get_original
+
+import logging
+log = logging.getLogger(__name__)
+
+# Constants
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+REPORT_INTERVAL = 60
+
+# A real lock, even once gevent has patched the thread module
+_allocate_lock = get_original('thread', 'allocate_lock')
+
+
+class Histogram(object):
+    """Fixed-bucket latency histogram.
+
+    Attributes:
+      counts (list): Samples per bucket. The last bucket holds everything
+        over the highest bound in BUCKETS.
+      count (int): Number of samples.
+      total (float): Sum of all samples, in milliseconds.
+      max (float): Largest sample, in milliseconds.
+
+    """
+    def __init__(self):
+        """Create an empty histogram."""
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        """Record one sample, in milliseconds."""
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """Return the bucket bound at or under which p% of samples fall.
+
+        Samples over the highest bucket bound report the largest sample.
+
+        """
+        if self.count == 0:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return float(BUCKETS[i]) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        """Return dict of count, mean, max and p50/p90/p99 in milliseconds."""
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class Metrics(object):
+    """Collection of named latency histograms and gauges.
+
+    Attributes:
+      histograms (dict): Histogram objects keyed by name.
+      gauges (dict): Functions returning a current value, keyed by name.
+      started (float): Time this collection was created or last reset.
+      reporter (Greenlet): Periodic log reporter, if running.
+
+    """
+    def __init__(self):
+        """Create an empty collection."""
+        self.gauges = dict()
+        self.reporter = None
+        self._lock = _allocate_lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all histograms. Gauges are kept."""
+        with self._lock:
+            self.histograms = dict()
+            self.started = time.time()
+
+    def record(self, name, ms):
+        """Record a latency sample for a name, in milliseconds."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].record(ms)
+
+    def timed(self, name, func, *args, **kwargs):
+        """Call func with the given args, timing it under a name.
+
+        Returns:
+          The return value of func.
+
+        """
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(name, (time.time() - start) * 1000)
+
+    def gauge(self, name, func):
+        """Register a function to be called for a gauge's current value."""
+        with self._lock:
+            self.gauges[name] = func
+
+    def snapshot(self):
+        """Return current metrics as a dict, suitable for sending as JSON.
+
+        Returns:
+          dict: `uptime` (seconds since reset), `events` (histogram summary
+            and rate per second for each name), and `gauges` (current value
+            of each gauge).
+
+        """
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            events = dict()
+            for name, hist in self.histograms.iteritems():
+                events[name] = hist.summary()
+                events[name]['rate'] = hist.count / elapsed
+            gaugeFuncs = self.gauges.items()
+
+        # Gauges are called unlocked, as they may be slow or record samples
+        gauges = dict()
+        for name, func in gaugeFuncs:
+            try:
+                gauges[name] = func()
+            except Exception:
+                log.exception('Gauge %s failed', name)
+                gauges[name] = None
+
+        return {'uptime': elapsed, 'events': events, 'gauges': gauges}
+
+    def reportLine(self):
+        """Return a one-line summary of the current metrics for the log."""
+        snap = self.snapshot()
+        gauges = ' '.join('{0}={1}'.format(k, v)
+                          for k, v in sorted(snap['gauges'].iteritems()))
+        events = ' '.join(
+            '{0}:n={1[count]},p50={1[p50]:.0f},p99={1[p99]:.0f}'.format(k, v)
+            for k, v in sorted(snap['events'].iteritems()))
+        return 'metrics {0} {1}'.format(gauges, events)
+
+    def startReporter(self, interval=REPORT_INTERVAL):
+        """Log a summary line every `interval` seconds, in a greenlet."""
+        def report():
+            while True:
+                gevent.sleep(interval)
+                log.info(self.reportLine())
+
+        if self.reporter is None:
+            self.reporter = gevent.spawn(report)
+
+
+registry = Metrics()
@@ -15,13 +15,18 @@ Attributes:
   LOBBY (int): Room number for Lobby.
   MAX_ROOM_SIZE (int): Maximum number of players allowed in a room, not
     including the Lobby.
+  LOBBY_UPDATE_INTERVAL (float): Seconds over which changes to rooms are
+    collected into one update for the Lobby.
 
 Public classes:
   Room: Organizes groups of clients with their corresponding Game object.
+  RoomRegistry: Lookup table of all open rooms, keyed by room number.
+  LobbyFeed: Versioned, batched room updates for clients in the Lobby.
   GameNamespace: SocketIO namespace used by server.
   Server: Manager for SocketIO connections.
 
 Public methods:
+  broadcast: Encode an event once and send it to a list of sockets.
   runServer: Starts SocketIO server. Blocks main thread.
 
 """
@@ -29,42 +34,81 @@ Public methods:
 # Applies gevent magic to standard sockets
 from gevent import monkey
 monkey.patch_all()
+import gevent
+from gevent.queue import Queue
 
 # This is where the websocket magic comes from
 from socketio import socketio_manage
 from socketio.server import SocketIOServer
 from socketio.namespace import BaseNamespace
 from socketio.mixins import BroadcastMixin
+from socketio import packet
 
-from threading import Timer
+from collections import OrderedDict
 
 import logging
 log = logging.getLogger(__name__)
 
 from db import parseLog
+import db.writer as writer
+from web.metrics import registry as metrics
 from core.game import Game, NUM_PLAYERS
+from ai.base import LocalNamespace
 from common import SOCKETIO_PORT, SOCKETIO_NS, db
 
 # Constants
 LOBBY = 0
 MAX_ROOM_SIZE = NUM_PLAYERS
+LOBBY_UPDATE_INTERVAL = 0.25
+
+
+def broadcast(sockets, event, args):
+    """Encode an event once and send it to a list of sockets.
+
+    The frame is encoded with the sockets' json_dumps, just as their own
+    send_packet would; all sockets of a server share the same one.
+
+    Args:
+      sockets (list): Recipient sockets.
+      event (str): Event name.
+      args (list): Event args.
+
+    """
+    if not sockets:
+        return
+    frame = packet.encode(dict(type="event", name=event, args=args,
+                               endpoint=SOCKETIO_NS), sockets[0].json_dumps)
+    for socket in sockets:
+        socket.put_client_msg(frame)
 
 
 class Room(object):
     """Container class for a game and users.
 
-    To improve data management, a Room does not directly reference players.
-    Instead, each player (socket connection) keeps their room number in their
-    session and the Room object is located on-demand. This normalizes the data
-    relationship and keeps the Room from maintaining an internal player list
-    that could get out of sync with reality.
+    Each player (socket connection) keeps their room number and seat in their
+    session. The Room also indexes its own sockets by session ID and by seat,
+    so broadcasts and seat queries cost O(room size) instead of a scan of
+    every connection on the server. The index is only changed through
+    `addUser` and `removeUser`, which GameNamespace calls whenever a session's
+    room changes, so the two can't get out of sync.
+
+    Seats can also be held by AI agents hosted in the room itself (see
+    `addBot`). These have no socket: game messages are handed straight to the
+    agent as Python objects, and the agent's bids and plays are posted to the
+    room's inbox like any other action.
 
     Attributes:
       server (Server): Pointer to active server object.
       num (int): The room ID number.
       game (core.game Game): Game object.
-      users (list of sockets): The users in the room.
+      users (dict): Sockets of the users in the room, keyed by session ID.
+      seats (dict): Sockets of seated users, keyed by seat number. Seats
+        aren't tracked in the Lobby, where everyone sits in seat 0.
+      bots (dict): In-process AI agents, keyed by seat number.
       started (boolean): If a game has been started in this room.
+      finished (boolean): If the room's game has ended.
+      inbox (Queue): Actions waiting to be applied to the room's game.
+      actor (Greenlet): Applies actions from the inbox one at a time.
 
     """
     server = None
@@ -78,7 +122,13 @@ class Room(object):
         """
         self.num = roomNum
         self.game = None
+        self.users = dict()
+        self.seats = dict()
+        self.bots = dict()
         self.started = False
+        self.finished = False
+        self.inbox = Queue()
+        self.actor = None
 
     def __str__(self):
         """Return a label for the room, with special handling for the Lobby."""
@@ -91,10 +141,128 @@ class Room(object):
         """Safely delete the Room."""
         log.debug("TODO: safely end game.")
 
+    def post(self, func, *args):
+        """Queue an action for the room's game.
+
+        All changes to a room's game go through its inbox and are applied in
+        order by the room's own actor greenlet, so actions from different
+        clients can't interleave. The actor is a greenlet on the shared
+        hub, so an action must not block: anything blocking inside it, like
+        a SQLite call or a slow bot decision, freezes every room and socket
+        in the process. Finished games are written on a thread by db.writer,
+        and slow AI models belong in an AgentPool (see ai.manager).
+
+        Args:
+          func (function): Action to apply; called as `func(*args)`.
+          args (list): Args for func.
+
+        """
+        self.inbox.put((func, args))
+        if self.actor is None:
+            self.actor = gevent.spawn(self._runActor)
+
+    def close(self):
+        """Stop the room's actor and agents. Queued actions are dropped."""
+        if self.actor is not None:
+            self.actor.kill(block=False)
+            self.actor = None
+        self._stopBots()
+
+    def retire(self):
+        """Remove the room from the server once its actor is done with it.
+
+        This is for rooms that empty out from inside the actor, such as
+        AI-only rooms when their game ends.
+
+        """
+        Server.request['rooms'].remove(self)
+        Server.request['lobby'].drop(self.num)
+        self.inbox.put(StopIteration)  # Ends the actor's loop
+        self.actor = None
+        self._stopBots()
+
+    def _stopBots(self):
+        """Stop the room's hosted agents, releasing any pooled ones."""
+        for agent in self.bots.values():
+            agent.stop()
+
+    def _runActor(self):
+        """Apply actions from the inbox in order, forever."""
+        for func, args in self.inbox:
+            try:
+                metrics.timed('room.' + func.__name__, func, *args)
+            except Exception:
+                log.exception('Error applying action in %s', self)
+
+    def addUser(self, socket, seatNum=None):
+        """Add a socket to the room's index, in a seat if one is given.
+
+        Args:
+          socket (Socket): Socket of the client joining the room.
+          seatNum (int, optional): Seat taken by the client.
+
+        """
+        self.users[socket.sessid] = socket
+        if seatNum is not None and self.num != LOBBY:
+            self.seats[seatNum] = socket
+
+    def removeUser(self, socket):
+        """Remove a socket and its seat, if any, from the room's index."""
+        self.users.pop(socket.sessid, None)
+        for seatNum, sock in self.seats.items():
+            if sock is socket:
+                del self.seats[seatNum]
+
     def getUsers(self):
         """Return list of sockets for clients in this room."""
-        return [x for x in self.server.sockets.values()
-                if 'roomNum' in x.session and x.session['roomNum'] == self.num]
+        return self.users.values()
+
+    def addBot(self, seatNum, aiClass):
+        """Seat an AI agent hosted in this room.
+
+        Args:
+          seatNum (int): Seat for the agent; assumed to be available.
+          aiClass (class): AIBase subclass to create the agent from.
+
+        Returns:
+          AIBase: The new agent.
+
+        """
+        agent = aiClass(self.num, seatNum,
+                        LocalNamespace(seatNum, self._botAction))
+        self.bots[seatNum] = agent
+        return agent
+
+    def _botAction(self, seatNum, event, *args):
+        """Post a bid or play emitted by a hosted agent; see LocalNamespace."""
+        if event == 'bid':
+            self.post(self.applyBid, seatNum, int(args[0]))
+        elif event == 'play':
+            self.post(self.applyPlay, seatNum, int(args[0]))
+
+    def sendTo(self, seatNum, event, msg):
+        """Send a message to the player in a seat, socket or hosted agent."""
+        if seatNum in self.bots:
+            self._tellBot(self.bots[seatNum], event, msg)
+        elif seatNum in self.seats:
+            self.seats[seatNum][SOCKETIO_NS].emit(event, msg)
+
+    def emit(self, event, *args):
+        """Send a message to everyone in the room, including hosted agents.
+
+        The packet is encoded once for all sockets in the room.
+
+        """
+        broadcast(self.getUsers(), event, args)
+        for agent in self.bots.values():
+            self._tellBot(agent, event, *args)
+
+    def _tellBot(self, agent, event, *args):
+        """Hand a message to a hosted agent, as its socket handlers would."""
+        if event in ('startData', 'bid', 'play'):
+            agent.handle_game_action(*args)
+        elif event == 'err':
+            agent.on_err(*args)
 
     def getUsernamesInRoom(self):
         """Return list of all users' nicknames in this room.
@@ -104,8 +272,10 @@ class Room(object):
 
         """
         names = [''] * NUM_PLAYERS
-        for sock in self.getUsers():
-            names[sock.session['seat']] = sock.session['nickname']
+        for seatNum, sock in self.seats.iteritems():
+            names[seatNum] = sock.session['nickname']
+        for seatNum, agent in self.bots.iteritems():
+            names[seatNum] = agent.label
         return names
 
     def isFull(self):
@@ -116,7 +286,7 @@ class Room(object):
         """
         if self.num == LOBBY:  # Lobby never fills
             return False
-        elif len(self.getUsers()) == MAX_ROOM_SIZE:
+        elif len(self.users) + len(self.bots) == MAX_ROOM_SIZE:
             return True
         else:
             return False
@@ -132,9 +302,8 @@ class Room(object):
         if self.num == LOBBY:
             return allSeats
         else:
-            usedSeats = [x.session['seat'] for x in self.getUsers()]
-            availableSeats = [x for x in allSeats if x not in usedSeats]
-            return availableSeats
+            return [x for x in allSeats
+                    if x not in self.seats and x not in self.bots]
 
     def getSeatingChart(self):
         """Return a seating chart for the room.
@@ -155,16 +324,21 @@ class Room(object):
 
             seatChart.append((name, seat))
 
+        for seat, agent in self.bots.iteritems():
+            seatChart.append((agent.label, seat))
+
         return seatChart
 
-    def startGame(self):
-        """Perform final player checks and start game."""
-        users = self.getUsers()
-        sock = users[0]  # Need to get reference to the namespace
+    def summary(self):
+        """Return the room's listing as shown in the Lobby."""
+        return {'name': str(self), 'num': self.num, 'isFull': self.isFull(),
+                'started': self.started, 'seatChart': self.getSeatingChart()}
 
+    def startGame(self):
+        """Perform final player checks and start game. Runs in actor."""
         # Prevent game from restarting if a full room empties and refills
         if self.started:
-            sock[SOCKETIO_NS].emit_to_room(
+            self.emit(
                 'chat',
                 ['System',
                  "This game already started, so I won't start a new one."])
@@ -174,26 +348,194 @@ class Room(object):
         if len(self.getAvailableSeats()) > 0:
             # Something has gone wrong
             log.error("bad seating error in startGame()")
-            sock[SOCKETIO_NS].emit_to_room('err', 'Problem starting game')
+            self.emit('err', 'Problem starting game')
             return
 
         # Send out the final seat chart
-        sock[SOCKETIO_NS].emit_to_room('seatChart', self.getSeatingChart())
+        self.emit('seatChart', self.getSeatingChart())
 
         self.game = Game()
         initData = self.game.start_game(self.getUsernamesInRoom())
+        self.started = True
 
         # Send initial game data to players
         log.debug("Sending initial game data in room %s", self.num)
-        sock[SOCKETIO_NS].emit_to_target_room(LOBBY, 'gameStarted', self.num)
-
-        target_sock_map = {s.session['seat']: s[SOCKETIO_NS]
-                           for s in users}
+        Server.request['lobby'].touch(self)
 
         for msg in initData:
-            target_sock_map[msg['tgt']].emit('startData', msg)
+            self.sendTo(msg['tgt'], 'startData', msg)
 
-        self.started = True
+    def joinInProgress(self, seatNum, nickname):
+        """Facilitate a player joining a game in progress. Runs in actor."""
+        if not self.started:
+            log.error("joinInProgress fired for a game not yet started")
+            return
+
+        initData = self.game.join_game_in_progress(seatNum, nickname)
+        self.sendTo(seatNum, 'startData', initData)
+
+    def applyBid(self, pNum, bid):
+        """Apply a bid to the game and send the result. Runs in actor."""
+        res = self.game.handle_bid(pNum, bid)
+        # False on bad bid, None for inactive player
+
+        if res is False:
+            self.sendTo(pNum, 'err', 'Bad bid: {0}'.format(bid))
+        elif res is None:
+            self.sendTo(pNum, 'err', "It's not your turn")
+        else:
+            self.emit('bid', res)
+
+    def applyPlay(self, pNum, play):
+        """Apply a play to the game and send the result. Runs in actor."""
+        res = self.game.handle_card_played(pNum, play)
+        # False on bad play, None for inactive player
+
+        if res is False:
+            log.debug("applyPlay: illegal play attempted in seat " + str(pNum))
+            self.sendTo(pNum, 'err', 'Bad play: {0}'.format(play))
+        elif res is None:
+            self.sendTo(pNum, 'err', "It's not your turn")
+        elif type(res) == list:
+            # Multiple messages == distinct messages; happens at end of hand
+            for msg in res:
+                self.sendTo(msg['tgt'], 'play', msg)
+        else:
+            self.emit('play', res)
+            if 'win' in res:
+                self.finished = True
+                if not self.users:  # Nobody left to leave the room
+                    self.retire()
+
+
+class RoomRegistry(object):
+    """Lookup table of all open rooms, keyed by room number.
+
+    Rooms are kept in an OrderedDict, so creating, finding and removing a room
+    all take constant time, while iterating still gives rooms in the order
+    they were created (which is also room number order).
+
+    Attributes:
+      rooms (OrderedDict): Room objects keyed by room number.
+      lastNum (int): Highest room number handed out so far.
+
+    """
+    def __init__(self):
+        """Create an empty registry."""
+        self.rooms = OrderedDict()
+        self.lastNum = LOBBY
+
+    def __iter__(self):
+        """Iterate over open rooms in order of creation."""
+        return iter(self.rooms.values())
+
+    def __len__(self):
+        """Return the number of open rooms, including the Lobby."""
+        return len(self.rooms)
+
+    def add(self, room):
+        """Register an existing Room object under its room number."""
+        self.rooms[room.num] = room
+        self.lastNum = max(self.lastNum, room.num)
+
+    def create(self):
+        """Create, register and return a Room with a new room number."""
+        room = Room(self.lastNum + 1)
+        self.add(room)
+        return room
+
+    def get(self, roomNum):
+        """Return the Room with a given room number, or None."""
+        return self.rooms.get(roomNum)
+
+    def remove(self, room):
+        """Unregister a Room. Removing an unregistered room does nothing."""
+        self.rooms.pop(room.num, None)
+
+    def liveRoomCount(self):
+        """Return the number of open game rooms, not counting the Lobby."""
+        return len(self.rooms) - (1 if LOBBY in self.rooms else 0)
+
+
+class LobbyFeed(object):
+    """Versioned, batched room updates for clients in the Lobby.
+
+    A client entering the Lobby is sent a snapshot of every room along with
+    the feed's current version. After that, rooms that change are collected
+    for LOBBY_UPDATE_INTERVAL seconds and sent to the Lobby as one
+    'lobbyDelta' holding the next version, the version it follows (`prev`),
+    the new listing of each changed room, and the numbers of rooms that are
+    gone. Several changes to one room in the same interval are sent as a
+    single listing.
+
+    Listings replace the client's copy outright, so applying a delta twice is
+    harmless. A client whose version isn't the delta's `prev` has missed an
+    update and asks for a new snapshot.
+
+    Attributes:
+      rooms (RoomRegistry): Registry of the server's open rooms.
+      version (int): Version of the most recently sent delta.
+      pending (OrderedDict): Changed Room objects (or None for a room that
+        is gone) keyed by room number, waiting to be sent.
+      flusher (Greenlet): Scheduled send of the pending changes, if any.
+
+    """
+    def __init__(self, rooms):
+        """Create a feed for the rooms in a RoomRegistry."""
+        self.rooms = rooms
+        self.version = 0
+        self.pending = OrderedDict()
+        self.flusher = None
+
+    def snapshot(self):
+        """Return every room's listing, excluding the Lobby, and the version.
+
+        Returns:
+          dict: `v` (int) is the version, `rooms` (list) is the listings.
+
+        """
+        return {'v': self.version,
+                'rooms': [x.summary() for x in self.rooms if x.num != LOBBY]}
+
+    def touch(self, room):
+        """Mark a room as changed so its listing goes out in the next delta."""
+        if room.num != LOBBY:
+            self.pending[room.num] = room
+            self._schedule()
+
+    def drop(self, roomNum):
+        """Mark a room as gone so the next delta removes it."""
+        self.pending[roomNum] = None
+        self._schedule()
+
+    def flush(self):
+        """Send all pending changes to the Lobby as one delta."""
+        self.flusher = None
+        if not self.pending:
+            return
+
+        self.version += 1
+        delta = {'v': self.version, 'prev': self.version - 1,
+                 'rooms': [], 'gone': []}
+        for roomNum, room in self.pending.iteritems():
+            if room is None:
+                delta['gone'].append(roomNum)
+            else:
+                delta['rooms'].append(room.summary())
+        self.pending.clear()
+        self.send(delta)
+
+    def send(self, delta):
+        """Send a delta to every client in the Lobby, encoded only once."""
+        lobby = self.rooms.get(LOBBY)
+        if lobby is not None:
+            broadcast(lobby.getUsers(), 'lobbyDelta', [delta])
+
+    def _schedule(self):
+        """Schedule a flush at the end of the interval, if not yet done."""
+        if self.flusher is None:
+            self.flusher = gevent.spawn_later(LOBBY_UPDATE_INTERVAL,
+                                              self.flush)
 
 
 class GameNamespace(BaseNamespace, BroadcastMixin):
@@ -206,6 +548,12 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         self.session['nickname'] = 'NewUser'
         self.session['seat'] = None
 
+    def call_method(self, method_name, packet, *args):
+        """Dispatch an incoming event, recording its latency in metrics."""
+        return metrics.timed(
+            method_name, super(GameNamespace, self).call_method,
+            method_name, packet, *args)
+
     def recv_connect(self):
         """Initialize connection for a client to this namespace.
 
@@ -302,13 +650,13 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         self.session['roomNum'] = roomNum
         if seatNum is not None:
             self.session['seat'] = seatNum
+        room = self.getRoomByNumber(roomNum)
+        room.addUser(self.socket, seatNum)
 
         # Tell others in room and lobby that someone has joined and sat down
         self.emit_to_room_not_me(
             'enter', self.session['nickname'], roomNum, seatNum)
-        if roomNum != LOBBY:
-            self.emit_to_target_room(
-                LOBBY, 'enter', self.session['nickname'], roomNum, seatNum)
+        self.request['lobby'].touch(room)
 
     def _leaveRoom(self):
         """Leave current room and announce departure to that room.
@@ -321,6 +669,10 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
             self.emit_to_room_not_me(
                 'exit', self.session['nickname'], self.session['roomNum'],
                 self.session['seat'])
+            room = self.getRoomByNumber(self.session['roomNum'])
+            if room is not None:
+                room.removeUser(self.socket)
+                self.request['lobby'].touch(room)
 
         self.session['roomNum'] = None
         self.session['seat'] = None
@@ -334,7 +686,7 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         new joins be allowed.
 
         Args:
-          roomNum (int): Index in request[rooms] for target room.
+          roomNum (int): Room number of target room.
           seatNum (int): Target seat number.
 
         """
@@ -359,33 +711,23 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
             # If the room is now full, begin or resume the game.
             if room.isFull():
                 self.emit_to_room('roomFull', roomNum)
-                self.emit_to_target_room(LOBBY, 'roomFull', roomNum)
 
-                # Without this Timer, the last person to join will receive
-                # start data before room data and will not have confirmed
-                # their seat/pNum.
+                # The last person to join must receive room data (the ack
+                # returned below) before start data, or they will not have
+                # confirmed their seat/pNum. The ack is queued as soon as
+                # this handler returns, before this greenlet yields, so the
+                # room's actor always sends start data after it.
                 if room.started:
-                    t = Timer(0.5, self.joinInProgress,
-                              [room, seatNum, self.session['nickname']])
+                    room.post(room.joinInProgress, seatNum,
+                              self.session['nickname'])
                 else:
-                    t = Timer(0.5, room.startGame)
-
-                t.start()
+                    room.post(room.startGame)
 
             log.debug('%s joined room %s.', self.session['nickname'], roomNum)
 
             return dict(roomNum=roomNum, seatChart=room.getSeatingChart(),
                         mySeat=seatNum)
 
-    def joinInProgress(self, room, seatNum, nickname):
-        """Facilitate a player joining a game in progress."""
-        if not room.started:
-            log.error("joinInProgress fired for a game not yet started")
-            return
-
-        initData = room.game.join_game_in_progress(seatNum, nickname)
-        self.emit('startData', initData)
-
     def on_exit(self):
         """Handle socket request to leave current room.
 
@@ -415,16 +757,11 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         curRoom = self.getRoomByNumber(curRoomNum)
 
         # Client is wanting to leave a game room. If room is full before user
-        # leaves, tell Lobby room is no longer full.
+        # leaves, tell the room it is no longer full. The Lobby hears about
+        # the open seat through the lobby feed.
 
         if curRoom.isFull():
             self.emit_to_room('roomNotFull', curRoomNum)
-            self.emit_to_target_room(LOBBY, 'roomNotFull', curRoomNum)
-
-        # The Lobby will want to know what seat is becoming available
-        self.emit_to_target_room(
-            LOBBY, 'exit', self.session['nickname'], curRoomNum,
-            self.session['seat'])
 
         self._leaveRoom()
 
@@ -433,7 +770,8 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         # availability to clients; this may be a memory leak. TODO investigate.
         if len(curRoom.getUsers()) == 0 and curRoomNum != LOBBY:
             self.request['rooms'].remove(curRoom)
-            self.broadcast_event('roomGone', curRoom.num)
+            curRoom.close()
+            self.request['lobby'].drop(curRoom.num)
 
         log.debug('%s left room %s; placing in lobby.',
                   self.session['nickname'], curRoomNum)
@@ -441,21 +779,17 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         self.moveToRoom(roomNum=LOBBY, seat=0)
 
     def on_room_list(self):
-        """Transmit list of available rooms and their occupants.
+        """Transmit snapshot of available rooms and their occupants.
 
-        Exclude the Lobby, because we don't want it in the list of rooms
-        to be joined. Remove `if x.num != LOBBY` if you want the Lobby to be
-        included.
+        The Lobby itself is excluded, because we don't want it in the list of
+        rooms to be joined. The snapshot carries the lobby feed's version, so
+        the client can apply later 'lobbyDelta' messages on top of it.
 
         """
-        roomList = [{'name': str(x), 'num': x.num, 'isFull': x.isFull(),
-                     'started': x.started, 'seatChart': x.getSeatingChart()}
-                    for x in self.request['rooms'] if x.num != LOBBY]
-
         # Not using callback as to support recv_connect
         # TODO: have all clients send a connection message when they start
         # instead of relying on recv_connect.
-        self.emit('rooms', roomList)
+        self.emit('rooms', self.request['lobby'].snapshot())
 
     def on_chat(self, message):
         """Transmit chat message to room, including nickname of sender.
@@ -480,27 +814,24 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
           args (dict, optional): {seat: ai_model_id, seat2: ...}
 
         """
-        # 'rooms' is list of Room objects
-        roomNum = self.request['curMaxRoomNum'] + 1
-        self.request['curMaxRoomNum'] += 1
-        newRoom = Room(roomNum)
-        self.request['rooms'].append(newRoom)  # store new room in Server
-
-        self.emit_to_target_room(
-            LOBBY, 'newRoom', {'name': str(newRoom), 'num': roomNum,
-                               'started': False, 'isFull': newRoom.isFull(),
-                               'seatChart': []})
+        roomNum = self._newRoomNumber()
 
         # Summon AI players
         try:
             for seat in args.keys():
-                self.emit_to_target_room(
-                    LOBBY, 'summonAI', {roomNum: (int(seat), int(args[seat]))})
+                self._summonAI(roomNum, int(seat), int(args[seat]))
         except AttributeError:
             pass  # No args given
 
         return roomNum  # Tells user to join room
 
+    def _newRoomNumber(self):
+        """Create a new room, list it in the Lobby and return its number."""
+        # 'rooms' is the server's RoomRegistry
+        newRoom = self.request['rooms'].create()
+        self.request['lobby'].touch(newRoom)
+        return newRoom.num
+
     def on_nickname(self, name):
         """Set nickname for user.
 
@@ -545,6 +876,11 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         else:
             return None
 
+    @localhost_only
+    def on_metrics(self):
+        """Return snapshot of server metrics. Only works from localhost."""
+        return metrics.snapshot()
+
     # --------------------
     # AI methods
     # --------------------
@@ -557,11 +893,54 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
         """Receive AI identity information from AI manager."""
         self.request['aiInfo'] = data
 
+    @localhost_only
+    def on_aiStats(self, counts):
+        """Receive AI manager's agent counts. Only works from localhost."""
+        self.request['aiStats'].update(counts)
+
     def on_summonAI(self, model, roomNum, seat):
         """Human client has requested an AI agent for a game room."""
         log.debug("AI model {0} summoned for Room {1} Seat {2}".format(
             model, roomNum, seat))
-        self.emit_to_target_room(LOBBY, 'summonAI', {roomNum: (seat, model)})
+        self._summonAI(int(roomNum), int(seat), int(model))
+
+    def _summonAI(self, roomNum, seat, model):
+        """Fill a seat with an AI agent.
+
+        If the server was given AI classes (see runServer), the agent is
+        hosted inside the Room and plays without a socket. Otherwise the AI
+        manager is asked for an agent, which connects and joins the room like
+        any other client.
+
+        Args:
+          roomNum (int): Room number of target room.
+          seat (int): Target seat number.
+          model (int): AI model ID, counting from 1.
+
+        """
+        aiClasses = self.request['aiClasses']
+        if not aiClasses:
+            self.emit_to_target_room(
+                LOBBY, 'summonAI', {roomNum: (seat, model)})
+            return
+
+        room = self.getRoomByNumber(roomNum)
+        if (room is None or seat not in room.getAvailableSeats() or
+                not 0 < model <= len(aiClasses)):
+            self.emit('err', 'Cannot seat AI model {0} in seat {1}.'.format(
+                model, seat))
+            return
+
+        agent = room.addBot(seat, aiClasses[model-1])
+        self.emit_to_target_room(roomNum, 'enter', agent.label, roomNum, seat)
+        self.request['lobby'].touch(room)
+
+        if room.isFull():
+            self.emit_to_target_room(roomNum, 'roomFull', roomNum)
+            if room.started:
+                room.post(room.joinInProgress, seat, agent.label)
+            else:
+                room.post(room.startGame)
 
     @localhost_only
     def on_aiOnlyGame(self, seatMap):
@@ -584,11 +963,17 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
     def on_bid(self, bid):
         """Relay bid to game.
 
+        The bid is applied by the room's actor; see Room.post.
+
         Args:
           bid (str): Bid amount. Must be a number.
 
         """
-        g = self.getRoomByNumber(self.session['roomNum']).game
+        room = self.getRoomByNumber(self.session.get('roomNum'))
+        if room is None or room.num == LOBBY or room.game is None:
+            # The room's actor would find no game to apply it to
+            self.emit('err', 'No game in progress; bidding not allowed.')
+            return
 
         if 'seat' in self.session:
             pNum = self.session['seat']
@@ -599,24 +984,22 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
                         self.session['nickname'], bid)
             return
 
-        res = g.handle_bid(pNum, int(bid))
-        # False on bad bid, None for inactive player
-
-        if res is False:
-            self.emit('err', 'Bad bid: {0}'.format(bid))
-        elif res is None:
-            self.emit('err', "It's not your turn")
-        else:
-            self.emit_to_room('bid', res)
+        room.post(room.applyBid, pNum, int(bid))
 
     def on_play(self, play):
         """Relay play to game.
 
+        The play is applied by the room's actor; see Room.post.
+
         Args:
           play (str): Card code. Must be a number.
 
         """
-        g = self.getRoomByNumber(self.session['roomNum']).game
+        room = self.getRoomByNumber(self.session.get('roomNum'))
+        if room is None or room.num == LOBBY or room.game is None:
+            # The room's actor would find no game to apply it to
+            self.emit('err', 'No game in progress; playing not allowed.')
+            return
 
         if 'seat' in self.session:
             pNum = self.session['seat']
@@ -627,26 +1010,7 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
                         self.session['nickname'], play)
             return
 
-        res = g.handle_card_played(pNum, int(play))
-        # False on bad play, None for inactive player
-
-        if res is False:
-            log.debug("on_play: illegal play attempted in seat " + str(pNum))
-            self.emit('err', 'Bad play: {0}'.format(play))
-        elif res is None:
-            self.emit('err', "It's not your turn")
-        else:
-            # Multiple messages == distinct messages; happens at end of hand
-            if type(res) == list:
-                target_sock_map = {s.session['seat']: s[SOCKETIO_NS]
-                                   for s in self.getRoomByNumber(
-                                       self.session['roomNum']).getUsers()}
-
-                for msg in res:
-                    target_sock_map[msg['tgt']].emit('play', msg)
-
-            else:
-                self.emit_to_room('play', res)
+        room.post(room.applyPlay, pNum, int(play))
 
     # --------------------
     # Game log methods
@@ -706,25 +1070,14 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
             identifying a method to be called when the clients respond.
 
         """
-        pkt = dict(type="event", name=event, args=args, endpoint=self.ns_name)
-
-        roomNum = self.session['roomNum']
-
-        callback = kwargs.pop('callback', None)
-        if callback:
-            # By passing 'data', we indicate that we *want* an explicit ack
-            # by the client code, not an automatic as with send().
-            pkt['ack'] = 'data'
-            pkt['id'] = msgid = self.socket._get_next_msgid()
-            self.socket._save_ack_callback(msgid, callback)
+        room = self.getRoomByNumber(self.session['roomNum'])
+        if room is None:
+            return
 
-        for sessid, socket in self.socket.server.sockets.iteritems():
-            if ('roomNum' in socket.session and
-               socket.session['roomNum'] == roomNum):
-                if socket is self.socket:
-                    continue
-                else:
-                    socket.send_packet(pkt)
+        frame = self._encodeEvent(event, args, kwargs)
+        for socket in room.getUsers():
+            if socket is not self.socket:
+                socket.put_client_msg(frame)
 
     def emit_to_target_room(self, roomNum, event, *args, **kwargs):
         """Send message to all users in a room identified by roomNum.
@@ -737,6 +1090,46 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
           kwargs (dict): This method only supports a callback kwarg,
             identifying a method to be called when the clients respond.
 
+        """
+        room = self.getRoomByNumber(roomNum)
+        if room is None:
+            return
+
+        frame = self._encodeEvent(event, args, kwargs)
+        for socket in room.getUsers():
+            socket.put_client_msg(frame)
+
+    def broadcast_event(self, event, *args):
+        """Send message to all users connected to the server.
+
+        This replaces the same-name method in socketio.mixins.BroadcastMixin
+        so that the packet is encoded only once for all recipients.
+
+        Args:
+          event (string): Command name for message.
+          args (list): Args for command specified by event.
+
+        """
+        frame = self._encodeEvent(event, args, {})
+        for socket in self.socket.server.sockets.values():
+            socket.put_client_msg(frame)
+
+    def _encodeEvent(self, event, args, kwargs):
+        """Encode an event packet for the wire, ready to send to many clients.
+
+        Sending a packet with socket.send_packet encodes it again for every
+        recipient. Broadcasts encode the packet here once instead, then write
+        the same frame to each recipient's queue.
+
+        Args:
+          event (string): Command name for message.
+          args (list): Args for command specified by event.
+          kwargs (dict): Only a callback kwarg is supported, identifying a
+            method to be called when the clients respond.
+
+        Returns:
+          str: Encoded socketio frame.
+
         """
         pkt = dict(type="event", name=event, args=args, endpoint=self.ns_name)
 
@@ -748,28 +1141,34 @@ class GameNamespace(BaseNamespace, BroadcastMixin):
             pkt['id'] = msgid = self.socket._get_next_msgid()
             self.socket._save_ack_callback(msgid, callback)
 
-        for sessid, socket in self.socket.server.sockets.iteritems():
-            if ('roomNum' in socket.session and
-               socket.session['roomNum'] == roomNum):
-                socket.send_packet(pkt)
+        return packet.encode(pkt, self.socket.json_dumps)
 
     def getRoomByNumber(self, roomNum):
         """Return Room object of a given room number."""
-        try:
-            return [x for x in self.request['rooms'] if x.num == roomNum][0]
-        except IndexError:
+        room = self.request['rooms'].get(roomNum)
+        if room is None:
             log.warning(str(roomNum) + ' is not a valid room number.')
-            return None
+        return room
 
 
 class Server(object):
     """Manages namespaces and connections while holding server-global info.
 
     Attributes:
-      request (dict): Maintains data global to all server connections.
+      request (dict): Maintains data global to all server connections. This
+        holds the RoomRegistry ('rooms'), the LobbyFeed ('lobby'), AI model
+        information ('aiInfo'), the AI manager's agent counts ('aiStats') and
+        AI classes for in-process agents ('aiClasses'), if any.
+      namespace (class): Namespace class used for client connections.
 
     """
-    request = {'rooms': [], 'curMaxRoomNum': LOBBY, 'aiInfo': dict()}
+    request = {'rooms': RoomRegistry(), 'aiInfo': dict(), 'aiStats': dict(),
+               'aiClasses': None}
+    request['lobby'] = LobbyFeed(request['rooms'])
+
+    def __init__(self, namespace=GameNamespace):
+        """Create a server whose clients use the given namespace class."""
+        self.namespace = namespace
 
     def __call__(self, environ, start_response):
         """Delegate incoming message to appropriate namespace."""
@@ -778,30 +1177,56 @@ class Server(object):
         if path.startswith("socket.io"):
             # Client should socket connect on 'http://whatever:port/cinch'
             socketio_manage(
-                environ, {SOCKETIO_NS: GameNamespace}, self.request)
+                environ, {SOCKETIO_NS: self.namespace}, self.request)
         else:
             log.error("not found " + path)
 
 
-def runServer():
+def runServer(port=SOCKETIO_PORT, namespace=GameNamespace, aiClasses=None):
     """Start socketio server.
 
     The Lobby is created during this method.
 
-    The call to serve_forever() blocks the main thread.
+    The call to serve_forever() blocks the main thread. When the server
+    stops, any finished games still queued for the database are written.
+
+    Args:
+      port (int, optional): Port to listen on.
+      namespace (class, optional): Namespace class used for client
+        connections; web.shard passes its own subclasses of GameNamespace.
+      aiClasses (list, optional): AI classes in model ID order, as loaded by
+        ai.manager.get_ai_models, or an AgentPool's factories. If given,
+        summoned AI agents are hosted in their Room instead of being
+        requested from the AI manager.
 
     """
-    log.info('Listening on port {0} for socketIO'.format(SOCKETIO_PORT))
+    log.info('Listening on port {0} for socketIO'.format(port))
 
     try:
-        server = SocketIOServer(('0.0.0.0', SOCKETIO_PORT), Server(),
+        server = SocketIOServer(('0.0.0.0', port), Server(namespace),
                                 heartbeat_timeout=120,
                                 resource="socket.io", policy_server=False)
         Room.server = server
-        server.application.request['rooms'].append(Room(LOBBY))
+        server.application.request['aiClasses'] = aiClasses
+        rooms = server.application.request['rooms']
+        rooms.add(Room(LOBBY))
+
+        metrics.gauge('rooms', rooms.liveRoomCount)
+        metrics.gauge('sockets', lambda: len(server.sockets))
+        metrics.gauge('games', lambda: len(
+            [x for x in rooms if x.started and not x.finished]))
+        metrics.gauge('writeBacklog', writer.backlog)
+        metrics.gauge('writeDropped', writer.dropped)
+        aiStats = server.application.request['aiStats']
+        for name in ['busy', 'idle', 'waiting']:
+            metrics.gauge('ai' + name.capitalize(),
+                          lambda name=name: aiStats.get(name, 0))
+        metrics.startReporter()
 
         server.serve_forever()
     except KeyboardInterrupt:
         log.info('Server halted with keyboard interrupt')
     except Exception, e:
         raise e
+    finally:
+        writer.shutdown()
@@ -0,0 +1,446 @@
+#!/usr/bin/python2
+
+"""Room sharding across several server processes.
+
+A single web.server process runs every room on one core. In sharded mode,
+game rooms are spread over a number of worker processes instead, each one a
+full web.server listening on its own port:
+
+- The lobby process listens on SOCKETIO_PORT. Clients connect here first. It
+  creates rooms, holds the Lobby, and keeps the one Lobby view of every room
+  on every worker. It never runs a game.
+- Worker `k` (counting from 0) listens on SOCKETIO_PORT + 1 + k, and hosts
+  every room whose number `n` has (n - 1) % numShards == k.
+
+When a client asks the lobby to join a game room, the lobby doesn't seat it.
+It answers with the room number and the `port` of the room's worker. The
+client then opens a second connection to that worker and joins there, keeping
+its lobby connection for Lobby updates. A worker creates its Room object when
+the first client joins. AI agents summoned from inside a room are hosted by
+the worker itself (see web.server.Room.addBot), since the AI manager is only
+connected to the lobby.
+
+The processes share state through a RoomDirectory, a small SQLite database.
+The lobby hands out room numbers from it, and workers write each room's Lobby
+listing to it. Every write gets the next sequence number, and the lobby polls
+for writes newer than the last one it saw, so the Lobby's feed versions are
+sequence numbers. A version can skip numbers, which is why deltas carry the
+version they follow (`prev`).
+
+Attributes:
+  log (Logger): Log interface common to all Cinch modules.
+  DIRECTORY_PATH (str): SQLite file of the shared RoomDirectory.
+  POLL_INTERVAL (float): Seconds between the lobby's polls of the directory.
+
+Public classes:
+  RoomDirectory: Room numbers and Lobby listings shared by all processes.
+  DirectoryFeed: Lobby feed built from the RoomDirectory (lobby process).
+  PublishingFeed: Lobby feed written to the RoomDirectory (worker process).
+  LobbyNamespace: GameNamespace for the lobby process.
+  WorkerNamespace: GameNamespace for a worker process.
+
+Public methods:
+  shard_of: Return the worker number that hosts a room.
+  shard_port: Return the port of the worker that hosts a room.
+  startWorkers: Start the worker processes.
+  runLobby: Run the lobby process's server. Blocks main thread.
+
+"""
+
+import os
+import json
+import sqlite3
+import multiprocessing
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+import logging
+log = logging.getLogger(__name__)
+
+import common
+import web.server as server
+from ai.manager import get_ai_models
+from web.server import (Room, LobbyFeed, GameNamespace, LOBBY,
+                        LOBBY_UPDATE_INTERVAL)
+from common import SOCKETIO_PORT
+
+# Constants
+DIRECTORY_PATH = os.path.join(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+    'db', 'rooms.sqlite')
+POLL_INTERVAL = LOBBY_UPDATE_INTERVAL
+
+
+def shard_of(roomNum, numShards):
+    """Return the number of the worker that hosts a game room."""
+    return (roomNum - 1) % numShards
+
+def shard_port(roomNum, numShards):
+    """Return the port of the worker that hosts a game room."""
+    return SOCKETIO_PORT + 1 + shard_of(roomNum, numShards)
+
+
+class RoomDirectory(object):
+    """Room numbers and Lobby listings shared by all processes.
+
+    Each room has one row, holding its Lobby listing as JSON and the sequence
+    number of its latest change. A room that is gone keeps its row with a
+    NULL listing, so the lobby hears about it and its number isn't reused.
+
+    SQLite calls block, so they don't run on the gevent hub. Each process
+    starts its own directory thread on first use, which opens the process's
+    connection and runs every query in order. A directory made before the
+    workers are forked is therefore safe to use in all of them. Writes take
+    the database's write lock as they begin (see `_transaction`), so
+    processes writing at once wait their turn instead of failing.
+
+    Attributes:
+      path (str): SQLite file holding the directory.
+
+    """
+    def __init__(self, path=DIRECTORY_PATH):
+        """Create a directory backed by the given SQLite file."""
+        self.path = path
+        self._conn = None
+        self._pool = None
+        self._pid = None
+
+    def _call(self, func, *args):
+        """Run func on this process's directory thread and return its result.
+
+        The calling greenlet waits, but the hub keeps running.
+
+        """
+        if self._pool is None or self._pid != os.getpid():
+            self._conn = None  # Belongs to the parent process
+            self._pool = ThreadPool(1)
+            self._pid = os.getpid()
+        return self._pool.apply(func, args)
+
+    def _connect(self):
+        """Return this process's connection. Directory thread only."""
+        if self._conn is None:
+            # No implicit BEGIN; writes begin their own, see _transaction
+            self._conn = sqlite3.connect(self.path, timeout=10,
+                                         check_same_thread=False,
+                                         isolation_level=None)
+        return self._conn
+
+    def _transaction(self):
+        """Begin a write transaction and return the connection to use in it.
+
+        BEGIN IMMEDIATE takes the write lock at once, waiting up to the
+        connection's timeout for other processes to finish. A deferred
+        transaction reading MAX(seq) before writing could instead fail
+        right away with "database is locked". Directory thread only.
+
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def reset(self):
+        """Clear the directory. Call before any server process starts.
+
+        This runs on the calling thread, so no directory thread is started
+        before the workers are forked.
+
+        """
+        conn = sqlite3.connect(self.path, timeout=10)
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS rooms')
+            conn.execute('CREATE TABLE rooms (num INTEGER PRIMARY KEY '
+                         'AUTOINCREMENT, listing TEXT, seq INTEGER)')
+            conn.execute('CREATE INDEX rooms_seq ON rooms (seq)')
+        conn.close()
+
+    def create(self, summarize):
+        """Hand out a new room number and store the room's first listing.
+
+        Args:
+          summarize (function): Called with the new room number; returns the
+            room's Lobby listing.
+
+        Returns:
+          int: The new room number.
+
+        """
+        roomNum = self._call(self._insert)
+        self._call(self._publish, [(json.dumps(summarize(roomNum)), roomNum)])
+        return roomNum
+
+    def _insert(self):
+        """Add a room row with no listing yet and return its number."""
+        with self._transaction() as conn:
+            return conn.execute(
+                'INSERT INTO rooms (listing, seq) VALUES '
+                '(NULL, (SELECT IFNULL(MAX(seq), 0) + 1 FROM rooms))'
+            ).lastrowid
+
+    def publish(self, listings, gone):
+        """Store new listings and mark rooms gone, as one change each.
+
+        Args:
+          listings (list): Lobby listings of changed rooms.
+          gone (list): Numbers of rooms that are gone.
+
+        """
+        changes = [(json.dumps(x), x['num']) for x in listings]
+        changes.extend((None, num) for num in gone)
+        self._call(self._publish, changes)
+
+    def _publish(self, changes):
+        """Store (listing JSON or None, room number) changes."""
+        with self._transaction() as conn:
+            for listing, roomNum in changes:
+                conn.execute(
+                    'UPDATE rooms SET listing = ?, '
+                    'seq = (SELECT MAX(seq) + 1 FROM rooms) WHERE num = ?',
+                    (listing, roomNum))
+
+    def isOpen(self, roomNum):
+        """Return True if a room has been created and isn't gone."""
+        return self._call(self._isOpen, roomNum)
+
+    def _isOpen(self, roomNum):
+        """Query for isOpen."""
+        row = self._connect().execute(
+            'SELECT listing FROM rooms WHERE num = ?', (roomNum,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def changes(self, since):
+        """Return rooms changed after a sequence number.
+
+        Returns:
+          list: (room number, listing or None if gone, sequence number)
+            tuples, in sequence order.
+
+        """
+        rows = self._call(self._changes, since)
+        return [(num, json.loads(listing) if listing else None, seq)
+                for num, listing, seq in rows]
+
+    def _changes(self, since):
+        """Query for changes; returns raw rows."""
+        return self._connect().execute(
+            'SELECT num, listing, seq FROM rooms WHERE seq > ? ORDER BY seq',
+            (since,)).fetchall()
+
+
+class DirectoryFeed(LobbyFeed):
+    """Lobby feed built from the RoomDirectory, used by the lobby process.
+
+    The feed polls the directory and keeps its own copy of every listing, so
+    a snapshot always matches the version that the next delta follows.
+
+    Attributes:
+      directory (RoomDirectory): Shared room directory.
+      listings (dict): Current Lobby listing of each open room, keyed by
+        room number.
+      poller (Greenlet): Polls the directory, once started.
+
+    """
+    def __init__(self, rooms, directory):
+        """Create a feed for the rooms listed in a RoomDirectory."""
+        LobbyFeed.__init__(self, rooms)
+        self.directory = directory
+        self.listings = dict()
+        self.poller = None
+
+    def snapshot(self):
+        """Return every room's listing and the version, from the local copy."""
+        return {'v': self.version,
+                'rooms': [self.listings[num] for num in sorted(self.listings)]}
+
+    def touch(self, room):
+        """Ignore local changes; rooms are listed by their workers."""
+        pass
+
+    def drop(self, roomNum):
+        """Ignore local changes; rooms are listed by their workers."""
+        pass
+
+    def start(self):
+        """Start polling the directory, in a greenlet."""
+        def poll():
+            while True:
+                try:
+                    self.poll()
+                except Exception:
+                    log.exception('Failed to poll room directory')
+                gevent.sleep(POLL_INTERVAL)
+
+        if self.poller is None:
+            self.poller = gevent.spawn(poll)
+
+    def poll(self):
+        """Send the Lobby a delta of the rooms changed since the last poll."""
+        changes = self.directory.changes(self.version)
+        if not changes:
+            return
+
+        delta = {'v': changes[-1][2], 'prev': self.version,
+                 'rooms': [], 'gone': []}
+        for roomNum, listing, seq in changes:
+            if listing is None:
+                # Rooms also have no listing for a moment while created
+                if self.listings.pop(roomNum, None) is not None:
+                    delta['gone'].append(roomNum)
+            else:
+                self.listings[roomNum] = listing
+                delta['rooms'].append(listing)
+        self.version = delta['v']
+        self.send(delta)
+
+
+class PublishingFeed(LobbyFeed):
+    """Lobby feed written to the RoomDirectory, used by a worker process.
+
+    Changes are batched just like a LobbyFeed's, but each batch is written to
+    the directory instead of being sent to the worker's own Lobby, which no
+    client watches. A batch that can't be written is kept for the next one.
+
+    Attributes:
+      directory (RoomDirectory): Shared room directory.
+
+    """
+    def __init__(self, rooms, directory):
+        """Create a feed publishing a RoomRegistry's rooms to a directory."""
+        LobbyFeed.__init__(self, rooms)
+        self.directory = directory
+
+    def send(self, delta):
+        """Write a delta's listings to the directory, or requeue them."""
+        try:
+            self.directory.publish(delta['rooms'], delta['gone'])
+        except Exception:
+            log.exception('Failed to publish rooms to directory; will retry')
+            # Changes made since the delta was built are newer; keep those
+            for listing in delta['rooms']:
+                self.pending.setdefault(listing['num'],
+                                        self.rooms.get(listing['num']))
+            for roomNum in delta['gone']:
+                self.pending.setdefault(roomNum, None)
+            self._schedule()
+
+
+class LobbyNamespace(GameNamespace):
+    """GameNamespace for the lobby process.
+
+    Attributes:
+      numShards (int): Number of worker processes.
+
+    """
+    numShards = 1
+
+    def _newRoomNumber(self):
+        """Create a new room in the directory and return its number."""
+        return self.request['directory'].create(lambda n: Room(n).summary())
+
+    def on_join(self, roomNum, seatNum):
+        """Join the Lobby, or send the client to the worker of a game room.
+
+        Returns:
+          dict: For a game room, `roomNum`, `mySeat` (the seat asked for) and
+            the `port` of the worker to join it on. The client isn't moved.
+
+        """
+        roomNum = int(roomNum)  # Arg `roomNum` is sent as unicode from browser
+        if roomNum == LOBBY:
+            return GameNamespace.on_join(self, roomNum, seatNum)
+
+        if not self.request['directory'].isOpen(roomNum):
+            self.emit('err', 'That room does not exist.')
+            return
+
+        return dict(roomNum=roomNum, mySeat=seatNum,
+                    port=shard_port(roomNum, self.numShards))
+
+
+class WorkerNamespace(GameNamespace):
+    """GameNamespace for a worker process.
+
+    Attributes:
+      shard (int): Number of this worker.
+      numShards (int): Number of worker processes.
+
+    """
+    shard = 0
+    numShards = 1
+
+    def recv_connect(self):
+        """Don't send a room list; clients get theirs from the lobby."""
+        pass
+
+    def on_join(self, roomNum, seatNum):
+        """Join a room hosted by this worker, creating it on first join."""
+        roomNum = int(roomNum)  # Arg `roomNum` is sent as unicode from browser
+        rooms = self.request['rooms']
+        if (roomNum != LOBBY and rooms.get(roomNum) is None and
+                shard_of(roomNum, self.numShards) == self.shard and
+                self.request['directory'].isOpen(roomNum) and
+                rooms.get(roomNum) is None):  # Checked again after waiting
+            rooms.add(Room(roomNum))
+
+        return GameNamespace.on_join(self, roomNum, seatNum)
+
+    def on_createRoom(self, args):
+        """Refuse to create rooms; only the lobby process does that."""
+        self.emit('err', 'Rooms are created in the Lobby.')
+
+
+def _runWorker(shard, numShards):
+    """Run the server for one worker process. Blocks."""
+    # Don't share the parent's database connection across the fork
+    common.db._adapter.connection = None
+    common.db._adapter.reconnect()
+
+    request = server.Server.request
+    request['directory'] = RoomDirectory()
+    request['lobby'] = PublishingFeed(request['rooms'], request['directory'])
+
+    WorkerNamespace.shard = shard
+    WorkerNamespace.numShards = numShards
+    server.runServer(port=SOCKETIO_PORT + 1 + shard,
+                     namespace=WorkerNamespace, aiClasses=get_ai_models())
+
+def startWorkers(numShards):
+    """Clear the room directory and start the worker processes.
+
+    This must run before any greenlets or threads are started, since they
+    would be copied into every worker.
+
+    Args:
+      numShards (int): Number of worker processes.
+
+    Returns:
+      list: The worker Process objects.
+
+    """
+    RoomDirectory().reset()
+
+    workers = []
+    for shard in range(numShards):
+        worker = multiprocessing.Process(target=_runWorker,
+                                         args=(shard, numShards),
+                                         name='CinchShard{0}'.format(shard))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    return workers
+
+def runLobby(numShards):
+    """Run the server for the lobby process. Blocks main thread.
+
+    Args:
+      numShards (int): Number of worker processes started by startWorkers.
+
+    """
+    request = server.Server.request
+    request['directory'] = RoomDirectory()
+    request['lobby'] = DirectoryFeed(request['rooms'], request['directory'])
+    request['lobby'].start()
+
+    LobbyNamespace.numShards = numShards
+    server.runServer(namespace=LobbyNamespace)